@@ -0,0 +1,41 @@
+"""add full-text search to contacts
+
+Revision ID: 1025798ccce5
+Revises: b2048d64a6e5
+Create Date: 2026-10-18 18:02:41.873310
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "1025798ccce5"
+down_revision: Union[str, None] = "b2048d64a6e5"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # 'simple' does no stemming, names are matched as written; notes rank
+    # below names
+    op.execute("""
+        ALTER TABLE contacts ADD COLUMN search tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('simple', coalesce(first, '')), 'A')
+            || setweight(to_tsvector('simple', coalesce(last, '')), 'A')
+            || setweight(to_tsvector('simple', coalesce(notes, '')), 'C')
+        ) STORED
+        """)
+    op.create_index(
+        "ix_contacts_search",
+        "contacts",
+        ["search"],
+        postgresql_using="gin",
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_contacts_search", table_name="contacts")
+    op.drop_column("contacts", "search")
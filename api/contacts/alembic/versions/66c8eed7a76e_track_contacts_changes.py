@@ -0,0 +1,113 @@
+"""track changes of contacts
+
+Revision ID: 66c8eed7a76e
+Revises: d09f777557cc
+Create Date: 2026-10-18 20:03:47.118264
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "66c8eed7a76e"
+down_revision: Union[str, None] = "d09f777557cc"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # every insert, update and delete of a contact takes the next value and
+    # records its transaction in "changeXid", CHANGES in repository reads
+    # the changes in that order
+    op.execute("CREATE SEQUENCE contacts_change_seq")
+    op.add_column(
+        "contacts",
+        sa.Column(
+            "changeSeq",
+            sa.BigInteger(),
+            nullable=False,
+            server_default=sa.text("nextval('contacts_change_seq')"),
+        ),
+    )
+    op.execute("""
+        ALTER SEQUENCE contacts_change_seq OWNED BY contacts."changeSeq"
+        """)
+    op.execute("""
+        ALTER TABLE contacts ADD COLUMN "changeXid" xid8 NOT NULL
+        DEFAULT pg_current_xact_id()
+        """)
+    op.create_index(
+        "ix_contacts_change",
+        "contacts",
+        ["changeXid", "changeSeq"],
+    )
+    op.create_table(
+        "contacts_tombstones",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("changeSeq", sa.BigInteger(), nullable=False),
+        sa.Column("deletedAt", sa.DateTime(), nullable=False),
+    )
+    op.execute("""
+        ALTER TABLE contacts_tombstones ADD COLUMN "changeXid" xid8 NOT NULL
+        """)
+    op.create_index(
+        "ix_contacts_tombstones_change",
+        "contacts_tombstones",
+        ["changeXid", "changeSeq"],
+    )
+    op.execute("""
+        CREATE OR REPLACE FUNCTION contacts_touch() RETURNS trigger AS $$
+        BEGIN
+            NEW.version := OLD.version + 1;
+            NEW."updatedAt" := now() AT TIME ZONE 'UTC';
+            NEW."changeSeq" := nextval('contacts_change_seq');
+            NEW."changeXid" := pg_current_xact_id();
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """)
+    op.execute("""
+        CREATE FUNCTION contacts_tombstone() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO contacts_tombstones
+                (id, "changeSeq", "changeXid", "deletedAt")
+            VALUES (
+                OLD.id,
+                nextval('contacts_change_seq'),
+                pg_current_xact_id(),
+                now() AT TIME ZONE 'UTC'
+            )
+            ON CONFLICT (id) DO UPDATE SET
+                "changeSeq" = EXCLUDED."changeSeq",
+                "changeXid" = EXCLUDED."changeXid",
+                "deletedAt" = EXCLUDED."deletedAt";
+            RETURN OLD;
+        END
+        $$ LANGUAGE plpgsql
+        """)
+    op.execute("""
+        CREATE TRIGGER contacts_tombstone AFTER DELETE ON contacts
+        FOR EACH ROW EXECUTE FUNCTION contacts_tombstone()
+        """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER contacts_tombstone ON contacts")
+    op.execute("DROP FUNCTION contacts_tombstone()")
+    op.execute("""
+        CREATE OR REPLACE FUNCTION contacts_touch() RETURNS trigger AS $$
+        BEGIN
+            NEW.version := OLD.version + 1;
+            NEW."updatedAt" := now() AT TIME ZONE 'UTC';
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """)
+    op.drop_table("contacts_tombstones")
+    op.drop_index("ix_contacts_change", table_name="contacts")
+    op.drop_column("contacts", "changeXid")
+    op.drop_column("contacts", "changeSeq")
@@ -0,0 +1,48 @@
+"""index contacts by createdAt
+
+Revision ID: b2048d64a6e5
+Revises: ee3ba0b8ba14
+Create Date: 2026-10-18 17:30:12.204518
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "b2048d64a6e5"
+down_revision: Union[str, None] = "ee3ba0b8ba14"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # keyset pagination compares ("createdAt", id), which skips NULLs
+    op.execute(
+        "UPDATE contacts SET \"createdAt\" = now() AT TIME ZONE 'UTC'"
+        + ' WHERE "createdAt" IS NULL'
+    )
+    op.alter_column(
+        "contacts",
+        "createdAt",
+        nullable=False,
+        server_default=sa.text("(now() AT TIME ZONE 'UTC')"),
+    )
+    op.create_index(
+        "ix_contacts_created_at_id",
+        "contacts",
+        ["createdAt", "id"],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_contacts_created_at_id", table_name="contacts")
+    op.alter_column(
+        "contacts",
+        "createdAt",
+        nullable=True,
+        server_default=None,
+    )
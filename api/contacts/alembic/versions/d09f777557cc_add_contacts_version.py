@@ -0,0 +1,78 @@
+"""add version and updatedAt to contacts
+
+Revision ID: d09f777557cc
+Revises: 1025798ccce5
+Create Date: 2026-10-18 19:12:05.530921
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "d09f777557cc"
+down_revision: Union[str, None] = "1025798ccce5"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "contacts",
+        sa.Column(
+            "version",
+            sa.Integer(),
+            nullable=False,
+            server_default=sa.text("1"),
+        ),
+    )
+    op.add_column(
+        "contacts",
+        sa.Column(
+            "updatedAt",
+            sa.DateTime(),
+            nullable=False,
+            server_default=sa.text("(now() AT TIME ZONE 'UTC')"),
+        ),
+    )
+    op.execute('UPDATE contacts SET "updatedAt" = "createdAt"')
+    # every writer (single, batch, import) goes through the trigger; an
+    # update that changes nothing keeps the version, and so the ETag
+    op.execute("""
+        CREATE FUNCTION contacts_touch() RETURNS trigger AS $$
+        BEGIN
+            NEW.version := OLD.version + 1;
+            NEW."updatedAt" := now() AT TIME ZONE 'UTC';
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """)
+    op.execute("""
+        CREATE TRIGGER contacts_touch BEFORE UPDATE ON contacts
+        FOR EACH ROW WHEN (
+            (OLD.first, OLD.last, OLD.avatar, OLD.twitter, OLD.notes,
+                OLD.favorite)
+            IS DISTINCT FROM
+            (NEW.first, NEW.last, NEW.avatar, NEW.twitter, NEW.notes,
+                NEW.favorite)
+        )
+        EXECUTE FUNCTION contacts_touch()
+        """)
+    # conditional requests read the version with an index-only scan
+    op.create_index(
+        "ix_contacts_id_version",
+        "contacts",
+        ["id"],
+        postgresql_include=["version", "updatedAt"],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_contacts_id_version", table_name="contacts")
+    op.execute("DROP TRIGGER contacts_touch ON contacts")
+    op.execute("DROP FUNCTION contacts_touch()")
+    op.drop_column("contacts", "updatedAt")
+    op.drop_column("contacts", "version")
@@ -0,0 +1,60 @@
+"""Latency of a sync of many edits, one statement per edit and batched.
+
+Each sync creates and updates ``--size / 2`` contacts. Everything happens
+in a transaction that is rolled back at the end, so the database is left
+as it was. Runs against the Postgres of compose.yml migrated with
+`alembic upgrade head`. Over a network each statement also pays a round
+trip, which this local measurement leaves out.
+
+    poetry run python -m benchmarks.bench_batch
+"""
+
+import argparse
+
+import contacts.repository
+
+from .common import connect, measure, report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--size", type=int, default=100)
+    parser.add_argument("-n", "--iterations", type=int, default=100)
+    args = parser.parse_args()
+
+    half = args.size // 2
+    creates = [{"first": f"first{i}", "notes": "synced"} for i in range(half)]
+    conn = connect()
+    try:
+        with conn.cursor() as cur:
+            ids = [
+                contact["id"]
+                for contact in contacts.repository.create_contacts(
+                    cur,
+                    creates,
+                )
+            ]
+            updates = {int(id): {"favorite": True} for id in ids}
+
+            def each():
+                for data in creates:
+                    contacts.repository.create_contact(cur, data)
+                for id, data in updates.items():
+                    contacts.repository.update_contact(cur, id, data)
+
+            def batch():
+                contacts.repository.create_contacts(cur, creates)
+                contacts.repository.update_contacts(cur, updates)
+
+            report(
+                f"statement per edit ({half * 2})",
+                measure(each, args.iterations),
+            )
+            report("batch (2)", measure(batch, args.iterations))
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Time for a client to catch up by re-listing and by reading changes.
+
+Seeds the contacts table with synthetic rows, changes a few of them and
+reads either every page of the list or only the changes since the seed.
+Changes are only read once they are committed, so the rows are committed
+and deleted again at the end. Runs against the Postgres of compose.yml
+migrated with `alembic upgrade head`.
+
+    poetry run python -m benchmarks.bench_changes
+"""
+
+import argparse
+
+import contacts.repository
+
+from .common import connect, measure, report
+
+PAGE_SIZE = 200
+
+
+def seed(cur, rows):
+    cur.execute(
+        """
+        INSERT INTO contacts (first, last, notes, favorite, "createdAt")
+        SELECT
+            'first' || i,
+            'last' || i,
+            md5(i::text),
+            i %% 7 = 0,
+            timestamp '2024-01-01' + i * interval '1 second'
+        FROM generate_series(1, %s) AS i
+        """,
+        (rows,),
+    )
+    cur.execute("ANALYZE contacts")
+
+
+def relist(cur):
+    after = None
+    while True:
+        _, after = contacts.repository.list_contacts(cur, PAGE_SIZE, after)
+        if after is None:
+            break
+
+
+def catch_up(cur, since):
+    more = True
+    while more:
+        _, _, since, more = contacts.repository.list_changes(
+            cur,
+            since,
+            PAGE_SIZE,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--rows", type=int, default=100_000)
+    parser.add_argument("-c", "--changes", type=int, default=100)
+    parser.add_argument("-n", "--iterations", type=int, default=10)
+    args = parser.parse_args()
+
+    conn = connect()
+    with conn.cursor() as cur:
+        cur.execute("SELECT coalesce(max(id), 0) FROM contacts")
+        (first,) = cur.fetchone()
+    try:
+        with conn.cursor() as cur:
+            seed(cur, args.rows)
+            conn.commit()
+            cur.execute(
+                'SELECT "changeXid", "changeSeq" FROM contacts'
+                + ' ORDER BY "changeXid" DESC, "changeSeq" DESC LIMIT 1'
+            )
+            xid, seq = cur.fetchone()
+            since = (int(xid), seq)
+            cur.execute(
+                "UPDATE contacts SET favorite = NOT favorite"
+                + " WHERE id > %s AND (id - %s) %% (%s / %s) = 0",
+                (first, first, args.rows, args.changes),
+            )
+            changed = cur.rowcount
+            conn.commit()
+            report(
+                f"re-list ({args.rows} rows)",
+                measure(lambda: relist(cur), args.iterations),
+            )
+            report(
+                f"changes ({changed} rows)",
+                measure(lambda: catch_up(cur, since), args.iterations),
+            )
+    finally:
+        conn.rollback()
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM contacts WHERE id > %s", (first,))
+            cur.execute(
+                "DELETE FROM contacts_tombstones WHERE id > %s",
+                (first,),
+            )
+        conn.commit()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Cost of answering a re-fetch with the contact and with 304.
+
+Seeds the contacts table with synthetic rows inside a transaction that is
+rolled back at the end, so the database is left as it was. Runs against
+the Postgres of compose.yml migrated with `alembic upgrade head`.
+
+    poetry run python -m benchmarks.bench_etag
+"""
+
+import argparse
+import json
+import random
+
+import contacts.repository
+
+from .common import connect, measure, report
+
+
+def seed(cur, rows) -> list[int]:
+    """Insert synthetic rows and return their ids.
+
+    The rows are rolled back at the end but the id sequence is not, so the
+    ids differ from run to run.
+    """
+    cur.execute(
+        """
+        INSERT INTO contacts (first, last, avatar, notes, favorite)
+        SELECT
+            'first' || i,
+            'last' || i,
+            'https://example.com/avatars/' || md5(i::text) || '.png',
+            repeat(md5(i::text), 8),
+            i %% 7 = 0
+        FROM generate_series(1, %s) AS i
+        RETURNING id
+        """,
+        (rows,),
+    )
+    ids = [id for (id,) in cur.fetchall()]
+    cur.execute("ANALYZE contacts")
+    return ids
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--rows", type=int, default=100_000)
+    parser.add_argument("-n", "--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    conn = connect()
+    try:
+        with conn.cursor() as cur:
+            # rows written in this transaction are not all-visible yet, so
+            # the index-only scan still visits the heap here; after a
+            # (auto)vacuum it does not
+            ids = random.sample(seed(cur, args.rows), min(1000, args.rows))
+            contact = contacts.repository.get_contact(cur, ids[0])
+            assert contact is not None
+            print(f"contact body: {len(json.dumps(contact))} bytes")
+            report(
+                "GET (200)",
+                measure(
+                    lambda: contacts.repository.get_contact(
+                        cur,
+                        random.choice(ids),
+                    ),
+                    args.iterations,
+                ),
+            )
+            report(
+                "If-None-Match (304)",
+                measure(
+                    lambda: contacts.repository.get_version(
+                        cur,
+                        random.choice(ids),
+                    ),
+                    args.iterations,
+                ),
+            )
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
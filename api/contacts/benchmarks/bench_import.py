@@ -0,0 +1,97 @@
+"""Time to import contacts with COPY compared to one INSERT per row.
+
+Every run happens in a transaction that is rolled back, so the database
+is left as it was. Runs against the Postgres of compose.yml migrated with
+`alembic upgrade head`.
+
+    poetry run python -m benchmarks.bench_import
+"""
+
+import argparse
+import io
+import json
+import time
+
+import contacts.importer
+import contacts.repository
+
+from .common import connect
+
+
+def records(rows):
+    for i in range(rows):
+        yield {
+            "first": f"first{i}",
+            "last": f"last{i}",
+            "twitter": f"@user{i}",
+            "notes": f"imported contact {i}",
+            "favorite": i % 7 == 0,
+        }
+
+
+def to_csv(rows) -> bytes:
+    lines = ["first,last,twitter,notes,favorite"]
+    for record in records(rows):
+        lines.append(",".join(str(value) for value in record.values()))
+    return "\n".join(lines).encode()
+
+
+def to_ndjson(rows) -> bytes:
+    return "\n".join(json.dumps(record) for record in records(rows)).encode()
+
+
+def timed(conn, label, rows, func):
+    try:
+        with conn.cursor() as cur:
+            start = time.perf_counter()
+            func(cur)
+            elapsed = time.perf_counter() - start
+    finally:
+        conn.rollback()
+    print(
+        f"{label:<32} rows={rows:<8} {elapsed:8.3f}s"
+        + f" {rows / elapsed:12,.0f} rows/s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--rows", type=int, default=100_000)
+    args = parser.parse_args()
+
+    csv_data = to_csv(args.rows)
+    ndjson_data = to_ndjson(args.rows)
+    conn = connect()
+    try:
+        timed(
+            conn,
+            "COPY (csv)",
+            args.rows,
+            lambda cur: contacts.importer.import_contacts(
+                cur,
+                io.BytesIO(csv_data),
+                "csv",
+            ),
+        )
+        timed(
+            conn,
+            "COPY (ndjson)",
+            args.rows,
+            lambda cur: contacts.importer.import_contacts(
+                cur,
+                io.BytesIO(ndjson_data),
+                "ndjson",
+            ),
+        )
+
+        def insert_each(cur):
+            for record in records(args.rows):
+                contacts.repository.create_contact(cur, record)
+
+        timed(conn, "INSERT per row (prepared)", args.rows, insert_each)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
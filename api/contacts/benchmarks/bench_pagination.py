@@ -0,0 +1,102 @@
+"""Latency of deep pages with OFFSET and with the keyset cursor.
+
+Seeds the contacts table with synthetic rows inside a transaction that is
+rolled back at the end, so the database is left as it was. Runs against
+the Postgres of compose.yml migrated with `alembic upgrade head`.
+
+    poetry run python -m benchmarks.bench_pagination
+"""
+
+import argparse
+
+import contacts.repository
+
+from .common import connect, measure, report
+
+PAGE_SIZE = 50
+
+
+def seed(cur, rows):
+    cur.execute(
+        """
+        INSERT INTO contacts (first, last, notes, favorite, "createdAt")
+        SELECT
+            'first' || i,
+            'last' || i,
+            md5(i::text),
+            i %% 7 = 0,
+            timestamp '2024-01-01' + i * interval '1 second'
+        FROM generate_series(1, %s) AS i
+        """,
+        (rows,),
+    )
+    cur.execute("ANALYZE contacts")
+
+
+def offset_page(cur, depth):
+    cur.execute(
+        f"SELECT {contacts.repository.COLUMNS} FROM contacts"
+        + ' ORDER BY "createdAt", id LIMIT %s OFFSET %s',
+        (PAGE_SIZE, depth),
+    )
+    return cur.fetchall()
+
+
+def key_at(cur, depth):
+    cur.execute(
+        'SELECT "createdAt", id FROM contacts'
+        + ' ORDER BY "createdAt", id OFFSET %s LIMIT 1',
+        (depth - 1,),
+    )
+    created_at, id = cur.fetchone()
+    return [created_at.isoformat(), id]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--rows", type=int, default=1_000_000)
+    parser.add_argument("-n", "--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    conn = connect()
+    try:
+        with conn.cursor() as cur:
+            seed(cur, args.rows)
+            depths = [0] + [
+                depth
+                for depth in [1_000, 10_000, 100_000, args.rows - PAGE_SIZE]
+                if 0 < depth < args.rows
+            ]
+            for depth in depths:
+                report(
+                    f"offset {depth}",
+                    measure(
+                        lambda: cur.execute(
+                            f"SELECT {contacts.repository.COLUMNS}"
+                            + ' FROM contacts ORDER BY "createdAt", id'
+                            + " LIMIT %s OFFSET %s",
+                            (PAGE_SIZE, depth),
+                        )
+                        or cur.fetchall(),
+                        args.iterations,
+                    ),
+                )
+                after = key_at(cur, depth) if depth else None
+                report(
+                    f"keyset {depth}",
+                    measure(
+                        lambda: contacts.repository.list_contacts(
+                            cur,
+                            PAGE_SIZE,
+                            after,
+                        ),
+                        args.iterations,
+                    ),
+                )
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
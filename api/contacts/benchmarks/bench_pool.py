@@ -0,0 +1,83 @@
+"""Per-request latency of the contacts handler with and without pooling.
+
+Both time GET /contacts. "before" opens a new connection for every
+request, like the handler did before the connection manager, and "after"
+reuses the connection of the warm container. Runs against the Postgres of
+compose.yml migrated with `alembic upgrade head`.
+
+    docker compose up -d db
+    poetry run python -m benchmarks.bench_pool
+"""
+
+import argparse
+import os
+import unittest.mock
+
+import boto3
+
+import contacts
+import contacts.db
+from tests.database import ENVIRON
+
+from .common import measure, report
+
+# GET /contacts, the first page of the contact list
+EVENT = {
+    "rawPath": "/contacts",
+    "requestContext": {"http": {"method": "GET"}},
+    "queryStringParameters": {"limit": "10"},
+}
+
+
+def list_contacts():
+    response = contacts.handler(EVENT, None)
+    assert response["statusCode"] == 200, response
+
+
+def list_contacts_without_pool():
+    contacts.db.reset_connection_manager()
+    list_contacts()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--iterations", type=int, default=500)
+    args = parser.parse_args()
+
+    with unittest.mock.patch.dict(os.environ, ENVIRON):
+        before = measure(list_contacts_without_pool, args.iterations)
+        list_contacts()
+        after = measure(list_contacts, args.iterations)
+        contacts.db.reset_connection_manager()
+
+    report("before (connect per request)", before)
+    report("after (connection manager)", after)
+
+    # generating an IAM token only signs locally, fake credentials will do
+    with unittest.mock.patch.dict(
+        os.environ,
+        {
+            "AWS_ACCESS_KEY_ID": "testing",
+            "AWS_SECRET_ACCESS_KEY": "testing",
+            "AWS_DEFAULT_REGION": "ap-northeast-1",
+        },
+    ):
+        rds = boto3.client("rds")
+        config = contacts.db.Config(os.environ)
+        tokens = contacts.db.AuthTokenCache(rds, config)
+        report(
+            "generate_db_auth_token",
+            measure(
+                lambda: rds.generate_db_auth_token(
+                    DBHostname=config.host,
+                    Port=config.port,
+                    DBUsername=config.user,
+                ),
+                args.iterations,
+            ),
+        )
+        report("AuthTokenCache.get", measure(tokens.get, args.iterations))
+
+
+if __name__ == "__main__":
+    main()
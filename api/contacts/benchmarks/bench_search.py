@@ -0,0 +1,71 @@
+"""Latency of ranked contact search on a large table.
+
+Seeds the contacts table with synthetic contacts, whose names are random
+hex words, inside a transaction that is rolled back at the end. Queries
+are random prefixes, so shorter prefixes match (and rank) more rows.
+Runs against the Postgres of compose.yml migrated with
+`alembic upgrade head`.
+
+    poetry run python -m benchmarks.bench_search
+"""
+
+import argparse
+import random
+
+import contacts.repository
+
+from .common import connect, measure, report
+
+PAGE_SIZE = 50
+
+
+def seed(cur, rows):
+    cur.execute(
+        """
+        INSERT INTO contacts (first, last, notes, favorite, "createdAt")
+        SELECT
+            substr(md5(i::text), 1, 6),
+            substr(md5((i * 7)::text), 1, 8),
+            substr(md5((i * 13)::text), 1, 5)
+                || ' ' || substr(md5((i * 17)::text), 1, 5),
+            false,
+            timestamp '2024-01-01' + i * interval '1 second'
+        FROM generate_series(1, %s) AS i
+        """,
+        (rows,),
+    )
+    # merge the pending list of the GIN index like autovacuum would
+    cur.execute("SELECT gin_clean_pending_list('ix_contacts_search')")
+    cur.execute("ANALYZE contacts")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--rows", type=int, default=1_000_000)
+    parser.add_argument("-n", "--iterations", type=int, default=500)
+    args = parser.parse_args()
+
+    conn = connect()
+    try:
+        with conn.cursor() as cur:
+            seed(cur, args.rows)
+            for length in [6, 4, 3]:
+
+                def search():
+                    prefix = "%x" % random.getrandbits(length * 4)
+                    query = contacts.repository.to_tsquery(
+                        prefix.zfill(length),
+                    )
+                    contacts.repository.search_contacts(cur, query, PAGE_SIZE)
+
+                report(
+                    f"search prefix of {length} chars",
+                    measure(search, args.iterations),
+                )
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import statistics
+import time
+
+from contacts.sql import PreparedConnection
+from tests.database import ENVIRON
+
+
+def connect() -> PreparedConnection:
+    """Connect to the Postgres of compose.yml."""
+    return PreparedConnection(
+        " ".join(
+            [
+                f"host={ENVIRON['DB_HOST']}",
+                f"port={ENVIRON['DB_PORT']}",
+                f"dbname={ENVIRON['DB_NAME']}",
+                f"user={ENVIRON['DB_USER']}",
+                f"password={ENVIRON['DB_PASSWORD']}",
+            ]
+        )
+    )
+
+
+def measure(func, iterations, setup=None):
+    """Call ``func`` repeatedly and return the latencies in milliseconds."""
+    samples = []
+    for _ in range(iterations):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def report(label, samples):
+    samples = sorted(samples)
+    p95 = samples[max(int(len(samples) * 0.95) - 1, 0)]
+    p99 = samples[max(int(len(samples) * 0.99) - 1, 0)]
+    print(
+        f"{label:<32} n={len(samples):<6} "
+        + f"mean={statistics.mean(samples):8.3f}ms "
+        + f"p50={statistics.median(samples):8.3f}ms "
+        + f"p95={p95:8.3f}ms "
+        + f"p99={p99:8.3f}ms"
+    )
@@ -0,0 +1,23 @@
+import base64
+import json
+
+
+class InvalidCursorException(Exception):
+    pass
+
+
+def encode(values: list) -> str:
+    """Opaque page token for the sort key of the last row of a page."""
+    data = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def decode(token: str) -> list:
+    try:
+        data = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = json.loads(data)
+    except ValueError as e:
+        raise InvalidCursorException(e) from e
+    if not isinstance(values, list):
+        raise InvalidCursorException("Invalid cursor")
+    return values
@@ -0,0 +1,217 @@
+import contextlib
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Iterator, Mapping, Optional
+
+import psycopg2
+import psycopg2.extensions
+
+from .sql import PreparedConnection
+
+logger = logging.getLogger(__name__)
+
+
+class Config(object):
+    def __init__(self, environ: Mapping[str, str]):
+        self.host = environ.get("DB_HOST", "localhost")
+        self.port = int(environ.get("DB_PORT", "5432"))
+        self.user = environ.get("DB_USER", "contacts_api")
+        self.name = environ.get("DB_NAME", "apidb")
+        # set for local runs, IAM authentication is used otherwise
+        self.password = environ.get("DB_PASSWORD")
+        self.region = environ.get("AWS_REGION")
+        self.sslrootcert = environ.get("DB_SSLROOTCERT")
+        self.connect_timeout = int(environ.get("DB_CONNECT_TIMEOUT", "5"))
+        self.ping_interval = float(
+            environ.get("DB_PING_INTERVAL_SECONDS", "30"),
+        )
+
+
+class AuthTokenCache(object):
+    """IAM authentication tokens for RDS, reused until shortly before
+    they expire.
+
+    Generating a token only signs a request locally, but it still costs a
+    credentials lookup and an HMAC chain on every invocation.
+    """
+
+    # tokens are valid for 15 minutes
+    LIFETIME = 15 * 60
+
+    def __init__(
+        self,
+        rds: Any,
+        config: Config,
+        margin: float = 2 * 60,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.__rds = rds
+        self.__config = config
+        self.__margin = margin
+        self.__clock = clock
+        self.__lock = threading.Lock()
+        self.__token: Optional[str] = None
+        self.__expires_at = 0.0
+
+    def get(self) -> str:
+        with self.__lock:
+            now = self.__clock()
+            if self.__token is None or now >= self.__expires_at:
+                self.__token = self.__rds.generate_db_auth_token(
+                    DBHostname=self.__config.host,
+                    Port=self.__config.port,
+                    DBUsername=self.__config.user,
+                    Region=self.__config.region,
+                )
+                self.__expires_at = now + self.LIFETIME - self.__margin
+            return self.__token
+
+    def invalidate(self):
+        with self.__lock:
+            self.__token = None
+
+
+class ConnectionManager(object):
+    """Keeps one database connection alive for the life of the container.
+
+    A Lambda container handles one request at a time, so a single
+    connection is enough and keeps the number of Postgres backends equal
+    to the number of warm containers. The connection is checked on
+    checkout when it has been idle for ``ping_interval`` seconds and is
+    replaced when it turns out to be broken.
+    """
+
+    def __init__(
+        self,
+        config: Config,
+        tokens: Optional[AuthTokenCache] = None,
+        connect: Callable[..., Any] = psycopg2.connect,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.__config = config
+        if tokens is None and config.password is None:
+            # boto3 only for IAM authentication, not with a password
+            import boto3
+
+            tokens = AuthTokenCache(boto3.client("rds"), config)
+        self.__tokens = tokens
+        self.__connect = connect
+        self.__clock = clock
+        self.__lock = threading.RLock()
+        self.__conn: Any = None
+        self.__used_at = 0.0
+
+    @contextlib.contextmanager
+    def connection(
+        self,
+        autocommit: bool = False,
+    ) -> Iterator[psycopg2.extensions.connection]:
+        """Check the connection out for one transaction.
+
+        The transaction is committed when the block succeeds and rolled
+        back otherwise. With ``autocommit`` every statement commits on its
+        own instead, which saves the round trips of BEGIN and COMMIT for
+        blocks that run a single statement or only read.
+        """
+        with self.__lock:
+            conn = self.__checkout()
+            conn.autocommit = autocommit
+            try:
+                yield conn
+                if not autocommit:
+                    conn.commit()
+            except BaseException:
+                self.__rollback(conn)
+                raise
+            finally:
+                self.__used_at = self.__clock()
+
+    def close(self):
+        with self.__lock:
+            if self.__conn is not None:
+                self.__conn.close()
+                self.__conn = None
+
+    def __rollback(self, conn):
+        try:
+            if not conn.closed:
+                conn.rollback()
+                return
+        except psycopg2.Error:
+            conn.close()
+        self.__conn = None
+
+    def __checkout(self):
+        conn = self.__conn
+        if conn is not None and not conn.closed:
+            idle = self.__clock() - self.__used_at
+            if idle < self.__config.ping_interval or self.__ping(conn):
+                return conn
+            logger.warning("Database connection is broken, reconnecting")
+            conn.close()
+        self.__conn = None
+        self.__conn = self.__open()
+        return self.__conn
+
+    def __ping(self, conn) -> bool:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def __open(self):
+        try:
+            return self.__connect(**self.__params())
+        except psycopg2.OperationalError as e:
+            if self.__tokens is None or "authentication failed" not in str(e):
+                raise
+            # the cached token was rejected, try once with a fresh one
+            self.__tokens.invalidate()
+            return self.__connect(**self.__params())
+
+    def __params(self) -> dict:
+        params = {
+            "host": self.__config.host,
+            "port": self.__config.port,
+            "dbname": self.__config.name,
+            "user": self.__config.user,
+            "connect_timeout": self.__config.connect_timeout,
+            "connection_factory": PreparedConnection,
+        }
+        if self.__tokens is None:
+            params["password"] = self.__config.password
+        else:
+            # IAM authentication only works over SSL
+            params["password"] = self.__tokens.get()
+            params["sslmode"] = "require"
+        if self.__config.sslrootcert:
+            params["sslmode"] = "verify-full"
+            params["sslrootcert"] = self.__config.sslrootcert
+        return params
+
+
+_lock = threading.Lock()
+_manager: Optional[ConnectionManager] = None
+
+
+def get_connection_manager() -> ConnectionManager:
+    global _manager
+    if _manager is None:
+        with _lock:
+            if _manager is None:
+                _manager = ConnectionManager(Config(os.environ))
+    return _manager
+
+
+def reset_connection_manager():
+    """Close and drop the cached manager. Intended for tests."""
+    global _manager
+    with _lock:
+        if _manager is not None:
+            _manager.close()
+        _manager = None
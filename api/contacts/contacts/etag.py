@@ -0,0 +1,39 @@
+import email.utils
+import re
+from datetime import datetime, timezone
+from typing import Optional
+
+# an entity tag is the version of the contact, "3" or W/"3"
+TAG = re.compile(r'(W/)?"([^"]*)"')
+MAX_VERSION = 2**31 - 1
+
+
+def encode(version: int) -> str:
+    return f'"{version}"'
+
+
+def parse(header: str, weak: bool) -> Optional[list[int]]:
+    """Return the versions listed in an If-Match or If-None-Match header.
+
+    None stands for ``*``, any version. Weak tags are skipped unless
+    ``weak`` (If-None-Match compares weakly, If-Match strongly) and so are
+    tags that did not come from this API.
+    """
+    if header.strip() == "*":
+        return None
+    versions = []
+    for prefix, value in TAG.findall(header):
+        if prefix and not weak:
+            continue
+        if value.isdigit() and int(value) <= MAX_VERSION:
+            versions.append(int(value))
+    return versions
+
+
+def headers(version: int, updated_at: int) -> dict:
+    """ETag and Last-Modified of a contact, updatedAt in epoch ms."""
+    modified = datetime.fromtimestamp(updated_at / 1000, timezone.utc)
+    return {
+        "ETag": encode(version),
+        "Last-Modified": email.utils.format_datetime(modified, usegmt=True),
+    }
@@ -0,0 +1,118 @@
+import csv
+import io
+import json
+from typing import Any
+
+from .repository import COLUMNS, FIELDS, to_contact
+
+# S3 takes at least 5 MiB for every part but the last
+PART_SIZE = 8 * 1024 * 1024
+ITERSIZE = 2000
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+HEADER = ["id", *FIELDS, "createdAt", "version", "updatedAt"]
+
+
+class MultipartWriter(object):
+    """Writes an S3 object as a multipart upload, one part at a time.
+
+    At most one part is held in memory, so the size of the object does not
+    matter. The upload is aborted when the block fails.
+    """
+
+    def __init__(
+        self,
+        s3: Any,
+        bucket: str,
+        key: str,
+        content_type: str,
+        part_size: int = PART_SIZE,
+    ):
+        self.__s3 = s3
+        self.__bucket = bucket
+        self.__key = key
+        self.__content_type = content_type
+        self.__part_size = part_size
+        self.__buffer = bytearray()
+        self.__parts: list[dict] = []
+        self.__upload_id = None
+        self.size = 0
+
+    def __enter__(self):
+        self.__upload_id = self.__s3.create_multipart_upload(
+            Bucket=self.__bucket,
+            Key=self.__key,
+            ContentType=self.__content_type,
+        )["UploadId"]
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.__s3.abort_multipart_upload(
+                Bucket=self.__bucket,
+                Key=self.__key,
+                UploadId=self.__upload_id,
+            )
+            return
+        # an empty export still needs one (empty) part
+        if self.__buffer or not self.__parts:
+            self.__upload_part()
+        self.__s3.complete_multipart_upload(
+            Bucket=self.__bucket,
+            Key=self.__key,
+            UploadId=self.__upload_id,
+            MultipartUpload={"Parts": self.__parts},
+        )
+
+    def write(self, data: bytes):
+        self.__buffer += data
+        self.size += len(data)
+        if len(self.__buffer) >= self.__part_size:
+            self.__upload_part()
+
+    def __upload_part(self):
+        number = len(self.__parts) + 1
+        response = self.__s3.upload_part(
+            Bucket=self.__bucket,
+            Key=self.__key,
+            UploadId=self.__upload_id,
+            PartNumber=number,
+            Body=bytes(self.__buffer),
+        )
+        self.__parts.append({"PartNumber": number, "ETag": response["ETag"]})
+        self.__buffer.clear()
+
+
+def export_contacts(conn, out, format: str) -> int:
+    """Stream every contact to ``out`` and return the number of rows.
+
+    Rows are read through a named (server-side) cursor, ``ITERSIZE`` rows
+    per round trip, so neither the driver nor this function ever holds the
+    whole table. Must run in a transaction.
+    """
+    if format not in FORMATS:
+        raise ValueError(f"Unknown format: {format}")
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    if format == "csv":
+        writer.writerow(HEADER)
+
+    rows = 0
+    with conn.cursor(name="contacts_export") as cur:
+        cur.itersize = ITERSIZE
+        cur.execute(f'SELECT {COLUMNS} FROM contacts ORDER BY "createdAt", id')
+        for row in cur:
+            if format == "csv":
+                writer.writerow(row)
+            else:
+                buffer.write(json.dumps(to_contact(row)))
+                buffer.write("\n")
+            rows += 1
+            if rows % ITERSIZE == 0:
+                out.write(buffer.getvalue().encode())
+                buffer.seek(0)
+                buffer.truncate()
+    out.write(buffer.getvalue().encode())
+    return rows
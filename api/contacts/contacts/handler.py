@@ -1,37 +1,496 @@
+import base64
+import io
+import json
+import logging
 import os
+import uuid
+from typing import TYPE_CHECKING, Any, Optional
 
-import boto3
 import psycopg2
 
+from . import cursor, etag, repository
+from .db import get_connection_manager
+
+if TYPE_CHECKING:
+    from .verifier import TokenVerifier
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+DEFAULT_CHANGES_PAGE_SIZE = 500
+MAX_CHANGES_PAGE_SIZE = 1000
+
+CSV_TYPES = ["text/csv"]
+NDJSON_TYPES = ["application/x-ndjson", "application/jsonl"]
+IMPORT_CHUNK_SIZE = 64 * 1024
+EXPORT_URL_TTL_SECONDS = 3600
+MAX_BATCH_SIZE = 100
+
+logger = logging.getLogger(__name__)
+
+_verifier: Optional["TokenVerifier"] = None
+_s3: Any = None
+
+
+def get_s3() -> Any:
+    global _s3
+    if _s3 is None:
+        # only the import and export routes talk to S3
+        import boto3
+
+        _s3 = boto3.client("s3")
+    return _s3
+
+
+def get_verifier() -> Optional["TokenVerifier"]:
+    """Verifier for the bearer token, when JWT_ISSUER is configured.
+
+    API Gateway already runs a JWT authorizer in front of this function,
+    this lets the handler check the token itself when it is invoked some
+    other way. The key set stays cached for the life of the container.
+    """
+    global _verifier
+    issuer = os.getenv("JWT_ISSUER")
+    if not issuer:
+        return None
+    if _verifier is None:
+        # jose is the largest import of the package, and only needed here
+        from .verifier import TokenVerifier
+
+        # raises ValueError without JWT_AUDIENCE, a configuration error
+        _verifier = TokenVerifier(
+            issuer,
+            [a for a in os.getenv("JWT_AUDIENCE", "").split(",") if a],
+        )
+    return _verifier
+
+
+def authorize(event) -> Optional[dict]:
+    verifier = get_verifier()
+    if verifier is None:
+        return None
+    from .verifier import InvalidTokenException
+
+    headers = event.get("headers") or {}
+    scheme, _, token = headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        return verifier.verify(token)
+    except InvalidTokenException:
+        return None
+
 
 def handler(event, context):
-    aws_region = os.getenv("AWS_REGION")
-    db_host = os.getenv("DB_HOST")
-    db_port = os.getenv("DB_POST", "5432")
-    db_user = os.getenv("DB_USER", "contacts_api")
-    db_name = os.getenv("DB_NAME", "apidb")
-
-    rds = boto3.client("rds")
-
-    token = rds.generate_db_auth_token(
-        DBHostname=db_host,
-        Port=db_port,
-        DBUsername=db_user,
-        Region=aws_region,
+    if get_verifier() is not None:
+        from .verifier import KeySetUnavailableException
+
+        try:
+            claims = authorize(event)
+        except KeySetUnavailableException as e:
+            logger.error("Cannot verify the token: %s", e)
+            return {"statusCode": 503}
+        if claims is None:
+            return {"statusCode": 401}
+
+    method = event.get("requestContext", {}).get("http", {}).get("method")
+    path = event.get("rawPath", "")
+    parts = path.strip("/").split("/")
+    if parts[0] != "contacts" or len(parts) > 3:
+        return {"statusCode": 404}
+    if len(parts) == 1:
+        if method == "GET":
+            return handler_list(event, context)
+        if method == "POST":
+            return handler_create(event, context)
+        return {"statusCode": 405}
+
+    if parts[1] == "changes" and len(parts) == 2:
+        if method == "GET":
+            return handler_changes(event, context)
+        return {"statusCode": 405}
+    if parts[1] == "import" and len(parts) == 2:
+        if method == "POST":
+            return handler_import(event, context)
+        return {"statusCode": 405}
+    if parts[1] == "batch" and len(parts) == 2:
+        if method == "POST":
+            return handler_batch(event, context)
+        return {"statusCode": 405}
+    if parts[1] == "export" and len(parts) == 2:
+        if method == "POST":
+            return handler_export(event, context)
+        return {"statusCode": 405}
+
+    id = parse_id(parts[1])
+    if id is None:
+        return {"statusCode": 404}
+    if len(parts) == 3:
+        if parts[2] != "favorite":
+            return {"statusCode": 404}
+        if method == "PUT":
+            return handler_favorite(event, context, id)
+        return {"statusCode": 405}
+    if method == "GET":
+        return handler_get(event, context, id)
+    if method == "PATCH":
+        return handler_update(event, context, id)
+    if method == "DELETE":
+        return handler_delete(event, context, id)
+    return {"statusCode": 405}
+
+
+def handler_list(event, context):
+    params = event.get("queryStringParameters") or {}
+    limit = params.get("limit", str(DEFAULT_PAGE_SIZE))
+    if not limit.isdigit() or not 1 <= int(limit) <= MAX_PAGE_SIZE:
+        return response(400, {"message": "Invalid limit"})
+    after = None
+    if "cursor" in params:
+        try:
+            after = cursor.decode(params["cursor"])
+        except cursor.InvalidCursorException:
+            return response(400, {"message": "Invalid cursor"})
+    query = repository.to_tsquery(params.get("q", ""))
+    if after is not None and not is_key(after, query is not None):
+        return response(400, {"message": "Invalid cursor"})
+
+    try:
+        with get_connection_manager().connection(autocommit=True) as conn:
+            with conn.cursor() as cur:
+                if query is None:
+                    contacts, next_key = repository.list_contacts(
+                        cur,
+                        int(limit),
+                        after,
+                    )
+                else:
+                    contacts, next_key = repository.search_contacts(
+                        cur,
+                        query,
+                        int(limit),
+                        after,
+                    )
+    except psycopg2.DataError:
+        # the token does not hold a valid timestamp
+        return response(400, {"message": "Invalid cursor"})
+    return response(
+        200,
+        {
+            "contacts": contacts,
+            "cursor": cursor.encode(next_key) if next_key else None,
+        },
+    )
+
+
+def handler_changes(event, context):
+    params = event.get("queryStringParameters") or {}
+    limit = params.get("limit", str(DEFAULT_CHANGES_PAGE_SIZE))
+    if not limit.isdigit() or not 1 <= int(limit) <= MAX_CHANGES_PAGE_SIZE:
+        return response(400, {"message": "Invalid limit"})
+    since = (0, 0)
+    if "since" in params:
+        # the cursor of the previous response, a full sync without it
+        try:
+            since = cursor.decode(params["since"])
+        except cursor.InvalidCursorException:
+            return response(400, {"message": "Invalid cursor"})
+        if not is_change(since):
+            return response(400, {"message": "Invalid cursor"})
+        since = (since[0], since[1])
+
+    with get_connection_manager().connection(autocommit=True) as conn:
+        with conn.cursor() as cur:
+            changed, deleted, last, more = repository.list_changes(
+                cur,
+                since,
+                int(limit),
+            )
+    return response(
+        200,
+        {
+            "changes": changed,
+            "deleted": deleted,
+            "cursor": cursor.encode(list(last)),
+            "more": more,
+        },
     )
 
+
+def handler_get(event, context, id):
+    headers = event.get("headers") or {}
+    with get_connection_manager().connection(autocommit=True) as conn:
+        with conn.cursor() as cur:
+            if "if-none-match" in headers:
+                current = repository.get_version(cur, id)
+                if current is None:
+                    return {"statusCode": 404}
+                versions = etag.parse(headers["if-none-match"], weak=True)
+                if versions is None or current[0] in versions:
+                    return {
+                        "statusCode": 304,
+                        "headers": etag.headers(*current),
+                    }
+            contact = repository.get_contact(cur, id)
+    if contact is None:
+        return {"statusCode": 404}
+    return contact_response(200, contact)
+
+
+def handler_create(event, context):
+    body = parse_body(event)
     try:
-        conn = psycopg2.connect(
-            host=db_host,
-            port=db_port,
-            database=db_name,
-            apidb=db_user,
-            password=token,
-            sslrootcert="SSLCERTIFICATE",
+        with get_connection_manager().connection(autocommit=True) as conn:
+            with conn.cursor() as cur:
+                contact = repository.create_contact(cur, body)
+    except repository.InvalidContactException as e:
+        return response(400, {"message": str(e)})
+    return contact_response(201, contact)
+
+
+def handler_update(event, context, id):
+    body = parse_body(event)
+    versions = if_match(event)
+    try:
+        with get_connection_manager().connection(autocommit=True) as conn:
+            with conn.cursor() as cur:
+                contact = repository.update_contact(cur, id, body, versions)
+                if contact is None:
+                    return not_written(cur, id, versions)
+    except repository.InvalidContactException as e:
+        return response(400, {"message": str(e)})
+    return contact_response(200, contact)
+
+
+def handler_favorite(event, context, id):
+    body = parse_body(event)
+    favorite = body.get("favorite") if isinstance(body, dict) else None
+    if not isinstance(favorite, bool):
+        return response(400, {"message": "Invalid value for favorite"})
+    versions = if_match(event)
+    with get_connection_manager().connection(autocommit=True) as conn:
+        with conn.cursor() as cur:
+            contact = repository.set_favorite(cur, id, favorite, versions)
+            if contact is None:
+                return not_written(cur, id, versions)
+    return contact_response(200, contact)
+
+
+def handler_batch(event, context):
+    body = parse_body(event)
+    operations = body.get("operations") if isinstance(body, dict) else None
+    if not isinstance(operations, list) or not operations:
+        return response(400, {"message": "Invalid batch request"})
+    if len(operations) > MAX_BATCH_SIZE:
+        return response(
+            400,
+            {"message": f"At most {MAX_BATCH_SIZE} operations per batch"},
         )
-        cur = conn.cursor()
-        cur.execute("""SELECT now()""")
-        query_results = cur.fetchall()
-        print(query_results)
-    except Exception as e:
-        print("Database connection failed due to {}".format(e))
+
+    # operations are grouped by kind, keyed by their index in the request
+    results = [None] * len(operations)
+    creates, updates, deletes = {}, {}, {}
+    ids = set()
+    for index, operation in enumerate(operations):
+        try:
+            op, id, data = parse_operation(operation)
+        except repository.InvalidContactException as e:
+            results[index] = {"status": 400, "message": str(e)}
+            continue
+        if op == "create":
+            creates[index] = data
+            continue
+        # with one operation per contact the order they run in is irrelevant
+        if id in ids:
+            results[index] = {"status": 400, "message": "Duplicate id"}
+            continue
+        ids.add(id)
+        if op == "update":
+            updates[index] = (id, data)
+        else:
+            deletes[index] = id
+
+    with get_connection_manager().connection() as conn:
+        with conn.cursor() as cur:
+            created = repository.create_contacts(cur, list(creates.values()))
+            updated = repository.update_contacts(cur, dict(updates.values()))
+            deleted = repository.delete_contacts(cur, list(deletes.values()))
+    for index, contact in zip(creates, created):
+        results[index] = {"status": 201, "contact": contact}
+    for index, (id, _) in updates.items():
+        if id in updated:
+            results[index] = {"status": 200, "contact": updated[id]}
+        else:
+            results[index] = {"status": 404}
+    for index, id in deletes.items():
+        results[index] = {"status": 204 if id in deleted else 404}
+    return response(200, {"results": results})
+
+
+def handler_import(event, context):
+    from . import importer
+
+    headers = event.get("headers") or {}
+    content_type = headers.get("content-type", "").split(";")[0].strip()
+    if content_type in CSV_TYPES:
+        format, lines = "csv", iter(io.BytesIO(raw_body(event)))
+    elif content_type in NDJSON_TYPES:
+        format, lines = "ndjson", iter(io.BytesIO(raw_body(event)))
+    elif content_type == "application/json":
+        # {"key": "...", "format": "csv" | "ndjson"} of an uploaded object
+        body = parse_body(event)
+        bucket = os.getenv("IMPORT_BUCKET")
+        if not bucket or not isinstance(body, dict) or "key" not in body:
+            return response(400, {"message": "Invalid import request"})
+        format = body.get("format") or body["key"].rsplit(".", 1)[-1]
+        format = "ndjson" if format == "jsonl" else format
+        import botocore.exceptions
+
+        try:
+            obj = get_s3().get_object(Bucket=bucket, Key=body["key"])
+        except botocore.exceptions.ClientError as e:
+            logger.warning("Failed to read %s: %s", body["key"], e)
+            return response(400, {"message": "Failed to read the object"})
+        lines = obj["Body"].iter_lines(IMPORT_CHUNK_SIZE, keepends=True)
+    else:
+        return {"statusCode": 415}
+
+    try:
+        with get_connection_manager().connection() as conn:
+            with conn.cursor() as cur:
+                result = importer.import_contacts(cur, lines, format)
+    except importer.InvalidImportException as e:
+        return response(400, {"message": str(e)})
+    logger.info("Imported contacts: %s", result)
+    return response(200, result)
+
+
+def handler_export(event, context):
+    from . import exporter
+
+    params = event.get("queryStringParameters") or {}
+    format = params.get("format", "ndjson")
+    if format not in exporter.FORMATS:
+        return response(400, {"message": "Invalid format"})
+    bucket = os.getenv("EXPORT_BUCKET")
+    if not bucket:
+        return {"statusCode": 501}
+
+    s3 = get_s3()
+    key = f"exports/{uuid.uuid4()}.{format}"
+    with get_connection_manager().connection() as conn:
+        with exporter.MultipartWriter(
+            s3,
+            bucket,
+            key,
+            exporter.FORMATS[format],
+        ) as out:
+            rows = exporter.export_contacts(conn, out, format)
+    logger.info("Exported %d contacts to %s (%d bytes)", rows, key, out.size)
+    ttl = os.getenv("EXPORT_URL_TTL_SECONDS", EXPORT_URL_TTL_SECONDS)
+    url = s3.generate_presigned_url(
+        "get_object",
+        Params={"Bucket": bucket, "Key": key},
+        ExpiresIn=int(ttl),
+    )
+    return response(200, {"url": url, "key": key, "rows": rows})
+
+
+def handler_delete(event, context, id):
+    versions = if_match(event)
+    with get_connection_manager().connection(autocommit=True) as conn:
+        with conn.cursor() as cur:
+            if not repository.delete_contact(cur, id, versions):
+                return not_written(cur, id, versions)
+    return {"statusCode": 204}
+
+
+def if_match(event) -> Optional[list[int]]:
+    # None writes whatever the version, like If-Match: *
+    headers = event.get("headers") or {}
+    if "if-match" not in headers:
+        return None
+    return etag.parse(headers["if-match"], weak=False)
+
+
+def not_written(cur, id: int, versions: Optional[list[int]]) -> dict:
+    # the write matched no row: the contact does not exist, or it has
+    # changed since the client read it
+    if versions is not None and repository.get_version(cur, id) is not None:
+        return {"statusCode": 412}
+    return {"statusCode": 404}
+
+
+def is_key(values: list, search: bool) -> bool:
+    # [rank, id] when searching, ["createdAt", id] otherwise, of the last
+    # contact of the previous page
+    if len(values) != 2 or not isinstance(values[1], int):
+        return False
+    if search:
+        return isinstance(values[0], (int, float))
+    return isinstance(values[0], str)
+
+
+def is_change(values: list) -> bool:
+    # ["changeXid", "changeSeq"] of the last change of the previous page,
+    # an xid8 and a bigint
+    if len(values) != 2:
+        return False
+    return all(isinstance(v, int) and 0 <= v < 2**63 for v in values)
+
+
+def parse_id(value: str) -> Optional[int]:
+    # ids are int4 serials
+    if not value.isdigit() or int(value) > 2**31 - 1:
+        return None
+    return int(value)
+
+
+def parse_operation(operation) -> tuple[str, Optional[int], dict]:
+    if not isinstance(operation, dict):
+        raise repository.InvalidContactException("Operation must be an object")
+    op = operation.get("op")
+    if op not in ("create", "update", "delete"):
+        raise repository.InvalidContactException(f"Unknown op: {op}")
+    data = {}
+    if op != "delete":
+        data = repository.validate(operation.get("contact"))
+    if op == "create":
+        return op, None, data
+    id = operation.get("id")
+    id = parse_id(id) if isinstance(id, str) else None
+    if id is None:
+        raise repository.InvalidContactException("Invalid id")
+    return op, id, data
+
+
+def raw_body(event) -> bytes:
+    body = event.get("body") or ""
+    if event.get("isBase64Encoded"):
+        return base64.b64decode(body)
+    return body.encode("utf-8")
+
+
+def parse_body(event):
+    body = raw_body(event)
+    if not body:
+        return None
+    try:
+        return json.loads(body)
+    except ValueError:
+        return None
+
+
+def response(status_code: int, body, headers: Optional[dict] = None) -> dict:
+    return {
+        "statusCode": status_code,
+        "headers": {"Content-Type": "application/json", **(headers or {})},
+        "body": json.dumps(body),
+    }
+
+
+def contact_response(status_code: int, contact: dict) -> dict:
+    return response(
+        status_code,
+        contact,
+        etag.headers(contact["version"], contact["updatedAt"]),
+    )
@@ -0,0 +1,264 @@
+import csv
+import io
+import json
+from typing import Iterable, Iterator, Optional
+
+from .repository import FIELDS, InvalidContactException, validate
+
+# the columns an import may carry, id selects the contact to update
+COLUMNS = ["id", *FIELDS]
+MAX_REJECTS = 100
+
+
+class InvalidImportException(Exception):
+    pass
+
+
+class LineStream(object):
+    """File-like object over an iterator of byte strings, for COPY."""
+
+    def __init__(self, lines: Iterable[bytes]):
+        self.__lines = iter(lines)
+        self.__buffer = b""
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self.__buffer) < size:
+            line = next(self.__lines, None)
+            if line is None:
+                break
+            self.__buffer += line
+        if size < 0:
+            size = len(self.__buffer)
+        data, self.__buffer = self.__buffer[:size], self.__buffer[size:]
+        return data
+
+    def readline(self, size: int = -1) -> bytes:
+        return self.read(size)
+
+
+def parse_header(line: bytes) -> list[str]:
+    try:
+        header = next(csv.reader([line.decode("utf-8-sig")]))
+    except (UnicodeDecodeError, StopIteration) as e:
+        raise InvalidImportException("Invalid CSV header") from e
+    unknown = set(header) - set(COLUMNS)
+    if unknown:
+        raise InvalidImportException(f"Unknown columns: {sorted(unknown)}")
+    if len(set(header)) != len(header):
+        raise InvalidImportException("Duplicate columns")
+    return header
+
+
+def csv_to_csv(lines: Iterable[bytes], header: list[str]) -> Iterator[bytes]:
+    """Rewrite CSV records as CSV rows of the staging table.
+
+    Records that do not parse or do not have a field for every column of
+    the header are kept with an error so that they are reported with the
+    other rejects, instead of failing the COPY of the whole file.
+    """
+    reader = csv.reader(
+        # undecodable bytes are kept as surrogates and rejected per row
+        (line.decode("utf-8", "surrogateescape") for line in lines),
+        strict=True,
+    )
+    return to_staging(csv_records(reader, header))
+
+
+def csv_records(reader, header: list[str]):
+    while True:
+        try:
+            fields = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            yield [None] * len(COLUMNS), f"Invalid CSV: {e}"
+            continue
+        if not fields:
+            continue
+        if len(fields) != len(header):
+            yield [None] * len(COLUMNS), "Wrong number of fields"
+            continue
+        row: list[Optional[str]] = [None] * len(COLUMNS)
+        for name, field in zip(header, fields):
+            # empty fields are NULL, as COPY reads them
+            row[COLUMNS.index(name)] = field or None
+        yield row, None
+
+
+def ndjson_to_csv(lines: Iterable[bytes]) -> Iterator[bytes]:
+    """Rewrite NDJSON lines as CSV rows of the staging table.
+
+    Lines that are not a JSON object of known fields are kept with an
+    error so that they are reported with the other rejects.
+    """
+    return to_staging(ndjson_records(lines))
+
+
+def ndjson_records(lines: Iterable[bytes]):
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield to_row(json.loads(line)), None
+        except json.JSONDecodeError:
+            yield [None] * len(COLUMNS), "Invalid JSON"
+        except ValueError as e:
+            yield [None] * len(COLUMNS), str(e)
+
+
+def to_staging(records) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    for row, error in records:
+        if error is None:
+            error = check_text(row)
+            if error is not None:
+                row = [None] * len(COLUMNS)
+        writer.writerow([*row, error])
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def check_text(row: list) -> Optional[str]:
+    # what COPY would fail the whole import on
+    for value in row:
+        if value is None:
+            continue
+        if "\x00" in value:
+            return "Invalid character"
+        try:
+            value.encode()
+        except UnicodeEncodeError:
+            return "Invalid UTF-8"
+    return None
+
+
+def to_row(record) -> list:
+    """Staging row of an NDJSON record, validated as the API does."""
+    if not isinstance(record, dict):
+        raise ValueError("Not an object")
+    record = dict(record)
+    id = record.pop("id", None)
+    if id is not None and not isinstance(id, str):
+        raise ValueError("Invalid id")
+    try:
+        validate(record)
+    except InvalidContactException as e:
+        raise ValueError(str(e)) from e
+    row: list[Optional[str]] = [None] * len(COLUMNS)
+    row[0] = id
+    for name, value in record.items():
+        row[COLUMNS.index(name)] = to_text(value)
+    return row
+
+
+def to_text(value) -> Optional[str]:
+    # None stays unquoted so that COPY reads it as NULL
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return value
+
+
+def import_contacts(cur, lines: Iterable[bytes], format: str) -> dict:
+    """Load contacts through a staging table and upsert them.
+
+    Rows are streamed into a temporary table with COPY, validated there
+    and then merged into contacts with two set-based statements: rows
+    whose id matches an existing contact update it, all other valid rows
+    are inserted as new contacts. Must run in a single transaction, the
+    staging table is dropped on commit.
+    """
+    lines = iter(lines)
+    cur.execute(
+        "CREATE TEMP TABLE contacts_import ("
+        + " row bigserial, "
+        + ", ".join(f"{name} text" for name in COLUMNS)
+        + ", error text"
+        + ") ON COMMIT DROP"
+    )
+
+    if format == "csv":
+        header = parse_header(next(lines, b""))
+        cur.copy_expert(
+            f"COPY contacts_import ({', '.join(COLUMNS)}, error)"
+            + " FROM STDIN WITH (FORMAT csv)",
+            LineStream(csv_to_csv(lines, header)),
+        )
+        updates = [name for name in header if name != "id"]
+    elif format == "ndjson":
+        cur.copy_expert(
+            f"COPY contacts_import ({', '.join(COLUMNS)}, error)"
+            + " FROM STDIN WITH (FORMAT csv)",
+            LineStream(ndjson_to_csv(lines)),
+        )
+        updates = list(FIELDS)
+    else:
+        raise InvalidImportException(f"Unknown format: {format}")
+
+    cur.execute("""
+        UPDATE contacts_import SET error = CASE
+            WHEN id !~ '^[0-9]{1,9}$' THEN 'Invalid id'
+            WHEN lower(favorite) NOT IN ('true', 'false', 't', 'f', '1', '0')
+                THEN 'Invalid value for favorite'
+        END
+        WHERE error IS NULL
+        """)
+    cur.execute(
+        "SELECT count(*) FILTER (WHERE error IS NULL),"
+        + " count(*) FILTER (WHERE error IS NOT NULL)"
+        + " FROM contacts_import"
+    )
+    valid, rejected = cur.fetchone()
+    cur.execute(
+        "SELECT row, error FROM contacts_import WHERE error IS NOT NULL"
+        + " ORDER BY row LIMIT %s",
+        (MAX_REJECTS,),
+    )
+    rejects = [{"row": row, "error": error} for row, error in cur.fetchall()]
+
+    updated = 0
+    if updates:
+        # the last row wins when an id appears more than once
+        cur.execute(
+            "UPDATE contacts SET "
+            + ", ".join(f"{name} = s.{name}" for name in updates)
+            + " FROM ("
+            + " SELECT DISTINCT ON (id::integer) id::integer AS id, "
+            + ", ".join(value(name) for name in updates)
+            + " FROM contacts_import"
+            + " WHERE error IS NULL AND id IS NOT NULL"
+            + " ORDER BY id::integer, row DESC"
+            + ") AS s WHERE contacts.id = s.id"
+        )
+        updated = cur.rowcount
+
+    # rows without an id, or with an unknown one, become new contacts
+    cur.execute(
+        "INSERT INTO contacts"
+        + f' ({", ".join(FIELDS)}, "createdAt")'
+        + f" SELECT {', '.join(value(name) for name in FIELDS)},"
+        + " now() AT TIME ZONE 'UTC'"
+        + " FROM contacts_import AS s"
+        + " WHERE error IS NULL AND (id IS NULL OR NOT EXISTS ("
+        + " SELECT 1 FROM contacts WHERE contacts.id = s.id::integer))"
+        + " ORDER BY row"
+    )
+    inserted = cur.rowcount
+
+    return {
+        "rows": valid + rejected,
+        "inserted": inserted,
+        "updated": updated,
+        # earlier rows for an id that appears more than once
+        "skipped": valid - inserted - updated,
+        "rejected": rejected,
+        "rejects": rejects,
+    }
+
+
+def value(name: str) -> str:
+    if name == "favorite":
+        favorite = "lower(favorite) IN ('true', 't', '1')"
+        return f"coalesce({favorite}, false) AS favorite"
+    return name
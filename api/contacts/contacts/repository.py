@@ -0,0 +1,361 @@
+import json
+import re
+from typing import Optional
+
+import psycopg2.extras
+
+from .sql import Statement
+
+# fields the client may set, with their JSON types
+FIELDS = {
+    "first": str,
+    "last": str,
+    "avatar": str,
+    "twitter": str,
+    "notes": str,
+    "favorite": bool,
+}
+SQL_TYPES = {str: "text", bool: "boolean"}
+
+# createdAt and updatedAt are returned in epoch milliseconds like the
+# frontend expects
+COLUMNS = (
+    "id, first, last, avatar, twitter, notes, favorite, "
+    + '(extract(epoch FROM "createdAt") * 1000)::bigint, '
+    + "version, "
+    + '(extract(epoch FROM "updatedAt") * 1000)::bigint'
+)
+
+# Pages are read with a keyset on ("createdAt", id), backed by the index
+# ix_contacts_created_at_id, so a deep page costs the same as the first.
+LIST_FIRST = Statement(
+    "contacts_list_first",
+    f'SELECT {COLUMNS}, "createdAt" FROM contacts'
+    + ' ORDER BY "createdAt", id LIMIT $1',
+    ["integer"],
+)
+LIST_AFTER = Statement(
+    "contacts_list_after",
+    f'SELECT {COLUMNS}, "createdAt" FROM contacts'
+    + ' WHERE ("createdAt", id) > ($1, $2)'
+    + ' ORDER BY "createdAt", id LIMIT $3',
+    ["timestamp", "integer", "integer"],
+)
+# Matches are ranked by ts_rank on the search column (ix_contacts_search)
+# and paged with a keyset on (rank, id). $2 and $3 are NULL for the first
+# page.
+SEARCH = Statement(
+    "contacts_search",
+    f"SELECT {COLUMNS}, rank FROM ("
+    + " SELECT contacts.*, ts_rank(search, query) AS rank"
+    + " FROM contacts, to_tsquery('simple', $1) AS query"
+    + " WHERE search @@ query"
+    + ") AS matches"
+    + " WHERE $2 IS NULL OR rank < $2 OR (rank = $2 AND id > $3)"
+    + " ORDER BY rank DESC, id LIMIT $4",
+    ["text", "real", "integer", "integer"],
+)
+# Changes after ($1, $2) in ("changeXid", "changeSeq") order, contacts that
+# exist with their columns and deleted ones with only their id. Each side
+# reads at most $3 rows from its index before the two are merged. Writers
+# commit in any order, so only the changes of transactions older than all
+# of those still in progress are read: a transaction that commits later
+# has a greater id, and the cursor never passes a change before it shows.
+WATERMARK = "pg_snapshot_xmin(pg_current_snapshot())"
+CHANGES = Statement(
+    "contacts_changes",
+    f'(SELECT "changeXid", "changeSeq", false, {COLUMNS} FROM contacts'
+    + ' WHERE ("changeXid", "changeSeq") > ($1, $2)'
+    + f' AND "changeXid" < {WATERMARK}'
+    + ' ORDER BY "changeXid", "changeSeq" LIMIT $3)'
+    + " UNION ALL"
+    + ' (SELECT "changeXid", "changeSeq", true, id,'
+    + " NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL"
+    + " FROM contacts_tombstones"
+    + ' WHERE ("changeXid", "changeSeq") > ($1, $2)'
+    + f' AND "changeXid" < {WATERMARK}'
+    + ' ORDER BY "changeXid", "changeSeq" LIMIT $3)'
+    + ' ORDER BY "changeXid", "changeSeq" LIMIT $3',
+    ["xid8", "bigint", "integer"],
+)
+GET = Statement(
+    "contacts_get",
+    f"SELECT {COLUMNS} FROM contacts WHERE id = $1",
+    ["integer"],
+)
+# Answered from ix_contacts_id_version with an index-only scan, for
+# conditional requests that do not need the contact itself.
+VERSION = Statement(
+    "contacts_version",
+    'SELECT version, (extract(epoch FROM "updatedAt") * 1000)::bigint'
+    + " FROM contacts WHERE id = $1",
+    ["integer"],
+)
+CREATE = Statement(
+    "contacts_create",
+    "INSERT INTO contacts"
+    + ' (first, last, avatar, twitter, notes, favorite, "createdAt")'
+    + " VALUES ($1, $2, $3, $4, $5, coalesce($6, false),"
+    + " now() AT TIME ZONE 'UTC')"
+    + f" RETURNING {COLUMNS}",
+    ["text", "text", "text", "text", "text", "boolean"],
+)
+
+
+def assignments(changes: str) -> str:
+    """SET clause that updates only the keys present in ``changes``.
+
+    ``changes`` is a jsonb expression, so one statement serves every
+    combination of fields.
+    """
+    return ", ".join(
+        f"{name} = CASE WHEN {changes} ? '{name}'"
+        + f" THEN ({changes}->>'{name}')::{SQL_TYPES[kind]}"
+        + f" ELSE {name} END"
+        for name, kind in FIELDS.items()
+    )
+
+
+# The last parameter of the writes is the versions the client expects
+# (If-Match), NULL to write whatever the version. The version itself is
+# bumped by the contacts_touch trigger.
+UPDATE = Statement(
+    "contacts_update",
+    "UPDATE contacts SET "
+    + assignments("$2")
+    + " WHERE id = $1 AND ($3 IS NULL OR version = ANY($3))"
+    + f" RETURNING {COLUMNS}",
+    ["integer", "jsonb", "integer[]"],
+)
+FAVORITE = Statement(
+    "contacts_favorite",
+    "UPDATE contacts SET favorite = $2"
+    + " WHERE id = $1 AND ($3 IS NULL OR version = ANY($3))"
+    + f" RETURNING {COLUMNS}",
+    ["integer", "boolean", "integer[]"],
+)
+DELETE = Statement(
+    "contacts_delete",
+    "DELETE FROM contacts"
+    + " WHERE id = $1 AND ($2 IS NULL OR version = ANY($2))"
+    + " RETURNING id",
+    ["integer", "integer[]"],
+)
+
+
+class InvalidContactException(Exception):
+    pass
+
+
+def to_contact(row) -> dict:
+    (
+        id,
+        first,
+        last,
+        avatar,
+        twitter,
+        notes,
+        favorite,
+        created_at,
+        version,
+        updated_at,
+    ) = row
+    return {
+        # ids are strings on the frontend
+        "id": str(id),
+        "first": first,
+        "last": last,
+        "avatar": avatar,
+        "twitter": twitter,
+        "notes": notes,
+        "favorite": favorite,
+        "createdAt": created_at,
+        "version": version,
+        "updatedAt": updated_at,
+    }
+
+
+def validate(data) -> dict:
+    if not isinstance(data, dict):
+        raise InvalidContactException("Contact must be an object")
+    for name, value in data.items():
+        kind = FIELDS.get(name)
+        if kind is None:
+            raise InvalidContactException(f"Unknown field: {name}")
+        if value is not None and not isinstance(value, kind):
+            raise InvalidContactException(f"Invalid value for {name}")
+    return data
+
+
+def list_contacts(
+    cur,
+    limit: int,
+    after: Optional[list] = None,
+) -> tuple[list[dict], Optional[list]]:
+    """Return a page of contacts and the key to read the next one after.
+
+    ``after`` is the key returned with the previous page.
+    """
+    if after is None:
+        rows = LIST_FIRST.execute(cur, [limit + 1]).fetchall()
+    else:
+        created_at, id = after
+        rows = LIST_AFTER.execute(
+            cur,
+            [created_at, id, limit + 1],
+        ).fetchall()
+    next_key = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_key = [rows[-1][-1].isoformat(), rows[-1][0]]
+    return [to_contact(row[:-1]) for row in rows], next_key
+
+
+def to_tsquery(q: str) -> Optional[str]:
+    """Prefix query matching contacts that have every word of ``q``."""
+    words = re.findall(r"\w+", q)
+    if not words:
+        return None
+    return " & ".join(f"{word}:*" for word in words)
+
+
+def search_contacts(
+    cur,
+    query: str,
+    limit: int,
+    after: Optional[list] = None,
+) -> tuple[list[dict], Optional[list]]:
+    """Return a page of the contacts matching ``query``, best first.
+
+    ``query`` comes from ``to_tsquery`` and ``after`` is the key returned
+    with the previous page.
+    """
+    rank, id = after if after is not None else (None, None)
+    rows = SEARCH.execute(cur, [query, rank, id, limit + 1]).fetchall()
+    next_key = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_key = [rows[-1][-1], rows[-1][0]]
+    return [to_contact(row[:-1]) for row in rows], next_key
+
+
+def list_changes(
+    cur,
+    since: tuple[int, int],
+    limit: int,
+) -> tuple[list[dict], list[str], tuple[int, int], bool]:
+    """Return a page of the changes after ``since``.
+
+    That is the contacts changed, the ids of those deleted, the change the
+    page ends at as ("changeXid", "changeSeq"), to read the next one
+    after, and whether there are more.
+    """
+    xid, seq = since
+    # xid8 has no cast from integers, it is passed as text
+    rows = CHANGES.execute(cur, [str(xid), seq, limit + 1]).fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    changed = [to_contact(row[3:]) for row in rows if not row[2]]
+    deleted = [str(row[3]) for row in rows if row[2]]
+    last = (int(rows[-1][0]), rows[-1][1]) if rows else since
+    return changed, deleted, last, more
+
+
+def get_contact(cur, id: int) -> Optional[dict]:
+    row = GET.execute(cur, [id]).fetchone()
+    return to_contact(row) if row else None
+
+
+def get_version(cur, id: int) -> Optional[tuple[int, int]]:
+    """Return the version and updatedAt of a contact, without reading it."""
+    return VERSION.execute(cur, [id]).fetchone()
+
+
+def create_contact(cur, data: dict) -> dict:
+    data = validate(data)
+    row = CREATE.execute(
+        cur,
+        [data.get(name) for name in FIELDS],
+    ).fetchone()
+    return to_contact(row)
+
+
+def update_contact(
+    cur,
+    id: int,
+    data: dict,
+    versions: Optional[list[int]] = None,
+) -> Optional[dict]:
+    """Update a contact, only at one of ``versions`` when it is given.
+
+    Returns None when there is no such contact or it is at another
+    version.
+    """
+    data = validate(data)
+    row = UPDATE.execute(cur, [id, json.dumps(data), versions]).fetchone()
+    return to_contact(row) if row else None
+
+
+def set_favorite(
+    cur,
+    id: int,
+    favorite: bool,
+    versions: Optional[list[int]] = None,
+) -> Optional[dict]:
+    row = FAVORITE.execute(cur, [id, favorite, versions]).fetchone()
+    return to_contact(row) if row else None
+
+
+def delete_contact(
+    cur,
+    id: int,
+    versions: Optional[list[int]] = None,
+) -> bool:
+    return DELETE.execute(cur, [id, versions]).fetchone() is not None
+
+
+# The batch functions write any number of contacts with one statement each.
+# They take data that has been validated already.
+
+
+def create_contacts(cur, items: list[dict]) -> list[dict]:
+    """Insert ``items`` and return the new contacts in the same order."""
+    if not items:
+        return []
+    rows = psycopg2.extras.execute_values(
+        cur,
+        f'INSERT INTO contacts ({", ".join(FIELDS)}, "createdAt")'
+        + f" VALUES %s RETURNING {COLUMNS}",
+        [[data.get(name) for name in FIELDS] for data in items],
+        template="(%s, %s, %s, %s, %s, coalesce(%s::boolean, false),"
+        + " now() AT TIME ZONE 'UTC')",
+        page_size=len(items),
+        fetch=True,
+    )
+    # the serial hands out ids in the order of VALUES
+    return [to_contact(row) for row in sorted(rows)]
+
+
+def update_contacts(cur, items: dict[int, dict]) -> dict[int, dict]:
+    """Apply the changes in ``items`` by id, return the updated contacts."""
+    if not items:
+        return {}
+    rows = psycopg2.extras.execute_values(
+        cur,
+        f"UPDATE contacts SET {assignments('changes')}"
+        + " FROM (VALUES %s) AS batch (batch_id, changes)"
+        + f" WHERE id = batch_id RETURNING {COLUMNS}",
+        [(id, json.dumps(data)) for id, data in items.items()],
+        template="(%s::integer, %s::jsonb)",
+        page_size=len(items),
+        fetch=True,
+    )
+    return {row[0]: to_contact(row) for row in rows}
+
+
+def delete_contacts(cur, ids: list[int]) -> set[int]:
+    """Delete the contacts with ``ids`` and return the ids that existed."""
+    if not ids:
+        return set()
+    cur.execute("DELETE FROM contacts WHERE id = ANY(%s) RETURNING id", [ids])
+    return {id for id, in cur.fetchall()}
@@ -0,0 +1,42 @@
+from typing import Sequence
+
+import psycopg2.extensions
+
+
+class PreparedConnection(psycopg2.extensions.connection):
+    """Connection that remembers the statements prepared on it."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.prepared: set[str] = set()
+
+
+class Statement(object):
+    """Server-side prepared statement, run on a PreparedConnection.
+
+    The statement is prepared the first time it runs on a connection,
+    after that each call is a single EXECUTE with the parameters only, so
+    Postgres does not parse and plan the query again. Prepared statements
+    outlive transactions, including rolled back ones, and disappear with
+    the connection.
+    """
+
+    def __init__(self, name: str, sql: str, types: Sequence[str] = ()):
+        self.name = name
+        self.sql = sql
+        self.types = types
+        if types:
+            self.__prepare = f"PREPARE {name} ({', '.join(types)}) AS {sql}"
+            placeholders = ", ".join(["%s"] * len(types))
+            self.__execute = f"EXECUTE {name} ({placeholders})"
+        else:
+            self.__prepare = f"PREPARE {name} AS {sql}"
+            self.__execute = f"EXECUTE {name}"
+
+    def execute(self, cur, params: Sequence = ()):
+        prepared = cur.connection.prepared
+        if self.name not in prepared:
+            cur.execute(self.__prepare)
+            prepared.add(self.name)
+        cur.execute(self.__execute, params)
+        return cur
@@ -0,0 +1,126 @@
+import json
+import threading
+import time
+import urllib.request
+from typing import Any, Callable, Optional
+
+from jose import jwk, jws
+from jose.exceptions import JOSEError
+
+# This module is shared with bff/auth/auth/verifier.py,
+# keep both copies in sync.
+
+
+class InvalidTokenException(Exception):
+    pass
+
+
+class KeySetUnavailableException(Exception):
+    pass
+
+
+class TokenVerifier(object):
+    """Verifies Cognito JWTs locally against the JWKS of the user pool.
+
+    The key set is downloaded once and kept for ``ttl`` seconds. A token
+    signed with an unknown ``kid`` triggers an early reload, at most once
+    every ``min_refresh_interval`` seconds so that garbage tokens cannot
+    turn into a flood of JWKS requests. KeySetUnavailableException is
+    raised when there is no key set yet and it cannot be downloaded.
+    """
+
+    def __init__(
+        self,
+        issuer: str,
+        audiences: list[str],
+        jwks_url: Optional[str] = None,
+        ttl: float = 60 * 60,
+        min_refresh_interval: float = 30,
+        leeway: float = 0,
+        timeout: float = 5,
+        clock: Callable[[], float] = time.time,
+    ):
+        # an empty audience would reject every token without a word
+        if not audiences or not all(audiences):
+            raise ValueError("No audience to verify tokens against")
+        self.__issuer = issuer
+        self.__audiences = audiences
+        self.__jwks_url = jwks_url or f"{issuer}/.well-known/jwks.json"
+        self.__ttl = ttl
+        self.__min_refresh_interval = min_refresh_interval
+        self.__leeway = leeway
+        self.__timeout = timeout
+        self.__clock = clock
+        self.__lock = threading.Lock()
+        self.__keys: dict[str, Any] = {}
+        self.__loaded_at: Optional[float] = None
+
+    def verify(self, token: str, token_use: Optional[str] = None) -> dict:
+        try:
+            header = jws.get_unverified_header(token)
+        except JOSEError as e:
+            raise InvalidTokenException(e) from e
+        if header.get("alg") != "RS256":
+            raise InvalidTokenException("Unsupported alg")
+
+        key = self.__get_key(header.get("kid", ""))
+        try:
+            payload = jws.verify(token, key, algorithms=["RS256"])
+        except JOSEError as e:
+            raise InvalidTokenException(e) from e
+        claims = json.loads(payload)
+
+        now = self.__clock()
+        if claims.get("exp", 0) + self.__leeway <= now:
+            raise InvalidTokenException("Token expired")
+        if claims.get("iss") != self.__issuer:
+            raise InvalidTokenException("Invalid issuer")
+        if token_use and claims.get("token_use") != token_use:
+            raise InvalidTokenException("Invalid token_use")
+        # id tokens carry the app client in aud, access tokens in client_id
+        audience = claims.get("aud", claims.get("client_id"))
+        if audience not in self.__audiences:
+            raise InvalidTokenException("Invalid audience")
+        return claims
+
+    def __get_key(self, kid: str):
+        now = self.__clock()
+        loaded_at = self.__loaded_at
+        fresh = loaded_at is not None and now < loaded_at + self.__ttl
+        if fresh and kid in self.__keys:
+            return self.__keys[kid]
+
+        with self.__lock:
+            loaded_at = self.__loaded_at
+            if loaded_at is None or now >= loaded_at + self.__ttl:
+                self.__load()
+            elif (
+                kid not in self.__keys
+                and now >= loaded_at + self.__min_refresh_interval
+            ):
+                # the pool may have rotated its signing keys
+                self.__load()
+        if kid not in self.__keys:
+            raise InvalidTokenException(f"Unknown kid: {kid}")
+        return self.__keys[kid]
+
+    def __load(self):
+        try:
+            with urllib.request.urlopen(
+                self.__jwks_url,
+                timeout=self.__timeout,
+            ) as res:
+                jwks = json.loads(res.read())
+        except (OSError, ValueError) as e:
+            if not self.__keys:
+                raise KeySetUnavailableException(e) from e
+            # keep the keys we have and try again a bit later
+            retry_in = self.__min_refresh_interval
+            self.__loaded_at = self.__clock() - self.__ttl + retry_in
+            return
+        self.__keys = {
+            key["kid"]: jwk.construct(key, algorithm="RS256")
+            for key in jwks["keys"]
+            if key.get("kty") == "RSA"
+        }
+        self.__loaded_at = self.__clock()
@@ -0,0 +1,47 @@
+import os
+import unittest
+
+import psycopg2
+
+# The Postgres of compose.yml, migrated with `alembic upgrade head`.
+ENVIRON = {
+    "DB_HOST": os.getenv("DB_HOST", "localhost"),
+    "DB_PORT": os.getenv("DB_PORT", "5432"),
+    "DB_NAME": os.getenv("DB_NAME", "postgres"),
+    "DB_USER": os.getenv("DB_USER", "postgres"),
+    "DB_PASSWORD": os.getenv("DB_PASSWORD", "example"),
+}
+
+
+def connect():
+    return psycopg2.connect(
+        host=ENVIRON["DB_HOST"],
+        port=ENVIRON["DB_PORT"],
+        dbname=ENVIRON["DB_NAME"],
+        user=ENVIRON["DB_USER"],
+        password=ENVIRON["DB_PASSWORD"],
+        connect_timeout=1,
+    )
+
+
+def is_available() -> bool:
+    try:
+        connect().close()
+        return True
+    except psycopg2.OperationalError:
+        return False
+
+
+requires_database = unittest.skipUnless(
+    is_available(),
+    "Postgres of compose.yml is not running",
+)
+
+
+def truncate(*tables):
+    conn = connect()
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute(f"TRUNCATE {', '.join(tables)} RESTART IDENTITY")
+    finally:
+        conn.close()
@@ -0,0 +1,187 @@
+import unittest
+import unittest.mock
+
+import psycopg2
+
+import contacts.db
+import contacts.sql
+
+from .database import ENVIRON, connect, requires_database
+
+STATEMENT = contacts.sql.Statement(
+    "test_db_add",
+    "SELECT $1 + $2",
+    ["integer", "integer"],
+)
+
+
+def config(**environ):
+    environ.setdefault("DB_HOST", "db")
+    return contacts.db.Config(environ)
+
+
+class TestAuthTokenCache(unittest.TestCase):
+    def test_get(self):
+        now = [0.0]
+        rds = unittest.mock.MagicMock()
+        rds.generate_db_auth_token.side_effect = ["token-1", "token-2"]
+        sut = contacts.db.AuthTokenCache(
+            rds,
+            config(),
+            margin=60,
+            clock=lambda: now[0],
+        )
+        self.assertEqual("token-1", sut.get())
+        now[0] = 14 * 60 - 1
+        self.assertEqual("token-1", sut.get())
+        now[0] = 14 * 60
+        self.assertEqual("token-2", sut.get())
+        self.assertEqual(2, rds.generate_db_auth_token.call_count)
+
+
+class TestConnectionManager(unittest.TestCase):
+    def setUp(self):
+        self.now = [0.0]
+        self.connections = []
+
+        def connect(**params):
+            conn = unittest.mock.MagicMock(closed=0)
+            self.connections.append((conn, params))
+            return conn
+
+        self.connect = unittest.mock.MagicMock(side_effect=connect)
+
+    def manager(self, tokens=None, **environ):
+        environ.setdefault("DB_PASSWORD", "example")
+        return contacts.db.ConnectionManager(
+            config(**environ),
+            tokens,
+            connect=self.connect,
+            clock=lambda: self.now[0],
+        )
+
+    def test_connection(self):
+        sut = self.manager()
+        with sut.connection() as conn:
+            conn.cursor()
+        with sut.connection() as other:
+            self.assertIs(conn, other)
+        self.assertEqual(1, self.connect.call_count)
+        self.assertEqual(2, conn.commit.call_count)
+        self.assertEqual("example", self.connections[0][1]["password"])
+
+    def test_connection_in_autocommit(self):
+        sut = self.manager()
+        with sut.connection(autocommit=True) as conn:
+            self.assertTrue(conn.autocommit)
+        conn.commit.assert_not_called()
+        with sut.connection() as other:
+            self.assertIs(conn, other)
+            self.assertFalse(conn.autocommit)
+        conn.commit.assert_called_once()
+
+    def test_connection_when_failed(self):
+        sut = self.manager()
+        with self.assertRaises(ValueError):
+            with sut.connection() as conn:
+                raise ValueError()
+        conn.rollback.assert_called_once()
+        conn.commit.assert_not_called()
+        with sut.connection() as other:
+            self.assertIs(conn, other)
+
+    def test_connection_when_closed(self):
+        sut = self.manager()
+        with sut.connection() as conn:
+            pass
+        conn.closed = 1
+        with sut.connection() as other:
+            self.assertIsNot(conn, other)
+        self.assertEqual(2, self.connect.call_count)
+
+    def test_connection_when_idle(self):
+        sut = self.manager(DB_PING_INTERVAL_SECONDS="30")
+        with sut.connection() as conn:
+            pass
+        self.now[0] = 29
+        with sut.connection():
+            pass
+        conn.cursor.assert_not_called()
+        self.now[0] = 60
+        with sut.connection() as other:
+            self.assertIs(conn, other)
+        conn.cursor.assert_called_once()
+
+    def test_connection_when_broken(self):
+        sut = self.manager(DB_PING_INTERVAL_SECONDS="30")
+        with sut.connection() as conn:
+            pass
+        cur = conn.cursor.return_value.__enter__.return_value
+        cur.execute.side_effect = psycopg2.OperationalError()
+        self.now[0] = 60
+        with sut.connection() as other:
+            self.assertIsNot(conn, other)
+        conn.close.assert_called_once()
+
+    def test_connection_with_iam_token(self):
+        tokens = unittest.mock.MagicMock()
+        tokens.get.side_effect = ["revoked", "token"]
+        connect = self.connect.side_effect
+
+        def reject_revoked(**params):
+            if params["password"] == "revoked":
+                raise psycopg2.OperationalError(
+                    'PAM authentication failed for user "contacts_api"',
+                )
+            return connect(**params)
+
+        self.connect.side_effect = reject_revoked
+        sut = contacts.db.ConnectionManager(
+            config(),
+            tokens,
+            connect=self.connect,
+        )
+        with sut.connection():
+            pass
+        tokens.invalidate.assert_called_once()
+        self.assertEqual("token", self.connections[0][1]["password"])
+        self.assertEqual("require", self.connections[0][1]["sslmode"])
+
+
+@requires_database
+class TestConnectionManagerWithDatabase(unittest.TestCase):
+    def test_connection_when_terminated(self):
+        sut = contacts.db.ConnectionManager(
+            contacts.db.Config(dict(ENVIRON, DB_PING_INTERVAL_SECONDS="0")),
+        )
+        self.addCleanup(sut.close)
+        with sut.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_backend_pid()")
+                (pid,) = cur.fetchone()
+
+        admin = connect()
+        self.addCleanup(admin.close)
+        with admin, admin.cursor() as cur:
+            cur.execute("SELECT pg_terminate_backend(%s)", (pid,))
+
+        with sut.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_backend_pid()")
+                self.assertNotEqual(pid, cur.fetchone()[0])
+
+    def test_connection_in_autocommit_with_statement(self):
+        sut = contacts.db.ConnectionManager(contacts.db.Config(ENVIRON))
+        self.addCleanup(sut.close)
+        for _ in range(2):
+            with sut.connection(autocommit=True) as conn:
+                with conn.cursor() as cur:
+                    self.assertEqual(
+                        3,
+                        STATEMENT.execute(cur, [1, 2]).fetchone()[0],
+                    )
+                # no BEGIN was sent, so there is no COMMIT to send either
+                self.assertEqual(
+                    psycopg2.extensions.TRANSACTION_STATUS_IDLE,
+                    conn.info.transaction_status,
+                )
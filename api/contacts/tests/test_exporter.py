@@ -0,0 +1,190 @@
+import csv
+import gc
+import importlib
+import io
+import json
+import os
+import resource
+import tracemalloc
+import unittest
+import unittest.mock
+
+import boto3
+import moto
+
+import contacts
+import contacts.db
+from contacts import exporter
+
+from .database import ENVIRON, connect, requires_database, truncate
+from .test_handler import request
+
+BUCKET = "contacts-export"
+# moto keeps each part in memory until it reaches this size, spool them to
+# disk so that only the exporter is measured
+MOTO_ENVIRON = {
+    "AWS_DEFAULT_REGION": "ap-northeast-1",
+    "AWS_ACCESS_KEY_ID": "testing",
+    "AWS_SECRET_ACCESS_KEY": "testing",
+    "MOTO_S3_DEFAULT_KEY_BUFFER_SIZE": "1",
+}
+
+ROWS = 500_000
+# about 300 MB of NDJSON. Each part is copied a few times on its way
+# through botocore and moto, the ceiling leaves room for that but not for
+# the export itself.
+MEMORY_CEILING = 12 * exporter.PART_SIZE
+
+
+def seed(rows):
+    conn = connect()
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO contacts"
+                + ' (first, last, twitter, notes, favorite, "createdAt")'
+                + " SELECT 'First' || i, 'Last' || i, '@contact' || i,"
+                + " repeat('lorem ipsum dolor sit amet ', 16), i %% 2 = 0,"
+                + " timestamp '2024-01-01' + i * interval '1 second'"
+                + " FROM generate_series(1, %s) AS i",
+                (rows,),
+            )
+    finally:
+        conn.close()
+
+
+class MeasuredS3(object):
+    """S3 client that records the peak memory before the upload completes.
+
+    moto leaves every request, body included, in a reference cycle and
+    joins all the parts in memory to complete the upload, neither of which
+    happens in production.
+    """
+
+    def __init__(self, s3):
+        self.__s3 = s3
+        self.peak = None
+        self.maxrss = None
+
+    def __getattr__(self, name):
+        return getattr(self.__s3, name)
+
+    def upload_part(self, **kwargs):
+        response = self.__s3.upload_part(**kwargs)
+        gc.collect()
+        return response
+
+    def complete_multipart_upload(self, **kwargs):
+        self.peak = tracemalloc.get_traced_memory()[1]
+        self.maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return self.__s3.complete_multipart_upload(**kwargs)
+
+
+@requires_database
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        patcher = unittest.mock.patch.dict(
+            os.environ,
+            dict(ENVIRON, EXPORT_BUCKET=BUCKET, **MOTO_ENVIRON),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        mock = moto.mock_aws()
+        mock.start()
+        self.addCleanup(mock.stop)
+        self.s3 = boto3.client("s3")
+        self.s3.create_bucket(
+            Bucket=BUCKET,
+            CreateBucketConfiguration={"LocationConstraint": "ap-northeast-1"},
+        )
+        patcher = unittest.mock.patch.object(
+            importlib.import_module("contacts.handler"),
+            "get_s3",
+            return_value=self.s3,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        contacts.db.reset_connection_manager()
+        self.addCleanup(contacts.db.reset_connection_manager)
+        truncate("contacts")
+        self.addCleanup(truncate, "contacts")
+
+    def read(self, key):
+        return self.s3.get_object(Bucket=BUCKET, Key=key)["Body"].read()
+
+    def test_export_ndjson(self):
+        created = [
+            request("POST", "/contacts", {"first": "Alice", "favorite": True}),
+            request("POST", "/contacts", {"first": "Bob", "notes": "a\nb"}),
+        ]
+        result = request("POST", "/contacts/export")
+        self.assertEqual(200, result["statusCode"])
+        self.assertEqual(2, result["body"]["rows"])
+        self.assertTrue(result["body"]["key"].endswith(".ndjson"))
+        self.assertIn(BUCKET, result["body"]["url"])
+        lines = self.read(result["body"]["key"]).decode().splitlines()
+        self.assertEqual(
+            [contact["body"] for contact in created],
+            [json.loads(line) for line in lines],
+        )
+
+    def test_export_csv(self):
+        request("POST", "/contacts", {"first": "Alice", "notes": "a,\nb"})
+        result = request("POST", "/contacts/export", query={"format": "csv"})
+        self.assertEqual(200, result["statusCode"])
+        body = self.read(result["body"]["key"]).decode()
+        rows = list(csv.DictReader(io.StringIO(body)))
+        self.assertEqual(1, len(rows))
+        self.assertEqual("Alice", rows[0]["first"])
+        self.assertEqual("a,\nb", rows[0]["notes"])
+        self.assertEqual("", rows[0]["last"])
+
+    def test_export_empty(self):
+        result = request("POST", "/contacts/export", query={"format": "csv"})
+        self.assertEqual(200, result["statusCode"])
+        self.assertEqual(0, result["body"]["rows"])
+        self.assertEqual(
+            ",".join(exporter.HEADER) + "\n",
+            self.read(result["body"]["key"]).decode(),
+        )
+
+    def test_export_invalid_format(self):
+        result = request("POST", "/contacts/export", query={"format": "xml"})
+        self.assertEqual(400, result["statusCode"])
+
+    def test_export_aborts_on_error(self):
+        s3 = unittest.mock.MagicMock(wraps=self.s3)
+        with self.assertRaises(RuntimeError):
+            with exporter.MultipartWriter(s3, BUCKET, "a.csv", "text/csv"):
+                raise RuntimeError()
+        s3.abort_multipart_upload.assert_called_once()
+        s3.complete_multipart_upload.assert_not_called()
+        response = self.s3.list_multipart_uploads(Bucket=BUCKET)
+        self.assertEqual([], response.get("Uploads", []))
+
+    def test_export_memory_is_flat(self):
+        seed(ROWS)
+        s3 = MeasuredS3(self.s3)
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        tracemalloc.start()
+        try:
+            with contacts.db.get_connection_manager().connection() as conn:
+                with exporter.MultipartWriter(
+                    s3,
+                    BUCKET,
+                    "exports/all.ndjson",
+                    "application/x-ndjson",
+                ) as out:
+                    rows = exporter.export_contacts(conn, out, "ndjson")
+        finally:
+            tracemalloc.stop()
+
+        self.assertEqual(ROWS, rows)
+        self.assertGreater(out.size, MEMORY_CEILING * 2)
+        self.assertLess(s3.peak, MEMORY_CEILING)
+        # rows held by libpq are not traced, the high-water mark of the
+        # process would grow by the size of the result without a named
+        # cursor
+        self.assertLess((s3.maxrss - maxrss) * 1024, MEMORY_CEILING)
+        head = self.s3.head_object(Bucket=BUCKET, Key="exports/all.ndjson")
+        self.assertEqual(out.size, head["ContentLength"])
@@ -1,23 +1,542 @@
+import importlib
 import json
 import os
+import time
 import unittest
 import unittest.mock
 
 import contacts
+import contacts.db
+from contacts import cursor, repository
 
+from .database import ENVIRON, connect, requires_database, truncate
+from .jwks import LocalJWKS
 
+
+def request(method, path, body=None, query=None, headers=None):
+    event = {
+        "rawPath": path,
+        "requestContext": {"http": {"method": method, "path": path}},
+        "headers": headers or {},
+        "queryStringParameters": query,
+        "isBase64Encoded": False,
+    }
+    if body is not None:
+        event["body"] = json.dumps(body)
+    result = contacts.handler(event, None)
+    if "body" in result:
+        result["body"] = json.loads(result["body"])
+    return result
+
+
+@requires_database
 class TestHandler(unittest.TestCase):
-    @unittest.skipIf(True, "Reason")
-    def test_handler(self):
-        with unittest.mock.patch.dict(
-            os.environ,
+    def setUp(self):
+        patcher = unittest.mock.patch.dict(os.environ, ENVIRON)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        contacts.db.reset_connection_manager()
+        self.addCleanup(contacts.db.reset_connection_manager)
+        truncate("contacts", "contacts_tombstones")
+
+    def test_handler_create(self):
+        result = request(
+            "POST",
+            "/contacts",
+            {"first": "Yuto", "last": "Nagano", "favorite": True},
+        )
+        self.assertEqual(201, result["statusCode"])
+        contact = result["body"]
+        self.assertEqual("1", contact["id"])
+        self.assertEqual("Yuto", contact["first"])
+        self.assertIsNone(contact["twitter"])
+        self.assertTrue(contact["favorite"])
+        self.assertIsInstance(contact["createdAt"], int)
+
+    def test_handler_create_when_invalid(self):
+        for body in [None, [], {"unknown": "x"}, {"favorite": "yes"}]:
+            with self.subTest(body=body):
+                result = request("POST", "/contacts", body)
+                self.assertEqual(400, result["statusCode"])
+
+    def test_handler_list(self):
+        for first in ["a", "b", "c"]:
+            request("POST", "/contacts", {"first": first})
+        result = request("GET", "/contacts")
+        self.assertEqual(200, result["statusCode"])
+        self.assertEqual(
+            ["a", "b", "c"],
+            [contact["first"] for contact in result["body"]["contacts"]],
+        )
+        self.assertIsNone(result["body"]["cursor"])
+
+    def test_handler_list_pages(self):
+        for i in range(5):
+            request("POST", "/contacts", {"first": str(i)})
+        pages = []
+        query = {"limit": "2"}
+        while True:
+            result = request("GET", "/contacts", query=query)
+            self.assertEqual(200, result["statusCode"])
+            pages.append(
+                [contact["first"] for contact in result["body"]["contacts"]],
+            )
+            if result["body"]["cursor"] is None:
+                break
+            query = {"limit": "2", "cursor": result["body"]["cursor"]}
+        self.assertEqual([["0", "1"], ["2", "3"], ["4"]], pages)
+
+    def test_handler_search(self):
+        for first, last, notes in [
+            ("Alice", "Smith", None),
+            ("Bob", "Alison", None),
+            ("Carol", "Jones", "met alice at work"),
+            ("Dave", "Brown", None),
+        ]:
+            request(
+                "POST",
+                "/contacts",
+                {"first": first, "last": last, "notes": notes},
+            )
+        result = request("GET", "/contacts", query={"q": "ali"})
+        self.assertEqual(200, result["statusCode"])
+        contacts = result["body"]["contacts"]
+        # names rank above notes
+        self.assertEqual(
+            ["Alice", "Bob", "Carol"],
+            [contact["first"] for contact in contacts],
+        )
+        result = request("GET", "/contacts", query={"q": "alice smi"})
+        contacts = result["body"]["contacts"]
+        self.assertEqual(["Alice"], [contact["first"] for contact in contacts])
+
+    def test_handler_search_pages(self):
+        for i in range(5):
+            request("POST", "/contacts", {"first": f"name{i}"})
+        seen = []
+        query = {"q": "name", "limit": "2"}
+        while True:
+            result = request("GET", "/contacts", query=query)
+            self.assertEqual(200, result["statusCode"])
+            contacts = result["body"]["contacts"]
+            seen += [contact["first"] for contact in contacts]
+            if result["body"]["cursor"] is None:
+                break
+            query = dict(query, cursor=result["body"]["cursor"])
+        self.assertEqual([f"name{i}" for i in range(5)], seen)
+
+    def test_handler_list_when_invalid(self):
+        for query in [
+            {"limit": "0"},
+            {"limit": "201"},
+            {"limit": "x"},
+            {"cursor": "!"},
+            {"cursor": cursor.encode(["x"])},
+            {"cursor": cursor.encode(["not a timestamp", 1])},
+            {"q": "a", "cursor": cursor.encode(["2024-01-01T00:00:00", 1])},
+        ]:
+            with self.subTest(query=query):
+                result = request("GET", "/contacts", query=query)
+                self.assertEqual(400, result["statusCode"])
+
+    def test_handler_get(self):
+        created = request("POST", "/contacts", {"first": "a"})["body"]
+        result = request("GET", f"/contacts/{created['id']}")
+        self.assertEqual(200, result["statusCode"])
+        self.assertEqual(created, result["body"])
+        for path in ["/contacts/2", "/contacts/x", "/contacts/99999999999"]:
+            with self.subTest(path=path):
+                self.assertEqual(404, request("GET", path)["statusCode"])
+
+    def test_handler_update(self):
+        created = request(
+            "POST",
+            "/contacts",
+            {"first": "a", "last": "b", "notes": "c"},
+        )["body"]
+        result = request(
+            "PATCH",
+            f"/contacts/{created['id']}",
+            {"first": "x", "notes": None},
+        )
+        self.assertEqual(200, result["statusCode"])
+        self.assertEqual("x", result["body"]["first"])
+        self.assertEqual("b", result["body"]["last"])
+        self.assertIsNone(result["body"]["notes"])
+        self.assertEqual(
+            404,
+            request("PATCH", "/contacts/2", {"first": "x"})["statusCode"],
+        )
+
+    def test_handler_favorite(self):
+        created = request("POST", "/contacts", {"first": "a"})["body"]
+        self.assertFalse(created["favorite"])
+        path = f"/contacts/{created['id']}/favorite"
+        result = request("PUT", path, {"favorite": True})
+        self.assertEqual(200, result["statusCode"])
+        self.assertTrue(result["body"]["favorite"])
+        self.assertEqual(400, request("PUT", path, {})["statusCode"])
+
+    def test_handler_delete(self):
+        created = request("POST", "/contacts", {"first": "a"})["body"]
+        path = f"/contacts/{created['id']}"
+        self.assertEqual(204, request("DELETE", path)["statusCode"])
+        self.assertEqual(404, request("DELETE", path)["statusCode"])
+        self.assertEqual(404, request("GET", path)["statusCode"])
+
+    def test_handler_get_etag(self):
+        created = request("POST", "/contacts", {"first": "a"})
+        etag = created["headers"]["ETag"]
+        self.assertEqual('"1"', etag)
+        self.assertIn("Last-Modified", created["headers"])
+        path = f"/contacts/{created['body']['id']}"
+        result = request("GET", path)
+        self.assertEqual(200, result["statusCode"])
+        self.assertEqual(created["headers"], result["headers"])
+        for header in [etag, f'"0", W/{etag}', "*"]:
+            with self.subTest(header=header):
+                headers = {"if-none-match": header}
+                result = request("GET", path, headers=headers)
+                self.assertEqual(304, result["statusCode"])
+                self.assertNotIn("body", result)
+                self.assertEqual(etag, result["headers"]["ETag"])
+                self.assertEqual(
+                    created["headers"]["Last-Modified"],
+                    result["headers"]["Last-Modified"],
+                )
+
+        request("PATCH", path, {"first": "b"})
+        result = request("GET", path, headers={"if-none-match": etag})
+        self.assertEqual(200, result["statusCode"])
+        self.assertEqual('"2"', result["headers"]["ETag"])
+        self.assertEqual("b", result["body"]["first"])
+        result = request("GET", "/contacts/2", headers={"if-none-match": "*"})
+        self.assertEqual(404, result["statusCode"])
+
+    def test_version_is_read_from_the_index(self):
+        conn = connect()
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "INSERT INTO contacts (first)"
+                    + " SELECT 'a' FROM generate_series(1, 1000)"
+                )
+                cur.execute("VACUUM ANALYZE contacts")
+                cur.execute(
+                    "EXPLAIN (ANALYZE, FORMAT JSON) "
+                    + repository.VERSION.sql.replace("$1", "500")
+                )
+                plan = cur.fetchone()[0][0]["Plan"]
+        finally:
+            conn.close()
+        self.assertEqual("Index Only Scan", plan["Node Type"])
+        self.assertEqual("ix_contacts_id_version", plan["Index Name"])
+        self.assertEqual(0, plan["Heap Fetches"])
+
+    def test_handler_update_unchanged_keeps_etag(self):
+        created = request("POST", "/contacts", {"first": "a"})
+        path = f"/contacts/{created['body']['id']}"
+        result = request("PATCH", path, {"first": "a"})
+        self.assertEqual(created["headers"]["ETag"], result["headers"]["ETag"])
+        self.assertEqual(created["body"], result["body"])
+
+    def test_handler_if_match(self):
+        created = request("POST", "/contacts", {"first": "a"})
+        etag = created["headers"]["ETag"]
+        path = f"/contacts/{created['body']['id']}"
+        result = request(
+            "PATCH",
+            path,
+            {"first": "b"},
+            headers={"if-match": etag},
+        )
+        self.assertEqual(200, result["statusCode"])
+        self.assertEqual('"2"', result["headers"]["ETag"])
+        # the client that still holds the first version loses
+        for method, sub, body in [
+            ("PATCH", "", {"first": "c"}),
+            ("PUT", "/favorite", {"favorite": True}),
+            ("DELETE", "", None),
+        ]:
+            for header in [etag, f"W/{result['headers']['ETag']}", "x"]:
+                with self.subTest(method=method, header=header):
+                    self.assertEqual(
+                        412,
+                        request(
+                            method,
+                            path + sub,
+                            body,
+                            headers={"if-match": header},
+                        )["statusCode"],
+                    )
+        self.assertEqual("b", request("GET", path)["body"]["first"])
+        result = request(
+            "PUT",
+            f"{path}/favorite",
+            {"favorite": True},
+            headers={"if-match": '"1", "2"'},
+        )
+        self.assertEqual(200, result["statusCode"])
+        self.assertEqual(
+            404,
+            request(
+                "PATCH",
+                "/contacts/2",
+                {"first": "x"},
+                headers={"if-match": "*"},
+            )["statusCode"],
+        )
+        result = request("DELETE", path, headers={"if-match": '"3"'})
+        self.assertEqual(204, result["statusCode"])
+
+    def test_handler_changes(self):
+        a = request("POST", "/contacts", {"first": "a"})["body"]
+        b = request("POST", "/contacts", {"first": "b"})["body"]
+        c = request("POST", "/contacts", {"first": "c"})["body"]
+        result = request("GET", "/contacts/changes")
+        self.assertEqual(200, result["statusCode"])
+        self.assertEqual([a, b, c], result["body"]["changes"])
+        self.assertEqual([], result["body"]["deleted"])
+        self.assertFalse(result["body"]["more"])
+        since = result["body"]["cursor"]
+
+        result = request("GET", "/contacts/changes", query={"since": since})
+        self.assertEqual([], result["body"]["changes"])
+        self.assertEqual(since, result["body"]["cursor"])
+
+        request("PATCH", f"/contacts/{c['id']}", {"first": "x"})
+        request("DELETE", f"/contacts/{b['id']}")
+        request("PATCH", f"/contacts/{a['id']}", {"first": "a"})
+        d = request("POST", "/contacts", {"first": "d"})["body"]
+        request("DELETE", f"/contacts/{d['id']}")
+        result = request("GET", "/contacts/changes", query={"since": since})
+        self.assertEqual(
+            ["x"],
+            [contact["first"] for contact in result["body"]["changes"]],
+        )
+        self.assertEqual([b["id"], d["id"]], result["body"]["deleted"])
+
+    def test_handler_changes_pages(self):
+        for i in range(5):
+            request("POST", "/contacts", {"first": str(i)})
+        request("DELETE", "/contacts/1")
+        pages = []
+        query = {"limit": "2"}
+        while True:
+            result = request("GET", "/contacts/changes", query=query)
+            self.assertEqual(200, result["statusCode"])
+            body = result["body"]
+            pages.append(
+                [contact["id"] for contact in body["changes"]]
+                + [f"-{id}" for id in body["deleted"]]
+            )
+            if not body["more"]:
+                break
+            query = {"limit": "2", "since": body["cursor"]}
+        self.assertEqual([["2", "3"], ["4", "5"], ["-1"]], pages)
+
+    def test_handler_changes_when_invalid(self):
+        for query in [
+            {"limit": "0"},
+            {"limit": "1001"},
+            {"since": "x"},
+            {"since": cursor.encode(["2024-01-01", 1])},
+            {"since": cursor.encode([1])},
+            {"since": cursor.encode([-1, 0])},
+            {"since": cursor.encode([0, 2**63])},
+        ]:
+            with self.subTest(query=query):
+                result = request("GET", "/contacts/changes", query=query)
+                self.assertEqual(400, result["statusCode"])
+
+    def test_handler_changes_with_concurrent_writers(self):
+        # writers do not wait for each other, and a change committed after
+        # a greater one is still read after the cursor of the greater one
+        first = connect()
+        second = connect()
+        try:
+            with second.cursor() as cur:
+                cur.execute("SELECT pg_current_xact_id()")
+            with first.cursor() as cur:
+                cur.execute("INSERT INTO contacts (first) VALUES ('a')")
+            with second.cursor() as cur:
+                cur.execute("SET lock_timeout = '100ms'")
+                cur.execute("INSERT INTO contacts (first) VALUES ('b')")
+            second.commit()
+            result = request("GET", "/contacts/changes")
+            self.assertEqual(
+                ["b"],
+                [contact["first"] for contact in result["body"]["changes"]],
+            )
+            query = {"since": result["body"]["cursor"]}
+            first.commit()
+            result = request("GET", "/contacts/changes", query=query)
+            self.assertEqual(
+                ["a"],
+                [contact["first"] for contact in result["body"]["changes"]],
+            )
+        finally:
+            first.close()
+            second.close()
+
+    def test_handler_batch(self):
+        a = request("POST", "/contacts", {"first": "a"})["body"]
+        b = request("POST", "/contacts", {"first": "b", "notes": "n"})["body"]
+        c = request("POST", "/contacts", {"first": "c"})["body"]
+        result = request(
+            "POST",
+            "/contacts/batch",
+            {
+                "operations": [
+                    {"op": "create", "contact": {"first": "d"}},
+                    {"op": "update", "id": a["id"], "contact": {"last": "x"}},
+                    {"op": "delete", "id": c["id"]},
+                    {"op": "create", "contact": {"favorite": True}},
+                    {
+                        "op": "update",
+                        "id": b["id"],
+                        "contact": {"favorite": True, "notes": None},
+                    },
+                    {"op": "delete", "id": "99"},
+                    {"op": "update", "id": "98", "contact": {}},
+                ]
+            },
+        )
+        self.assertEqual(200, result["statusCode"])
+        results = result["body"]["results"]
+        self.assertEqual(
+            [201, 200, 204, 201, 200, 404, 404],
+            [item["status"] for item in results],
+        )
+        self.assertEqual("4", results[0]["contact"]["id"])
+        self.assertEqual("d", results[0]["contact"]["first"])
+        self.assertEqual("5", results[3]["contact"]["id"])
+        self.assertTrue(results[3]["contact"]["favorite"])
+        self.assertEqual(
+            {**a, "last": "x", "version": 2},
+            {**results[1]["contact"], "updatedAt": a["updatedAt"]},
+        )
+        self.assertEqual(
+            {**b, "favorite": True, "notes": None, "version": 2},
+            {**results[4]["contact"], "updatedAt": b["updatedAt"]},
+        )
+        result = request("GET", "/contacts")
+        self.assertEqual(
+            ["a", "b", "d", None],
+            [contact["first"] for contact in result["body"]["contacts"]],
+        )
+
+    def test_handler_batch_when_invalid(self):
+        created = request("POST", "/contacts", {"first": "a"})["body"]
+        result = request(
+            "POST",
+            "/contacts/batch",
             {
-                "AWS_REGION": "ap-northeast-1",
-                "DB_HOST": "localhost",
+                "operations": [
+                    "create",
+                    {"op": "upsert"},
+                    {"op": "create", "contact": {"unknown": "x"}},
+                    {"op": "update", "id": 1, "contact": {}},
+                    {"op": "delete", "id": created["id"]},
+                    {"op": "update", "id": created["id"], "contact": {}},
+                ]
             },
-        ):
-            result = contacts.handler({}, None)
+        )
+        self.assertEqual(200, result["statusCode"])
+        self.assertEqual(
+            [400, 400, 400, 400, 204, 400],
+            [item["status"] for item in result["body"]["results"]],
+        )
         self.assertEqual(
-            json.dumps({"message": "hello, world."}),
-            result["body"],
+            "Duplicate id",
+            result["body"]["results"][5]["message"],
         )
+        operations = [{"op": "create", "contact": {}}] * 101
+        for body in [None, {}, {"operations": []}, {"operations": operations}]:
+            with self.subTest(body=body):
+                result = request("POST", "/contacts/batch", body)
+                self.assertEqual(400, result["statusCode"])
+        self.assertEqual([], request("GET", "/contacts")["body"]["contacts"])
+
+
+class TestHandlerRouting(unittest.TestCase):
+    def test_handler_when_not_found(self):
+        for method, path in [
+            ("GET", "/"),
+            ("GET", "/other"),
+            ("GET", "/contacts/1/other"),
+            ("GET", "/contacts/1/favorite/x"),
+        ]:
+            with self.subTest(path=path):
+                self.assertEqual(404, request(method, path)["statusCode"])
+
+    def test_handler_when_method_not_allowed(self):
+        for method, path in [
+            ("DELETE", "/contacts"),
+            ("POST", "/contacts/1"),
+            ("GET", "/contacts/1/favorite"),
+            ("GET", "/contacts/batch"),
+        ]:
+            with self.subTest(method=method, path=path):
+                self.assertEqual(405, request(method, path)["statusCode"])
+
+
+class TestAuthorize(unittest.TestCase):
+    def setUp(self):
+        self.jwks = LocalJWKS().__enter__()
+        self.addCleanup(self.jwks.__exit__)
+        self.environ = {
+            "JWT_ISSUER": self.jwks.issuer,
+            "JWT_AUDIENCE": "client-id",
+        }
+        patcher = unittest.mock.patch.object(
+            importlib.import_module("contacts.handler"),
+            "_verifier",
+            None,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def bearer(self, token):
+        return {"authorization": f"Bearer {token}"}
+
+    @requires_database
+    def test_handler(self):
+        truncate("contacts", "contacts_tombstones")
+        contacts.db.reset_connection_manager()
+        self.addCleanup(contacts.db.reset_connection_manager)
+        with unittest.mock.patch.dict(os.environ, ENVIRON | self.environ):
+            headers = self.bearer(self.jwks.sign())
+            claims = contacts.authorize({"headers": headers})
+            self.assertEqual("user-id", claims["sub"])
+            result = request("GET", "/contacts", headers=headers)
+            self.assertEqual(200, result["statusCode"])
+        self.assertEqual(1, self.jwks.requests)
+
+    def test_handler_when_unauthorized(self):
+        with unittest.mock.patch.dict(os.environ, self.environ):
+            for headers in [
+                {},
+                {"authorization": self.jwks.sign()},
+                self.bearer("not a token"),
+                self.bearer(self.jwks.sign(aud="other-client-id")),
+                self.bearer(self.jwks.sign(exp=int(time.time()) - 1)),
+            ]:
+                with self.subTest(headers=headers):
+                    self.assertIsNone(contacts.authorize({"headers": headers}))
+                    result = request("GET", "/contacts", headers=headers)
+                    self.assertEqual(401, result["statusCode"])
+
+    def test_handler_when_key_set_unavailable(self):
+        self.environ["JWT_ISSUER"] = "http://127.0.0.1:1"
+        with unittest.mock.patch.dict(os.environ, self.environ):
+            headers = self.bearer(self.jwks.sign(iss="http://127.0.0.1:1"))
+            result = request("GET", "/contacts", headers=headers)
+            self.assertEqual(503, result["statusCode"])
+
+    def test_handler_without_audience(self):
+        self.environ["JWT_AUDIENCE"] = ""
+        with unittest.mock.patch.dict(os.environ, self.environ):
+            with self.assertRaises(ValueError):
+                request("GET", "/contacts", headers=self.bearer("token"))
@@ -0,0 +1,185 @@
+import base64
+import importlib
+import io
+import json
+import os
+import unittest
+import unittest.mock
+
+import botocore.response
+
+import contacts
+import contacts.db
+
+from .database import ENVIRON, requires_database, truncate
+from .test_handler import request
+
+
+def import_request(body, content_type, **extra):
+    event = {
+        "rawPath": "/contacts/import",
+        "requestContext": {"http": {"method": "POST"}},
+        "headers": {"content-type": content_type},
+        "body": body,
+        "isBase64Encoded": False,
+    }
+    result = contacts.handler(dict(event, **extra), None)
+    if "body" in result:
+        result["body"] = json.loads(result["body"])
+    return result
+
+
+@requires_database
+class TestImport(unittest.TestCase):
+    def setUp(self):
+        patcher = unittest.mock.patch.dict(os.environ, ENVIRON)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        contacts.db.reset_connection_manager()
+        self.addCleanup(contacts.db.reset_connection_manager)
+        truncate("contacts")
+
+    def list_contacts(self):
+        result = request("GET", "/contacts", query={"limit": "200"})
+        return result["body"]["contacts"]
+
+    def test_import_csv(self):
+        body = "\n".join(
+            [
+                "first,last,notes,favorite",
+                "Alice,Smith,,true",
+                'Bob,Jones,"line one\nline two",',
+                "Carol,Brown,,maybe",
+            ]
+        )
+        result = import_request(body, "text/csv; charset=utf-8")
+        self.assertEqual(200, result["statusCode"])
+        self.assertEqual(3, result["body"]["rows"])
+        self.assertEqual(2, result["body"]["inserted"])
+        self.assertEqual(
+            [{"row": 3, "error": "Invalid value for favorite"}],
+            result["body"]["rejects"],
+        )
+        alice, bob = self.list_contacts()
+        self.assertEqual(("Alice", True), (alice["first"], alice["favorite"]))
+        self.assertEqual("line one\nline two", bob["notes"])
+        self.assertFalse(bob["favorite"])
+
+    def test_import_csv_updates(self):
+        created = request("POST", "/contacts", {"first": "a", "last": "b"})
+        id = created["body"]["id"]
+        body = f"id,first\n{id},x\n{id},y\n999,z\n"
+        result = import_request(body, "text/csv")
+        self.assertEqual(1, result["body"]["updated"])
+        self.assertEqual(1, result["body"]["inserted"])
+        self.assertEqual(1, result["body"]["skipped"])
+        updated, inserted = self.list_contacts()
+        # columns missing from the file are left alone
+        self.assertEqual(("y", "b"), (updated["first"], updated["last"]))
+        self.assertEqual("z", inserted["first"])
+        self.assertNotEqual("999", inserted["id"])
+
+    def test_import_csv_when_invalid(self):
+        for body in ["first,unknown\na,b\n", "first,first\na,b\n"]:
+            with self.subTest(body=body):
+                result = import_request(body, "text/csv")
+                self.assertEqual(400, result["statusCode"])
+        self.assertEqual([], self.list_contacts())
+
+    def test_import_csv_rejects(self):
+        body = b"\n".join(
+            [
+                b"first,last",
+                b"Alice,Smith",
+                b"a,b,c",
+                b'"a"b,c',
+                b"a\x00,b",
+                b"\xff,b",
+                b"Bob,Jones",
+            ]
+        )
+        result = import_request(
+            base64.b64encode(body).decode(),
+            "text/csv",
+            isBase64Encoded=True,
+        )
+        self.assertEqual(200, result["statusCode"])
+        self.assertEqual(6, result["body"]["rows"])
+        self.assertEqual(2, result["body"]["inserted"])
+        self.assertEqual(
+            [
+                {"row": 2, "error": "Wrong number of fields"},
+                {"row": 3, "error": "Invalid CSV: ',' expected after '\"'"},
+                {"row": 4, "error": "Invalid character"},
+                {"row": 5, "error": "Invalid UTF-8"},
+            ],
+            result["body"]["rejects"],
+        )
+        self.assertEqual(
+            ["Alice", "Bob"],
+            [contact["first"] for contact in self.list_contacts()],
+        )
+
+    def test_import_ndjson(self):
+        body = "\n".join(
+            [
+                json.dumps({"first": "Alice", "favorite": True}),
+                "",
+                "{not json",
+                json.dumps({"first": "Bob", "unknown": 1}),
+                json.dumps({"first": "Carol", "id": "x"}),
+                json.dumps({"first": "Dave", "notes": 'a,"b"'}),
+                json.dumps({"first": 1}),
+                json.dumps({"first": "Erin", "id": 1}),
+            ]
+        )
+        result = import_request(body, "application/x-ndjson")
+        self.assertEqual(200, result["statusCode"])
+        self.assertEqual(7, result["body"]["rows"])
+        self.assertEqual(2, result["body"]["inserted"])
+        self.assertEqual(
+            [
+                {"row": 2, "error": "Invalid JSON"},
+                {"row": 3, "error": "Unknown field: unknown"},
+                {"row": 4, "error": "Invalid id"},
+                {"row": 6, "error": "Invalid value for first"},
+                {"row": 7, "error": "Invalid id"},
+            ],
+            result["body"]["rejects"],
+        )
+        alice, dave = self.list_contacts()
+        self.assertTrue(alice["favorite"])
+        self.assertEqual('a,"b"', dave["notes"])
+
+    def test_import_from_s3(self):
+        data = b"first,last\nAlice,Smith\n"
+        s3 = unittest.mock.MagicMock()
+        s3.get_object.return_value = {
+            "Body": botocore.response.StreamingBody(
+                io.BytesIO(data),
+                len(data),
+            ),
+        }
+        with unittest.mock.patch.dict(
+            os.environ,
+            {"IMPORT_BUCKET": "imports"},
+        ), unittest.mock.patch.object(
+            # contacts.handler is the function re-exported by the package
+            importlib.import_module("contacts.handler"),
+            "get_s3",
+            return_value=s3,
+        ):
+            result = import_request(
+                json.dumps({"key": "uploads/contacts.csv"}),
+                "application/json",
+            )
+        self.assertEqual(200, result["statusCode"])
+        self.assertEqual(1, result["body"]["inserted"])
+        s3.get_object.assert_called_once_with(
+            Bucket="imports",
+            Key="uploads/contacts.csv",
+        )
+
+    def test_import_when_unsupported(self):
+        result = import_request("", "text/plain")
+        self.assertEqual(415, result["statusCode"])
@@ -0,0 +1,47 @@
+import unittest
+
+import contacts.sql
+
+from .database import ENVIRON, requires_database
+
+STATEMENT = contacts.sql.Statement(
+    "test_add",
+    "SELECT $1 + $2",
+    ["integer", "integer"],
+)
+
+
+@requires_database
+class TestStatement(unittest.TestCase):
+    def setUp(self):
+        self.conn = contacts.sql.PreparedConnection(
+            " ".join(
+                [
+                    f"host={ENVIRON['DB_HOST']}",
+                    f"port={ENVIRON['DB_PORT']}",
+                    f"dbname={ENVIRON['DB_NAME']}",
+                    f"user={ENVIRON['DB_USER']}",
+                    f"password={ENVIRON['DB_PASSWORD']}",
+                ]
+            )
+        )
+        self.addCleanup(self.conn.close)
+
+    def prepared_statements(self):
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT name FROM pg_prepared_statements")
+            return [name for (name,) in cur.fetchall()]
+
+    def test_execute(self):
+        with self.conn.cursor() as cur:
+            self.assertEqual(3, STATEMENT.execute(cur, [1, 2]).fetchone()[0])
+            self.assertEqual(7, STATEMENT.execute(cur, [3, 4]).fetchone()[0])
+        self.assertEqual({"test_add"}, self.conn.prepared)
+        self.assertEqual(["test_add"], self.prepared_statements())
+
+    def test_execute_after_rollback(self):
+        with self.conn.cursor() as cur:
+            STATEMENT.execute(cur, [1, 2])
+        self.conn.rollback()
+        with self.conn.cursor() as cur:
+            self.assertEqual(3, STATEMENT.execute(cur, [1, 2]).fetchone()[0])
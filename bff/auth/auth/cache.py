@@ -0,0 +1,121 @@
+import collections
+import threading
+import time
+from typing import Any, Callable, Hashable, Optional
+
+# (expires_at, size, value)
+Entry = tuple[float, int, Any]
+
+
+class LRUCache(object):
+    """Thread safe LRU cache bounded by entry count, size and age."""
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: int = 8 * 1024 * 1024,
+        ttl: float = 60,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.__max_entries = max_entries
+        self.__max_bytes = max_bytes
+        self.__ttl = ttl
+        self.__clock = clock
+        self.__lock = threading.Lock()
+        self.__entries: collections.OrderedDict[Hashable, Entry]
+        self.__entries = collections.OrderedDict()
+        self.__bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, _, value = entry
+            if expires_at <= self.__clock():
+                self.__remove(key)
+                self.misses += 1
+                return None
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(
+        self,
+        key: Hashable,
+        value: Any,
+        size: int = 0,
+        ttl: Optional[float] = None,
+    ):
+        with self.__lock:
+            self.__put(key, value, size, ttl)
+
+    def add(
+        self,
+        key: Hashable,
+        value: Any,
+        size: int = 0,
+        ttl: Optional[float] = None,
+    ) -> bool:
+        """Put the value unless the key holds one already, atomically.
+
+        Returns whether the value was added.
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None and entry[0] > self.__clock():
+                return False
+            self.__put(key, value, size, ttl)
+            return True
+
+    def delete(self, key: Hashable):
+        with self.__lock:
+            if key in self.__entries:
+                self.__remove(key)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.__bytes = 0
+
+    def stats(self) -> dict:
+        with self.__lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.__entries),
+                "bytes": self.__bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+    def __put(
+        self,
+        key: Hashable,
+        value: Any,
+        size: int,
+        ttl: Optional[float],
+    ):
+        ttl = self.__ttl if ttl is None else min(ttl, self.__ttl)
+        if key in self.__entries:
+            self.__remove(key)
+        if ttl <= 0 or size > self.__max_bytes or self.__max_entries <= 0:
+            return
+        self.__entries[key] = (self.__clock() + ttl, size, value)
+        self.__bytes += size
+        max_entries, max_bytes = self.__max_entries, self.__max_bytes
+        while len(self.__entries) > max_entries or self.__bytes > max_bytes:
+            self.__remove(next(iter(self.__entries)))
+            self.evictions += 1
+
+    def __remove(self, key: Hashable):
+        _, size, _ = self.__entries.pop(key)
+        self.__bytes -= size
@@ -0,0 +1,33 @@
+import concurrent.futures
+from typing import Any, Callable
+
+
+def gather(
+    executor: concurrent.futures.Executor,
+    calls: list[Callable[[], Any]],
+    timeout: float,
+    return_exceptions: bool = False,
+) -> list:
+    """Run independent calls concurrently and return their results in order.
+
+    Every call runs to completion even when another one fails, nothing is
+    cancelled or undone. When all of them finish within ``timeout``
+    seconds, the exception of the first failed call, in the order given, is
+    raised, unlike calls made one after another the later calls have run
+    too. With ``return_exceptions`` the exceptions are returned in place of
+    the results instead, so the caller can undo what did succeed. Otherwise
+    TimeoutError is raised and the calls still pending are not interrupted:
+    they keep running in the executor, within their own client timeouts,
+    and may complete during a later invocation or after the container
+    thaws. Their outcome is unknown, a write may or may not have happened.
+    """
+    futures = [executor.submit(call) for call in calls]
+    _, pending = concurrent.futures.wait(futures, timeout)
+    if pending:
+        raise TimeoutError(
+            f"{len(pending)} of {len(futures)} calls did not finish"
+            + f" within {timeout}s",
+        )
+    if return_exceptions:
+        return [future.exception() or future.result() for future in futures]
+    return [future.result() for future in futures]
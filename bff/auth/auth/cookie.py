@@ -0,0 +1,170 @@
+import base64
+import binascii
+import hashlib
+import http.cookies
+import json
+import os
+import zlib
+from typing import Any, Optional
+
+COOKIE_NAME = "session_tokens"
+# browsers keep at most 4096 bytes per cookie, name and attributes included
+CHUNK_SIZE = 3800
+MAX_CHUNKS = 8
+ATTRIBUTES = "Path=/auth; Secure; HttpOnly; SameSite=Lax"
+EXPIRED = "expires=Thu, 01 Jan 1970 00:00:00 GMT"
+
+# what /auth/session answers with, the refresh token never leaves storage
+ENVELOPE = ("access_token", "id_token", "expiration", "claims")
+
+
+class InvalidCookieException(Exception):
+    pass
+
+
+def key_id(key: bytes) -> str:
+    return hashlib.sha256(key).hexdigest()[:8]
+
+
+class Keyring(object):
+    """Keys of the session cookie, the first one encrypts.
+
+    The others only decrypt, so cookies written before a rotation stay
+    readable until their key is dropped from the ring.
+    """
+
+    def __init__(self, keys: list[bytes]):
+        # imported here, only the cookie mode needs cryptography
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+        if not keys:
+            raise ValueError("The keyring needs at least one key")
+        if any(len(key) != 32 for key in keys):
+            raise ValueError("Session keys must be 32 bytes")
+        self.primary = key_id(keys[0])
+        self.__keys = {key_id(key): AESGCM(key) for key in keys}
+
+    def get(self, kid: str) -> Any:
+        return self.__keys.get(kid)
+
+
+class SessionCookieCodec(object):
+    """Carries the tokens of a session in AES-256-GCM encrypted cookies.
+
+    The envelope is bound to the session id, so it cannot be replayed with
+    another session cookie, and split into as many ``name_<n>`` cookies as
+    it takes to stay under the size limit of a cookie.
+    """
+
+    def __init__(
+        self,
+        keyring: Keyring,
+        name: str = COOKIE_NAME,
+        chunk_size: int = CHUNK_SIZE,
+        max_chunks: int = MAX_CHUNKS,
+    ):
+        self.__keyring = keyring
+        self.__name = name
+        self.__chunk_size = chunk_size
+        self.__max_chunks = max_chunks
+
+    def encode(
+        self,
+        session_id: str,
+        tokens: dict,
+        cookies: Optional[http.cookies.SimpleCookie] = None,
+    ) -> list[str]:
+        """Return the Set-Cookie values carrying the tokens.
+
+        Chunks left over in ``cookies`` from a longer envelope are expired.
+        """
+        envelope = {key: tokens[key] for key in ENVELOPE if key in tokens}
+        payload = zlib.compress(
+            json.dumps(envelope, separators=(",", ":")).encode(),
+        )
+        kid = self.__keyring.primary
+        iv = os.urandom(12)
+        ciphertext = self.__keyring.get(kid).encrypt(
+            iv,
+            payload,
+            f"{kid}.{session_id}".encode(),
+        )
+        value = f"{kid}.{b64encode(iv + ciphertext)}"
+        chunks = []
+        for start in range(0, len(value), self.__chunk_size):
+            end = start + self.__chunk_size
+            chunks.append(value[start:end])
+        if len(chunks) > self.__max_chunks:
+            raise ValueError(
+                f"The session envelope needs {len(chunks)} cookies",
+            )
+        # the first chunk tells how many to read
+        chunks[0] = f"{len(chunks)}.{chunks[0]}"
+        set_cookies = []
+        for i, chunk in enumerate(chunks):
+            set_cookies.append(f"{self.__name}_{i}={chunk}; {ATTRIBUTES}")
+        for name in self.__chunk_names(cookies):
+            if int(name.rpartition("_")[2]) >= len(chunks):
+                set_cookies.append(self.__expire(name))
+        return set_cookies
+
+    def decode(
+        self,
+        session_id: str,
+        cookies: http.cookies.SimpleCookie,
+    ) -> dict:
+        """Return the tokens carried by the cookies.
+
+        Raises InvalidCookieException when they are missing, incomplete,
+        tampered with, bound to another session or encrypted with a key
+        that is no longer in the keyring.
+        """
+        first = cookies.get(f"{self.__name}_0")
+        if first is None:
+            raise InvalidCookieException("No session cookie")
+        count, _, value = first.value.partition(".")
+        if not count.isdigit() or not 0 < int(count) <= self.__max_chunks:
+            raise InvalidCookieException("Malformed session cookie")
+        for i in range(1, int(count)):
+            chunk = cookies.get(f"{self.__name}_{i}")
+            if chunk is None:
+                raise InvalidCookieException("Incomplete session cookie")
+            value += chunk.value
+
+        from cryptography.exceptions import InvalidTag
+
+        kid, _, data = value.partition(".")
+        aead = self.__keyring.get(kid)
+        if aead is None:
+            raise InvalidCookieException("Unknown session cookie key")
+        try:
+            raw = b64decode(data)
+            payload = aead.decrypt(
+                raw[:12],
+                raw[12:],
+                f"{kid}.{session_id}".encode(),
+            )
+        except (InvalidTag, ValueError, binascii.Error) as e:
+            raise InvalidCookieException("Invalid session cookie") from e
+        return json.loads(zlib.decompress(payload))
+
+    def expire(self, cookies: http.cookies.SimpleCookie) -> list[str]:
+        """Return the Set-Cookie values deleting the envelope."""
+        return [self.__expire(name) for name in self.__chunk_names(cookies)]
+
+    def __chunk_names(self, cookies: Optional[http.cookies.SimpleCookie]):
+        if not cookies:
+            return []
+        names = [f"{self.__name}_{i}" for i in range(self.__max_chunks)]
+        return [name for name in names if name in cookies]
+
+    def __expire(self, name: str) -> str:
+        return f"{name}=deleted; {EXPIRED}; {ATTRIBUTES}"
+
+
+def b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
@@ -1,29 +1,50 @@
 import base64
-import datetime
+import functools
 import hashlib
 import http.cookies
 import json
 import logging
-import os
 import urllib.parse
 
-import boto3
-import botocore
-import botocore.exceptions
-from jose import jwt
-
-from .identity import Identity
-from .storage import DataNotFoundException, Storage
+from .cookie import InvalidCookieException
+from .runtime import get_runtime
+from .session import attach_claims, get_claims, refresh_session
+from .state import InvalidStateException
+from .storage import DataNotFoundException
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(
-    level=logging.INFO,
-    format="{asctime} [{levelname:.4}] {name}: {message}",
-    style="{",
-)
+
+
+@functools.cache
+def configure_logging():
+    # on the first invocation rather than on import, so that importing the
+    # package (tests, tools) leaves the logging configuration alone
+    logging.basicConfig(
+        level=logging.INFO,
+        format="{asctime} [{levelname:.4}] {name}: {message}",
+        style="{",
+    )
 
 
 def handler(event, context):
+    configure_logging()
+    try:
+        return route(event, context)
+    except TimeoutError as e:
+        # downstream calls still pending, their outcome is unknown
+        logger.error("Timed out: %s", e)
+        return {
+            "statusCode": 504,
+            "headers": set_security_headers(
+                {
+                    "Content-Type": "application/json",
+                }
+            ),
+            "body": json.dumps({"message": "Timed out."}),
+        }
+
+
+def route(event, context):
     path = event.get("rawPath")
     if path == "/auth/login":
         return handler_login(event, context)
@@ -31,6 +52,10 @@ def handler(event, context):
         return handler_logout(event, context)
     if path == "/auth/session":
         return handler_session(event, context)
+    if path == "/auth/sessions":
+        return handler_sessions(event, context)
+    if path == "/auth/sessions/revoke-all":
+        return handler_revoke_all_sessions(event, context)
     if path == "/auth/authorize":
         return handler_authorize(event, context)
     if path == "/auth/callback":
@@ -42,6 +67,10 @@ def handler(event, context):
 
 
 def handler_login(event, context):
+    # botocore is loaded with the Cognito client anyway, only the routes
+    # which call Cognito pay for it
+    import botocore.exceptions
+
     body = event.get("body")
     if not body:
         return {"statusCode": 400}
@@ -49,27 +78,12 @@ def handler_login(event, context):
         body = base64.b64decode(body).decode("utf-8")
     body = json.loads(body)
 
-    s3_bucket = os.getenv("S3_BUCKET")
-    s3 = boto3.client("s3")
-    st = Storage(s3, s3_bucket)
-
-    cognito_user_pool_id = os.getenv("COGNITO_USER_POOL_ID")
-    cognito_user_pool_domain = os.getenv("COGNITO_USER_POOL_DOMAIN")
-    api_client_secret_id = os.getenv("API_CLIENT_SECRET_ID")
-    cognito_idp = boto3.client("cognito-idp")
-    secretsmanager = boto3.client("secretsmanager")
-
-    idp = Identity(
-        cognito_idp,
-        secretsmanager,
-        cognito_user_pool_id,
-        cognito_user_pool_domain,
-        api_client_secret_id,
-    )
+    rt = get_runtime()
+    idp = rt.identity
 
     try:
-        tokens = idp.login(body["username"], body["password"])
-        claims = jwt.get_unverified_claims(tokens["id_token"])
+        tokens = attach_claims(idp.login(body["username"], body["password"]))
+        claims = tokens["claims"]
         session_id = hashlib.sha256(
             tokens["refresh_token"].encode("utf-8"),
         ).hexdigest()
@@ -78,26 +92,30 @@ def handler_login(event, context):
             claims["sub"],
             session_id,
         )
-        st.save_tokens(session_id, tokens)
+        save_session(rt, claims["sub"], session_id, tokens)
         set_cookie = f"session_id={session_id}"
-        return {
-            "statusCode": 200,
-            "headers": set_security_headers(
-                {
-                    "Content-Type": "application/json",
-                    "Set-Cookie": set_cookie,
-                }
-            ),
-            "body": json.dumps(
-                {
-                    "session": {
-                        "access_token": tokens["access_token"],
-                        "id_token": tokens["id_token"],
-                    },
-                    "claims": claims,
-                }
-            ),
-        }
+        return set_session_cookies(
+            {
+                "statusCode": 200,
+                "headers": set_security_headers(
+                    {
+                        "Content-Type": "application/json",
+                        "Set-Cookie": set_cookie,
+                    }
+                ),
+                "body": json.dumps(
+                    {
+                        "session": {
+                            "access_token": tokens["access_token"],
+                            "id_token": tokens["id_token"],
+                        },
+                        "claims": claims,
+                    }
+                ),
+            },
+            session_id,
+            tokens,
+        )
     except botocore.exceptions.ClientError as e:
         logger.exception(e)
         return {
@@ -119,18 +137,15 @@ def handler_logout(event, context):
     if not session_id:
         return {"statusCode": 401}
 
-    s3_bucket = os.getenv("S3_BUCKET")
-
-    s3 = boto3.client("s3")
-    st = Storage(s3, s3_bucket)
+    st = get_runtime().storage
 
     try:
-        tokens = st.get_tokens(session_id.value)
-        st.delete_tokens(session_id.value)
+        tokens = st.pop_tokens(session_id.value)
     except DataNotFoundException:
         return {"statusCode": 401}
 
-    claims = jwt.get_unverified_claims(tokens["id_token"])
+    claims = get_claims(tokens)
+    st.remove_user_sessions(claims["sub"], [session_id.value])
     logger.info(
         "User %s logged out (session id: %s)",
         claims["sub"],
@@ -138,14 +153,17 @@ def handler_logout(event, context):
     )
 
     set_cookie = "session_id=deleted; expires=Thu, 01 Jan 1970 00:00:00 GMT"
-    return {
-        "statusCode": 200,
-        "headers": set_security_headers(
-            {
-                "Set-Cookie": set_cookie,
-            }
-        ),
-    }
+    return expire_session_cookies(
+        {
+            "statusCode": 200,
+            "headers": set_security_headers(
+                {
+                    "Set-Cookie": set_cookie,
+                }
+            ),
+        },
+        sc,
+    )
 
 
 def handler_authorize(event, context):
@@ -158,38 +176,34 @@ def handler_authorize(event, context):
             "body": "Bad Request",
         }
 
-    s3_bucket = os.getenv("S3_BUCKET")
-    cognito_user_pool_domain = os.getenv("COGNITO_USER_POOL_DOMAIN")
-    api_client_secret_id = os.getenv("API_CLIENT_SECRET_ID")
-
-    s3 = boto3.client("s3")
-    secretsmanager = boto3.client("secretsmanager")
+    rt = get_runtime()
+    cognito_user_pool_domain = rt.config.cognito_user_pool_domain
 
-    secret_response = secretsmanager.get_secret_value(
-        SecretId=api_client_secret_id,
-    )
-
-    secret_value = json.loads(secret_response["SecretString"])
+    redirect_url = query_params.get("redirect_url")
+    codec = rt.state_codec()
+    if codec is not None:
+        state = codec.encode({"redirect_url": redirect_url})
+        secret_value = rt.secrets.get(rt.config.api_client_secret_id)
+    else:
+        request_id = event.get("requestContext").get("requestId")
+        state = base64.b64encode(
+            json.dumps({"request_id": request_id}).encode(),
+        ).decode()
+        secret_value, _ = rt.gather(
+            lambda: rt.secrets.get(rt.config.api_client_secret_id),
+            lambda: rt.storage.save_state(
+                request_id,
+                {"redirect_url": redirect_url},
+            ),
+        )
     client_id = secret_value["client_id"]
     redirect_uri = secret_value["redirect_uri"]
-
-    request_id = event.get("requestContext").get("requestId")
-    redirect_url = query_params.get("redirect_url")
-
-    st = Storage(s3, s3_bucket)
-    st.save_state(request_id, {"redirect_url": redirect_url})
     query = urllib.parse.urlencode(
         {
             "response_type": "code",
             "client_id": client_id,
             "redirect_uri": redirect_uri,
-            "state": base64.b64encode(
-                json.dumps(
-                    {
-                        "request_id": request_id,
-                    }
-                ).encode()
-            ).decode(),
+            "state": state,
             "identity_provider": idp,
             "scope": "openid profile",
         }
@@ -217,33 +231,32 @@ def handler_callback(event, context):
             "body": "Bad Request",
         }
 
-    s3_bucket = os.getenv("S3_BUCKET")
-    s3 = boto3.client("s3")
-    st = Storage(s3, s3_bucket)
-
-    cognito_user_pool_id = os.getenv("COGNITO_USER_POOL_ID")
-    cognito_user_pool_domain = os.getenv("COGNITO_USER_POOL_DOMAIN")
-    api_client_secret_id = os.getenv("API_CLIENT_SECRET_ID")
-    cognito_idp = boto3.client("cognito-idp")
-    secretsmanager = boto3.client("secretsmanager")
-
-    idp = Identity(
-        cognito_idp,
-        secretsmanager,
-        cognito_user_pool_id,
-        cognito_user_pool_domain,
-        api_client_secret_id,
-    )
+    rt = get_runtime()
+    st = rt.storage
+    idp = rt.identity
 
     state = query_string_parameters.get("state")
-    state = json.loads(base64.b64decode(state))
-    request_id = state["request_id"]
-    return_uri = st.get_state(request_id)["redirect_url"]
-
-    tokens = idp.request_tokens_by_code(code)
+    codec = rt.state_codec()
+    if codec is not None:
+        try:
+            return_uri = codec.decode(state or "")["redirect_url"]
+        except InvalidStateException as e:
+            logger.warning("Rejected the OAuth state: %s", e)
+            return {
+                "statusCode": 400,
+                "headers": set_security_headers({}),
+                "body": "Bad Request",
+            }
+        tokens = idp.request_tokens_by_code(code)
+    else:
+        request_id = json.loads(base64.b64decode(state))["request_id"]
+        # the code is only redeemed for a state we issued
+        return_uri = st.get_state(request_id)["redirect_url"]
+        tokens = idp.request_tokens_by_code(code)
+    tokens = attach_claims(tokens)
 
     # トークンの取得に成功した場合
-    claims = jwt.get_unverified_claims(tokens["id_token"])
+    claims = tokens["claims"]
     session_id = hashlib.sha256(
         tokens["refresh_token"].encode("utf-8"),
     ).hexdigest()
@@ -252,21 +265,104 @@ def handler_callback(event, context):
         claims["sub"],
         session_id,
     )
-    st = Storage(s3, s3_bucket)
-    st.save_tokens(session_id, tokens)
+    save_session(rt, claims["sub"], session_id, tokens)
     set_cookie = f"session_id={session_id}"
+    return set_session_cookies(
+        {
+            "statusCode": 302,
+            "headers": set_security_headers(
+                {
+                    "Set-Cookie": set_cookie,
+                    "Location": return_uri if return_uri else "/",
+                }
+            ),
+        },
+        session_id,
+        tokens,
+    )
+
+
+def handler_session(event, context):
+    headers = event.get("headers", {})
+    cookie = headers.get("cookie")
+    sc = http.cookies.SimpleCookie(cookie)
+    session_id = sc.get("session_id")
+    if not session_id:
+        return {"statusCode": 401}
+
+    rt = get_runtime()
+    policy = rt.refresh_policy
+    codec = rt.session_cookie_codec()
+
+    envelope = None
+    if codec is not None:
+        try:
+            envelope = codec.decode(session_id.value, sc)
+        except InvalidCookieException as e:
+            logger.info("Reading the session from storage: %s", e)
+        if envelope is not None and not policy.should_refresh(
+            session_id.value,
+            envelope,
+        ):
+            # answered from the cookie alone, no storage read
+            return session_response(envelope)
+
+    st = rt.storage
+    idp = rt.identity
+
+    try:
+        tokens = st.get_tokens(session_id.value)
+    except DataNotFoundException:
+        return {"statusCode": 401}
+
+    # the policy has already decided for the envelope of the cookie
+    if envelope is not None or policy.should_refresh(
+        session_id.value,
+        tokens,
+    ):
+        try:
+            tokens = refresh_session(
+                st,
+                idp,
+                session_id.value,
+                tokens,
+                policy.threshold_for(session_id.value),
+            )
+        except DataNotFoundException:
+            return {"statusCode": 401}
+        except Exception as e:
+            logger.exception(e)
+            return {"statusCode": 401}
+
+    response = session_response(tokens)
+    if codec is not None:
+        # written again so the next check needs no storage read either
+        response["cookies"] = codec.encode(session_id.value, tokens, sc)
+    return response
+
+
+def session_response(tokens):
+    claims = get_claims(tokens)
     return {
-        "statusCode": 302,
+        "statusCode": 200,
         "headers": set_security_headers(
             {
-                "Set-Cookie": set_cookie,
-                "Location": return_uri if return_uri else "/",
+                "Content-Type": "application/json",
+            }
+        ),
+        "body": json.dumps(
+            {
+                "session": {
+                    "access_token": tokens["access_token"],
+                    "id_token": tokens["id_token"],
+                },
+                "claims": claims,
             }
         ),
     }
 
 
-def handler_session(event, context):
+def handler_sessions(event, context):
     headers = event.get("headers", {})
     cookie = headers.get("cookie")
     sc = http.cookies.SimpleCookie(cookie)
@@ -274,82 +370,115 @@ def handler_session(event, context):
     if not session_id:
         return {"statusCode": 401}
 
-    s3_bucket = os.getenv("S3_BUCKET")
-    s3 = boto3.client("s3")
-    st = Storage(s3, s3_bucket)
-
-    cognito_user_pool_id = os.getenv("COGNITO_USER_POOL_ID")
-    cognito_user_pool_domain = os.getenv("COGNITO_USER_POOL_DOMAIN")
-    api_client_secret_id = os.getenv("API_CLIENT_SECRET_ID")
-    cognito_idp = boto3.client("cognito-idp")
-    secretsmanager = boto3.client("secretsmanager")
-
-    idp = Identity(
-        cognito_idp,
-        secretsmanager,
-        cognito_user_pool_id,
-        cognito_user_pool_domain,
-        api_client_secret_id,
-    )
+    st = get_runtime().storage
 
     try:
         tokens = st.get_tokens(session_id.value)
     except DataNotFoundException:
         return {"statusCode": 401}
 
-    claims = jwt.get_unverified_claims(tokens["id_token"])
+    claims = get_claims(tokens)
+    session_ids = st.list_user_sessions(claims["sub"])
+    return {
+        "statusCode": 200,
+        "headers": set_security_headers(
+            {
+                "Content-Type": "application/json",
+            }
+        ),
+        "body": json.dumps(
+            {
+                "sessions": [
+                    {
+                        # session ids are credentials, never expose them
+                        "id": hashlib.sha256(sid.encode()).hexdigest()[:16],
+                        "current": sid == session_id.value,
+                    }
+                    for sid in session_ids
+                ],
+            }
+        ),
+    }
 
-    if datetime.datetime.fromisoformat(
-        tokens["expiration"],
-    ) > datetime.datetime.now(
-        datetime.timezone.utc
-    ) + datetime.timedelta(minutes=20):
-        return {
-            "statusCode": 200,
-            "headers": set_security_headers(
-                {
-                    "Content-Type": "application/json",
-                }
-            ),
-            "body": json.dumps(
-                {
-                    "session": {
-                        "access_token": tokens["access_token"],
-                        "id_token": tokens["id_token"],
-                    },
-                    "claims": claims,
-                }
-            ),
-        }
+
+def handler_revoke_all_sessions(event, context):
+    headers = event.get("headers", {})
+    cookie = headers.get("cookie")
+    sc = http.cookies.SimpleCookie(cookie)
+    session_id = sc.get("session_id")
+    if not session_id:
+        return {"statusCode": 401}
+
+    rt = get_runtime()
+    st = rt.storage
 
     try:
-        tokens = idp.refresh_tokens(
-            claims["username"],
-            tokens["refresh_token"],
-        )
+        tokens = st.get_tokens(session_id.value)
+    except DataNotFoundException:
+        return {"statusCode": 401}
 
-        claims = jwt.get_unverified_claims(tokens["id_token"])
-        st.save_token(session_id.value, tokens)
-        return {
+    claims = get_claims(tokens)
+    session_ids = st.list_user_sessions(claims["sub"])
+    if session_id.value not in session_ids:
+        session_ids.append(session_id.value)
+    # a session left out of the index could not be revoked again, so the
+    # index is only updated once the sessions are gone
+    st.delete_sessions(session_ids)
+    st.remove_user_sessions(claims["sub"], session_ids)
+    logger.info(
+        "User %s revoked %d sessions",
+        claims["sub"],
+        len(session_ids),
+    )
+
+    set_cookie = "session_id=deleted; expires=Thu, 01 Jan 1970 00:00:00 GMT"
+    return expire_session_cookies(
+        {
             "statusCode": 200,
             "headers": set_security_headers(
                 {
-                    "Content-Type": "application/json",
-                }
-            ),
-            "body": json.dumps(
-                {
-                    "session": {
-                        "access_token": tokens["access_token"],
-                        "id_token": tokens["id_token"],
-                    },
-                    "claims": claims,
+                    "Set-Cookie": set_cookie,
                 }
             ),
-        }
-    except Exception as e:
-        print(e)
-        return {"statusCode": 401}
+        },
+        sc,
+    )
+
+
+def save_session(rt, sub, session_id, tokens):
+    """Save the session and add it to the user's index at the same time.
+
+    When one of the writes fails the other is undone, so the index neither
+    misses a saved session nor lists one that was never saved.
+    """
+    st = rt.storage
+    saved, indexed = rt.gather(
+        lambda: st.save_tokens(session_id, tokens),
+        lambda: st.add_user_session(sub, session_id),
+        return_exceptions=True,
+    )
+    if isinstance(saved, Exception):
+        if not isinstance(indexed, Exception):
+            st.remove_user_sessions(sub, [session_id])
+        raise saved
+    if isinstance(indexed, Exception):
+        st.delete_tokens(session_id)
+        raise indexed
+
+
+def set_session_cookies(response, session_id, tokens):
+    """Carry the tokens in the session cookie too, when in cookie mode."""
+    codec = get_runtime().session_cookie_codec()
+    if codec is not None:
+        response["cookies"] = codec.encode(session_id, tokens)
+    return response
+
+
+def expire_session_cookies(response, sc):
+    codec = get_runtime().session_cookie_codec()
+    if codec is not None:
+        response["cookies"] = codec.expire(sc)
+    return response
 
 
 def set_security_headers(headers):
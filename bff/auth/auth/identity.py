@@ -2,11 +2,18 @@ import base64
 import datetime
 import hashlib
 import hmac
-import json
-from typing import Any
+import logging
+import time
+from typing import Any, Optional
 
 import botocore.exceptions
 import requests
+import requests.adapters
+import urllib3.util
+
+from .secret import SecretCache
+
+logger = logging.getLogger(__name__)
 
 
 def generate_secret_hash(client_id, client_secret, username):
@@ -26,6 +33,62 @@ class TokenRefreshFailedException(Exception):
     pass
 
 
+class InvalidClientException(Exception):
+    pass
+
+
+class TokenRequestFailedException(Exception):
+    def __init__(self, status: int, error: Optional[str]):
+        super().__init__(f"{status} {error}")
+        self.status = status
+        self.error = error
+
+
+def is_invalid_client_error(e: botocore.exceptions.ClientError) -> bool:
+    # Cognito answers with these when the app client in the cached secret
+    # has been rotated away.
+    error = e.response["Error"]
+    if error["Code"] == "ResourceNotFoundException":
+        return True
+    return error["Code"] == "NotAuthorizedException" and (
+        "secret hash" in error.get("Message", "").lower()
+    )
+
+
+def create_http_session(
+    max_retries: int = 2,
+    backoff_factor: float = 0.2,
+    pool_maxsize: int = 10,
+) -> requests.Session:
+    """Session for the Cognito OAuth endpoints.
+
+    The connections are kept alive across invocations of a warm container.
+    Requests are retried with exponential backoff (honouring Retry-After)
+    only when they were not processed: when the connection failed or the
+    answer is 429 or 503. An authorization code can be redeemed once, so a
+    POST that may have reached Cognito, on a read timeout or another 5xx,
+    is never sent again.
+    """
+    retry = urllib3.util.Retry(
+        total=max_retries,
+        connect=max_retries,
+        read=0,
+        other=0,
+        backoff_factor=backoff_factor,
+        status_forcelist=[429, 503],
+        allowed_methods=None,
+        raise_on_status=False,
+    )
+    adapter = requests.adapters.HTTPAdapter(
+        pool_maxsize=pool_maxsize,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
 class Identity(object):
 
     def __init__(
@@ -35,41 +98,48 @@ class Identity(object):
         user_pool_id: str,
         user_pool_domain: str,
         secret_key_id: str,
+        secret_cache: Optional[SecretCache] = None,
+        http: Optional[requests.Session] = None,
+        timeout: tuple[float, float] = (3.05, 10),
     ):
         self.__cognito_idp = cognito_idp
-        self.__secretsmanager = secretsmanager
         self.__user_pool_id = user_pool_id
         self.__user_pool_domain = user_pool_domain
         self.__secret_key_id = secret_key_id
-        self.__client_id = None
-        self.__client_secret = None
-        self.__redirect_uri = None
+        if secret_cache is None:
+            secret_cache = SecretCache(secretsmanager)
+        self.__secrets = secret_cache
+        if http is None:
+            http = create_http_session()
+        self.__http = http
+        # (connect, read) in seconds
+        self.__timeout = timeout
 
-    def __load_secret(self):
-        secret_response = self.__secretsmanager.get_secret_value(
-            SecretId=self.__secret_key_id,
-        )
-
-        secret_value = json.loads(secret_response["SecretString"])
-        self.__client_id = secret_value["client_id"]
-        self.__client_secret = secret_value["client_secret"]
-        self.__redirect_uri = secret_value["redirect_uri"]
+    def __with_secret(self, func):
+        try:
+            return func(self.__secrets.get(self.__secret_key_id))
+        except InvalidClientException:
+            # the secret was rotated; reload it and try once more
+            self.__secrets.invalidate(self.__secret_key_id)
+            return func(self.__secrets.get(self.__secret_key_id))
 
     def login(self, username: str, password: str):
-        if not self.__client_id:
-            self.__load_secret()
+        return self.__with_secret(
+            lambda secret: self.__login(secret, username, password),
+        )
 
+    def __login(self, secret: dict, username: str, password: str):
         try:
             response = self.__cognito_idp.admin_initiate_auth(
                 UserPoolId=self.__user_pool_id,
-                ClientId=self.__client_id,
+                ClientId=secret["client_id"],
                 AuthFlow="ADMIN_USER_PASSWORD_AUTH",
                 AuthParameters={
                     "USERNAME": username,
                     "PASSWORD": password,
                     "SECRET_HASH": generate_secret_hash(
-                        self.__client_id,
-                        self.__client_secret,
+                        secret["client_id"],
+                        secret["client_secret"],
                         username,
                     ),
                 },
@@ -90,31 +160,50 @@ class Identity(object):
                 ).isoformat(),
             }
         except botocore.exceptions.ClientError as e:
+            if is_invalid_client_error(e):
+                raise InvalidClientException(e) from e
             if e.response["Error"]["Code"] in ["NotAuthorizedException"]:
                 raise LoginFailedException(e) from e
             raise e from e
 
     def request_tokens_by_code(self, code: str):
-        if not self.__client_id:
-            self.__load_secret()
+        return self.__with_secret(
+            lambda secret: self.__request_tokens_by_code(secret, code),
+        )
 
+    def __request_tokens_by_code(self, secret: dict, code: str):
         # Cognitoにトークンを要求
         headers = {"Content-type": "application/x-www-form-urlencoded"}
         body = {
             "grant_type": "authorization_code",
             "code": code,
-            "client_id": self.__client_id,
-            "redirect_uri": self.__redirect_uri,
+            "client_id": secret["client_id"],
+            "redirect_uri": secret["redirect_uri"],
         }
 
-        response = requests.post(
-            f"https://{self.__user_pool_domain}/oauth2/token",
+        url = f"https://{self.__user_pool_domain}/oauth2/token"
+        start = time.perf_counter()
+        response = self.__http.post(
+            url,
             data=body,
             headers=headers,
-            auth=(str(self.__client_id), str(self.__client_secret)),
+            auth=(str(secret["client_id"]), str(secret["client_secret"])),
+            timeout=self.__timeout,
+        )
+        logger.info(
+            "POST %s %d in %.1f ms",
+            url,
+            response.status_code,
+            (time.perf_counter() - start) * 1000,
         )
         if response.status_code != 200:
-            raise Exception()
+            try:
+                error = response.json().get("error")
+            except ValueError:
+                error = None
+            if error == "invalid_client":
+                raise InvalidClientException(error)
+            raise TokenRequestFailedException(response.status_code, error)
 
         # トークンの取得に成功した場合
         result = response.json()
@@ -134,19 +223,30 @@ class Identity(object):
         }
 
     def refresh_tokens(self, username: str, refresh_token: str):
-        if not self.__client_id:
-            self.__load_secret()
+        return self.__with_secret(
+            lambda secret: self.__refresh_tokens(
+                secret,
+                username,
+                refresh_token,
+            ),
+        )
 
+    def __refresh_tokens(
+        self,
+        secret: dict,
+        username: str,
+        refresh_token: str,
+    ):
         try:
             response = self.__cognito_idp.admin_initiate_auth(
                 UserPoolId=self.__user_pool_id,
-                ClientId=self.__client_id,
+                ClientId=secret["client_id"],
                 AuthFlow="REFRESH_TOKEN_AUTH",
                 AuthParameters={
                     "REFRESH_TOKEN": refresh_token,
                     "SECRET_HASH": generate_secret_hash(
-                        self.__client_id,
-                        self.__client_secret,
+                        secret["client_id"],
+                        secret["client_secret"],
                         username,
                     ),
                 },
@@ -167,4 +267,6 @@ class Identity(object):
                 ).isoformat(),
             }
         except botocore.exceptions.ClientError as e:
+            if is_invalid_client_error(e):
+                raise InvalidClientException(e) from e
             raise TokenRefreshFailedException(e) from e
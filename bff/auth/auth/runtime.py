@@ -0,0 +1,304 @@
+import base64
+import os
+import threading
+from typing import TYPE_CHECKING, Any, Callable, Mapping, Optional
+
+from .cache import LRUCache
+from .cookie import Keyring, SessionCookieCodec
+from .secret import SecretCache
+from .session import RefreshPolicy, is_session_id
+from .state import StateCodec
+from .storage import CachedStorage, DynamoDBStorage, S3Storage, Storage
+
+if TYPE_CHECKING:
+    import concurrent.futures
+
+    from .identity import Identity
+
+
+class Config(object):
+    def __init__(self, environ: Mapping[str, str]):
+        self.session_storage = environ.get("SESSION_STORAGE", "s3")
+        self.s3_bucket = environ.get("S3_BUCKET", "")
+        self.dynamodb_table = environ.get("DYNAMODB_TABLE", "")
+        self.session_ttl = int(
+            environ.get("SESSION_TTL_SECONDS", str(30 * 24 * 60 * 60)),
+        )
+        self.oauth_state_ttl = int(
+            environ.get("OAUTH_STATE_TTL_SECONDS", "600"),
+        )
+        self.oauth_state_mode = environ.get("OAUTH_STATE_MODE", "storage")
+        self.oauth_state_key_secret_id = environ.get(
+            "OAUTH_STATE_KEY_SECRET_ID",
+            "",
+        )
+        self.session_mode = environ.get("SESSION_MODE", "storage")
+        self.session_keys_secret_id = environ.get("SESSION_KEYS_SECRET_ID", "")
+        self.oauth_state_nonce_cache_size = int(
+            environ.get("OAUTH_STATE_NONCE_CACHE_SIZE", "10000"),
+        )
+        self.cognito_user_pool_id = environ.get("COGNITO_USER_POOL_ID", "")
+        self.cognito_user_pool_domain = environ.get(
+            "COGNITO_USER_POOL_DOMAIN",
+            "",
+        )
+        self.api_client_secret_id = environ.get("API_CLIENT_SECRET_ID", "")
+        self.cognito_connect_timeout = float(
+            environ.get("COGNITO_CONNECT_TIMEOUT_SECONDS", "3.05"),
+        )
+        self.cognito_read_timeout = float(
+            environ.get("COGNITO_READ_TIMEOUT_SECONDS", "10"),
+        )
+        self.cognito_max_retries = int(
+            environ.get("COGNITO_MAX_RETRIES", "2"),
+        )
+        self.secret_ttl = float(environ.get("SECRET_CACHE_TTL_SECONDS", "300"))
+        self.session_cache_max_entries = int(
+            environ.get("SESSION_CACHE_MAX_ENTRIES", "1024"),
+        )
+        self.session_cache_max_bytes = int(
+            environ.get("SESSION_CACHE_MAX_BYTES", str(8 * 1024 * 1024)),
+        )
+        self.session_cache_ttl = float(
+            environ.get("SESSION_CACHE_TTL_SECONDS", "60"),
+        )
+        self.negative_cache_max_entries = int(
+            environ.get("SESSION_NEGATIVE_CACHE_MAX_ENTRIES", "10000"),
+        )
+        self.negative_cache_ttl = float(
+            environ.get("SESSION_NEGATIVE_CACHE_TTL_SECONDS", "30"),
+        )
+        self.io_max_workers = int(environ.get("IO_MAX_WORKERS", "4"))
+        self.io_timeout = float(environ.get("IO_TIMEOUT_SECONDS", "10"))
+        self.refresh_threshold = float(
+            environ.get("SESSION_REFRESH_THRESHOLD_SECONDS", str(20 * 60)),
+        )
+        self.refresh_jitter = float(
+            environ.get("SESSION_REFRESH_JITTER_SECONDS", str(10 * 60)),
+        )
+        self.refresh_max_per_second = float(
+            environ.get("SESSION_REFRESH_MAX_PER_SECOND", "0"),
+        )
+
+
+class Runtime(object):
+    """Clients and services shared by every invocation of a container.
+
+    Everything is built on first use so that routes which do not need a
+    client never pay for creating it.
+    """
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.__lock = threading.RLock()
+        self.__clients: dict[str, Any] = {}
+        self.__secrets: Optional[SecretCache] = None
+        self.__storage: Optional[Storage] = None
+        self.__identity: Optional["Identity"] = None
+        self.__refresh_policy: Optional[RefreshPolicy] = None
+        self.__state_nonces: Optional[LRUCache] = None
+        self.__cookie_codec: Optional[tuple[dict, SessionCookieCodec]] = None
+        self.__executor: Optional["concurrent.futures.ThreadPoolExecutor"]
+        self.__executor = None
+
+    def client(self, service_name: str) -> Any:
+        client = self.__clients.get(service_name)
+        if client is None:
+            # boto3's default session is not thread safe
+            with self.__lock:
+                client = self.__clients.get(service_name)
+                if client is None:
+                    import boto3
+
+                    client = boto3.client(service_name)  # type: ignore
+                    self.__clients[service_name] = client
+        return client
+
+    @property
+    def executor(self) -> "concurrent.futures.ThreadPoolExecutor":
+        """Threads overlapping the independent downstream calls."""
+        if self.__executor is None:
+            with self.__lock:
+                if self.__executor is None:
+                    import concurrent.futures
+
+                    self.__executor = concurrent.futures.ThreadPoolExecutor(
+                        self.config.io_max_workers,
+                        thread_name_prefix="auth-io",
+                    )
+        return self.__executor
+
+    def gather(
+        self,
+        *calls: Callable[[], Any],
+        return_exceptions: bool = False,
+    ) -> list:
+        from .concurrency import gather
+
+        return gather(
+            self.executor,
+            list(calls),
+            self.config.io_timeout,
+            return_exceptions,
+        )
+
+    @property
+    def secrets(self) -> SecretCache:
+        if self.__secrets is None:
+            with self.__lock:
+                if self.__secrets is None:
+                    self.__secrets = SecretCache(
+                        self.client("secretsmanager"),
+                        self.config.secret_ttl,
+                    )
+        return self.__secrets
+
+    @property
+    def storage(self) -> Storage:
+        if self.__storage is None:
+            with self.__lock:
+                if self.__storage is None:
+                    self.__storage = self.__create_storage()
+        return self.__storage
+
+    def __create_storage(self) -> Storage:
+        storage: Storage
+        if self.config.session_storage == "dynamodb":
+            storage = DynamoDBStorage(
+                self.client("dynamodb"),
+                self.config.dynamodb_table,
+                self.config.session_ttl,
+                self.config.oauth_state_ttl,
+            )
+        elif self.config.session_storage == "s3":
+            storage = S3Storage(self.client("s3"), self.config.s3_bucket)
+        else:
+            raise ValueError(
+                f"Unknown SESSION_STORAGE: {self.config.session_storage}",
+            )
+        negative = None
+        if self.config.negative_cache_max_entries > 0:
+            negative = LRUCache(
+                self.config.negative_cache_max_entries,
+                ttl=self.config.negative_cache_ttl,
+            )
+        # even without caches, malformed ids never reach the storage
+        return CachedStorage(
+            storage,
+            LRUCache(
+                self.config.session_cache_max_entries,
+                self.config.session_cache_max_bytes,
+                self.config.session_cache_ttl,
+            ),
+            negative=negative,
+            validate=is_session_id,
+        )
+
+    @property
+    def identity(self) -> "Identity":
+        if self.__identity is None:
+            with self.__lock:
+                if self.__identity is None:
+                    # requests is only needed by the routes calling Cognito
+                    from .identity import Identity, create_http_session
+
+                    self.__identity = Identity(
+                        self.client("cognito-idp"),
+                        self.client("secretsmanager"),
+                        self.config.cognito_user_pool_id,
+                        self.config.cognito_user_pool_domain,
+                        self.config.api_client_secret_id,
+                        self.secrets,
+                        create_http_session(self.config.cognito_max_retries),
+                        (
+                            self.config.cognito_connect_timeout,
+                            self.config.cognito_read_timeout,
+                        ),
+                    )
+        return self.__identity
+
+    @property
+    def refresh_policy(self) -> RefreshPolicy:
+        if self.__refresh_policy is None:
+            with self.__lock:
+                if self.__refresh_policy is None:
+                    self.__refresh_policy = RefreshPolicy(
+                        self.config.refresh_threshold,
+                        self.config.refresh_jitter,
+                        self.config.refresh_max_per_second,
+                    )
+        return self.__refresh_policy
+
+    def state_codec(self) -> Optional[StateCodec]:
+        """The codec of the OAuth state, None when it is kept in storage.
+
+        The key is read through the secret cache on every call, so a
+        rotated key is picked up once the cached secret expires.
+        """
+        mode = self.config.oauth_state_mode
+        if mode == "storage":
+            return None
+        if mode not in ("signed", "encrypted"):
+            raise ValueError(f"Unknown OAUTH_STATE_MODE: {mode}")
+        if self.__state_nonces is None:
+            with self.__lock:
+                if self.__state_nonces is None:
+                    self.__state_nonces = LRUCache(
+                        self.config.oauth_state_nonce_cache_size,
+                        ttl=self.config.oauth_state_ttl,
+                    )
+        secret = self.secrets.get(self.config.oauth_state_key_secret_id)
+        key = secret["state_key"]
+        return StateCodec(
+            base64.urlsafe_b64decode(key + "=" * (-len(key) % 4)),
+            self.config.oauth_state_ttl,
+            mode == "encrypted",
+            self.__state_nonces,
+        )
+
+    def session_cookie_codec(self) -> Optional[SessionCookieCodec]:
+        """The codec of the session cookie, None unless in cookie mode.
+
+        The codec is rebuilt whenever the secret cache reloads the keys, so
+        a rotation is picked up without a new container.
+        """
+        mode = self.config.session_mode
+        if mode == "storage":
+            return None
+        if mode != "cookie":
+            raise ValueError(f"Unknown SESSION_MODE: {mode}")
+        secret = self.secrets.get(self.config.session_keys_secret_id)
+        cached = self.__cookie_codec
+        if cached is not None and cached[0] is secret:
+            return cached[1]
+        keys = [
+            base64.urlsafe_b64decode(key + "=" * (-len(key) % 4))
+            for key in secret["session_keys"]
+        ]
+        codec = SessionCookieCodec(Keyring(keys))
+        self.__cookie_codec = (secret, codec)
+        return codec
+
+
+_lock = threading.Lock()
+_runtime: Optional[Runtime] = None
+
+
+def get_runtime() -> Runtime:
+    global _runtime
+    if _runtime is None:
+        with _lock:
+            if _runtime is None:
+                _runtime = Runtime(Config(os.environ))
+    return _runtime
+
+
+def reset_runtime():
+    """Drop the cached runtime so the next call rebuilds it.
+
+    Intended for tests, where the environment and the moto backends
+    change between test cases.
+    """
+    global _runtime
+    with _lock:
+        _runtime = None
@@ -0,0 +1,61 @@
+import json
+import threading
+import time
+from typing import Any, Callable
+
+
+class SecretCache(object):
+    """Process-wide cache of JSON secrets stored in Secrets Manager.
+
+    Values are reloaded lazily once their TTL has passed, and concurrent
+    callers asking for the same expired secret share a single request.
+    """
+
+    def __init__(
+        self,
+        secretsmanager: Any,
+        ttl: float = 300,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.__secretsmanager = secretsmanager
+        self.__ttl = ttl
+        self.__clock = clock
+        self.__lock = threading.Lock()
+        self.__loading: dict[str, threading.Lock] = {}
+        self.__entries: dict[str, tuple[float, dict]] = {}
+
+    def get(self, secret_id: str) -> dict:
+        value = self.__lookup(secret_id)
+        if value is not None:
+            return value
+
+        with self.__lock:
+            loading = self.__loading.setdefault(secret_id, threading.Lock())
+        with loading:
+            # another caller may have loaded it while we were waiting
+            value = self.__lookup(secret_id)
+            if value is not None:
+                return value
+            secret_response = self.__secretsmanager.get_secret_value(
+                SecretId=secret_id,
+            )
+            value = json.loads(secret_response["SecretString"])
+            with self.__lock:
+                self.__entries[secret_id] = (
+                    self.__clock() + self.__ttl,
+                    value,
+                )
+            return value
+
+    def invalidate(self, secret_id: str):
+        with self.__lock:
+            self.__entries.pop(secret_id, None)
+
+    def __lookup(self, secret_id: str):
+        entry = self.__entries.get(secret_id)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= self.__clock():
+            return None
+        return value
@@ -0,0 +1,173 @@
+import datetime
+import hashlib
+import re
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Optional
+
+from .storage import Storage
+
+if TYPE_CHECKING:
+    from .identity import Identity
+
+# the hex sha256 of the refresh token, see handler_login
+SESSION_ID = re.compile(r"[0-9a-f]{64}")
+
+
+class SessionRefreshFailedException(Exception):
+    pass
+
+
+def is_session_id(value: str) -> bool:
+    return SESSION_ID.fullmatch(value) is not None
+
+
+def expires_within(
+    tokens: dict,
+    seconds: float,
+    now: Optional[datetime.datetime] = None,
+) -> bool:
+    if now is None:
+        now = datetime.datetime.now(datetime.timezone.utc)
+    expiration = datetime.datetime.fromisoformat(tokens["expiration"])
+    return expiration <= now + datetime.timedelta(seconds=seconds)
+
+
+def attach_claims(tokens: dict) -> dict:
+    """Return the tokens with the decoded id token claims stored alongside.
+
+    Saving the claims with the session spares every request that reads it
+    from decoding the id token again.
+    """
+    # jose takes longer to import than most routes take to run
+    from jose import jwt
+
+    claims = jwt.get_unverified_claims(tokens["id_token"])
+    return {**tokens, "claims": claims}
+
+
+def get_claims(tokens: dict) -> dict:
+    claims = tokens.get("claims")
+    if claims is None:
+        # sessions saved before the claims were stored with the tokens
+        from jose import jwt
+
+        claims = jwt.get_unverified_claims(tokens["id_token"])
+    return claims
+
+
+class RefreshPolicy(object):
+    """Decides when the tokens of a session should be refreshed.
+
+    Each session refreshes ``threshold`` seconds before its tokens expire
+    plus a stable per-session share of ``jitter``, so that sessions created
+    together do not all refresh in the same minute. When
+    ``max_per_second`` is set, refreshes of still valid tokens beyond that
+    rate are deferred to a later request.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 20 * 60,
+        jitter: float = 0,
+        max_per_second: float = 0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.threshold = threshold
+        self.jitter = jitter
+        self.__max_per_second = max_per_second
+        self.__clock = clock
+        self.__lock = threading.Lock()
+        self.__allowance = max(max_per_second, 1)
+        self.__last = clock()
+
+    def threshold_for(self, session_id: str) -> float:
+        if not self.jitter:
+            return self.threshold
+        digest = hashlib.sha256(session_id.encode()).digest()
+        share = int.from_bytes(digest[:4], "big") / 0xFFFFFFFF
+        return self.threshold + self.jitter * share
+
+    def should_refresh(
+        self,
+        session_id: str,
+        tokens: dict,
+        now: Optional[datetime.datetime] = None,
+    ) -> bool:
+        if expires_within(tokens, 0, now):
+            return True
+        if not expires_within(tokens, self.threshold_for(session_id), now):
+            return False
+        return self.__take()
+
+    def __take(self) -> bool:
+        if not self.__max_per_second:
+            return True
+        with self.__lock:
+            now = self.__clock()
+            self.__allowance = min(
+                max(self.__max_per_second, 1),
+                self.__allowance + (now - self.__last) * self.__max_per_second,
+            )
+            self.__last = now
+            if self.__allowance < 1:
+                return False
+            self.__allowance -= 1
+            return True
+
+
+def refresh_session(
+    st: Storage,
+    idp: "Identity",
+    session_id: str,
+    tokens: dict,
+    threshold: float,
+    lease_ttl: int = 10,
+    wait: float = 2.0,
+    interval: float = 0.1,
+) -> dict:
+    """Refresh the tokens of the session, at most once at a time.
+
+    Only the invocation holding the refresh lease calls Cognito. Others
+    answer with the current tokens while they are still valid, or wait up
+    to ``wait`` seconds for the lease holder to store the new ones.
+    """
+    lease = st.acquire_refresh_lease(session_id, lease_ttl)
+    if lease is None:
+        if not expires_within(tokens, 0):
+            return tokens
+        return wait_for_refresh(st, session_id, wait, interval)
+
+    try:
+        # somebody may have refreshed it since we read it
+        tokens = st.get_tokens(session_id)
+        if not expires_within(tokens, threshold):
+            return tokens
+        claims = get_claims(tokens)
+        tokens = attach_claims(
+            idp.refresh_tokens(
+                claims.get("cognito:username") or claims["username"],
+                tokens["refresh_token"],
+            )
+        )
+        st.save_tokens(session_id, tokens)
+        return tokens
+    finally:
+        st.release_refresh_lease(session_id, lease)
+
+
+def wait_for_refresh(
+    st: Storage,
+    session_id: str,
+    wait: float,
+    interval: float,
+) -> dict:
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        time.sleep(interval)
+        tokens = st.get_tokens(session_id)
+        if not expires_within(tokens, 0):
+            return tokens
+    raise SessionRefreshFailedException(
+        f"Timed out waiting for session {session_id} to be refreshed",
+    )
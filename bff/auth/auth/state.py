@@ -0,0 +1,108 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import os
+import time
+from typing import Callable, Optional
+
+from .cache import LRUCache
+
+
+class InvalidStateException(Exception):
+    pass
+
+
+def b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def b64decode(data: str) -> bytes:
+    try:
+        return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+    except (binascii.Error, ValueError) as e:
+        raise InvalidStateException("Malformed state") from e
+
+
+class StateCodec(object):
+    """Self-contained OAuth ``state``, so the flow needs no storage.
+
+    The token carries the data, an expiry and a random nonce. It is signed
+    with HMAC-SHA256, or encrypted with AES-256-GCM when ``encrypt`` is
+    set so the data is not readable in the URL either. Decoding a token
+    records its nonce in ``nonces`` until the token expires, a token seen
+    again is rejected. The cache lives in one container and is bounded, so
+    this stops replays within a container, while the authorization code
+    itself can only ever be redeemed once.
+    """
+
+    def __init__(
+        self,
+        key: bytes,
+        ttl: int = 600,
+        encrypt: bool = False,
+        nonces: Optional[LRUCache] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        if len(key) != 32:
+            raise ValueError("The state key must be 32 bytes")
+        self.__key = key
+        self.__ttl = ttl
+        self.__encrypt = encrypt
+        self.__nonces = nonces if nonces is not None else LRUCache(ttl=ttl)
+        self.__clock = clock
+
+    def encode(self, data: dict) -> str:
+        payload = json.dumps(
+            {
+                "d": data,
+                "n": b64encode(os.urandom(16)),
+                "e": int(self.__clock()) + self.__ttl,
+            },
+            separators=(",", ":"),
+        ).encode()
+        if self.__encrypt:
+            # imported here, the signed mode does not need cryptography
+            from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+            iv = os.urandom(12)
+            ciphertext = AESGCM(self.__key).encrypt(iv, payload, None)
+            return b64encode(iv + ciphertext)
+        body = b64encode(payload)
+        return f"{body}.{self.__sign(body)}"
+
+    def decode(self, token: str) -> dict:
+        """Return the data of the token, once.
+
+        Raises InvalidStateException when the token was tampered with, has
+        expired or has been used already.
+        """
+        if self.__encrypt:
+            from cryptography.exceptions import InvalidTag
+            from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+            data = b64decode(token)
+            iv, ciphertext = data[:12], data[12:]
+            try:
+                payload = AESGCM(self.__key).decrypt(iv, ciphertext, None)
+            except (InvalidTag, ValueError) as e:
+                raise InvalidStateException("Invalid state") from e
+        else:
+            body, _, signature = token.partition(".")
+            expected = self.__sign(body).encode()
+            if not hmac.compare_digest(signature.encode(), expected):
+                raise InvalidStateException("Invalid state")
+            payload = b64decode(body)
+
+        state = json.loads(payload)
+        remaining = state["e"] - self.__clock()
+        if remaining <= 0:
+            raise InvalidStateException("Expired state")
+        if not self.__nonces.add(state["n"], True, ttl=remaining):
+            raise InvalidStateException("Replayed state")
+        return state["d"]
+
+    def __sign(self, body: str) -> str:
+        digest = hmac.new(self.__key, body.encode(), hashlib.sha256).digest()
+        return b64encode(digest)
@@ -1,13 +1,106 @@
+import abc
+import datetime
 import json
+import logging
+import time
+import uuid
+from typing import TYPE_CHECKING, Callable, Optional
 
-import botocore.exceptions
+from .cache import LRUCache
+
+if TYPE_CHECKING:
+    import botocore.exceptions
+
+logger = logging.getLogger(__name__)
 
 
 class DataNotFoundException(Exception):
     pass
 
 
-class Storage(object):
+CONDITIONAL_CHECK_FAILED = "ConditionalCheckFailedException"
+PRECONDITION_FAILED = ["PreconditionFailed", "ConditionalRequestConflict"]
+LEASE_AVAILABLE = "attribute_not_exists(pk) OR expires_at <= :now"
+
+
+def client_error() -> "type[botocore.exceptions.ClientError]":
+    # An except clause evaluates its type only once something was raised,
+    # so botocore is not imported until a call fails. It comes with the
+    # client the storage is given anyway, this keeps it off the import.
+    import botocore.exceptions
+
+    return botocore.exceptions.ClientError
+
+
+def chunked(items: list, size: int):
+    for start in range(0, len(items), size):
+        end = start + size
+        yield items[start:end]
+
+
+class Storage(abc.ABC):
+    @abc.abstractmethod
+    def save_tokens(self, session_id: str, data: dict):
+        pass
+
+    @abc.abstractmethod
+    def get_tokens(self, session_id: str) -> dict:
+        pass
+
+    @abc.abstractmethod
+    def delete_tokens(self, session_id: str):
+        """Delete the session if it exists."""
+
+    @abc.abstractmethod
+    def pop_tokens(self, session_id: str) -> dict:
+        """Delete the session and return the tokens it held."""
+
+    @abc.abstractmethod
+    def delete_sessions(self, session_ids: list[str]):
+        """Delete many sessions with as few requests as possible."""
+
+    @abc.abstractmethod
+    def add_user_session(self, sub: str, session_id: str):
+        """Record the session in the index of sessions of the user."""
+
+    @abc.abstractmethod
+    def list_user_sessions(self, sub: str) -> list[str]:
+        """Return the ids of the sessions of the user.
+
+        The index is not pruned when sessions expire on their own, so it
+        may contain ids of sessions which no longer exist.
+        """
+
+    @abc.abstractmethod
+    def remove_user_sessions(self, sub: str, session_ids: list[str]):
+        """Remove the sessions from the index of sessions of the user."""
+
+    @abc.abstractmethod
+    def acquire_refresh_lease(
+        self,
+        session_id: str,
+        ttl: int,
+    ) -> Optional[str]:
+        """Try to become the only refresher of the session for ``ttl`` secs.
+
+        Returns an opaque lease to pass to ``release_refresh_lease``, or
+        None when somebody else holds the lease.
+        """
+
+    @abc.abstractmethod
+    def release_refresh_lease(self, session_id: str, lease: str):
+        pass
+
+    @abc.abstractmethod
+    def save_state(self, request_id: str, data: dict):
+        pass
+
+    @abc.abstractmethod
+    def get_state(self, request_id: str) -> dict:
+        pass
+
+
+class S3Storage(Storage):
     def __init__(self, s3, bucket: str):
         self.__s3 = s3
         self.__bucket = bucket
@@ -26,26 +119,156 @@ class Storage(object):
                 Key=f"sessions/{session_id}/tokens.json",
             )
             return json.loads(res["Body"].read())
-        except botocore.exceptions.ClientError as e:
+        except client_error() as e:
             if e.response["Error"]["Code"] in ["404", "NoSuchKey"]:
                 raise DataNotFoundException()
             raise Exception(e) from e
 
     def delete_tokens(self, session_id: str):
         try:
-            self.__s3.head_object(
+            self.__s3.delete_object(
                 Bucket=self.__bucket,
                 Key=f"sessions/{session_id}/tokens.json",
             )
-            self.__s3.delete_object(
+        except client_error() as e:
+            raise Exception(e) from e
+
+    def pop_tokens(self, session_id: str) -> dict:
+        # S3 has no atomic read-and-delete, a GET and a DELETE is the least
+        data = self.get_tokens(session_id)
+        self.delete_tokens(session_id)
+        return data
+
+    def delete_sessions(self, session_ids: list[str]):
+        for chunk in chunked(session_ids, 1000):
+            try:
+                res = self.__s3.delete_objects(
+                    Bucket=self.__bucket,
+                    Delete={
+                        "Objects": [
+                            {"Key": f"sessions/{session_id}/tokens.json"}
+                            for session_id in chunk
+                        ],
+                        "Quiet": True,
+                    },
+                )
+            except client_error() as e:
+                raise Exception(e) from e
+            if res.get("Errors"):
+                raise Exception(res["Errors"])
+
+    def add_user_session(self, sub: str, session_id: str):
+        self.__s3.put_object(
+            Bucket=self.__bucket,
+            Key=f"users/{sub}/sessions/{session_id}",
+            Body=b"",
+        )
+
+    def list_user_sessions(self, sub: str) -> list[str]:
+        prefix = f"users/{sub}/sessions/"
+        paginator = self.__s3.get_paginator("list_objects_v2")
+        try:
+            return [
+                content["Key"].removeprefix(prefix)
+                for page in paginator.paginate(
+                    Bucket=self.__bucket,
+                    Prefix=prefix,
+                )
+                for content in page.get("Contents", [])
+            ]
+        except client_error() as e:
+            raise Exception(e) from e
+
+    def remove_user_sessions(self, sub: str, session_ids: list[str]):
+        for chunk in chunked(session_ids, 1000):
+            try:
+                res = self.__s3.delete_objects(
+                    Bucket=self.__bucket,
+                    Delete={
+                        "Objects": [
+                            {"Key": f"users/{sub}/sessions/{session_id}"}
+                            for session_id in chunk
+                        ],
+                        "Quiet": True,
+                    },
+                )
+            except client_error() as e:
+                raise Exception(e) from e
+            if res.get("Errors"):
+                raise Exception(res["Errors"])
+
+    def acquire_refresh_lease(
+        self,
+        session_id: str,
+        ttl: int,
+    ) -> Optional[str]:
+        # Generations of lock objects, each created at most once with
+        # IfNoneMatch. The next one is only created once the latest has
+        # been released or has expired, so of the invocations taking over a
+        # lock only one gets it, and a lock holds for its whole ttl. A lock
+        # left behind by a crashed invocation expires with its generation.
+        # The lease is the key of the generation.
+        prefix = f"sessions/{session_id}/refresh/"
+        now = int(time.time())
+        try:
+            keys = self.__list_keys(prefix)
+            generation = max(
+                (int(key.removeprefix(prefix).split(".")[0]) for key in keys),
+                default=-1,
+            )
+            released = f"{prefix}{generation:012d}.released"
+            if generation >= 0 and released not in keys:
+                res = self.__s3.get_object(
+                    Bucket=self.__bucket,
+                    Key=f"{prefix}{generation:012d}.lock",
+                )
+                if json.loads(res["Body"].read())["expires_at"] > now:
+                    return None
+            key = f"{prefix}{generation + 1:012d}.lock"
+            self.__s3.put_object(
                 Bucket=self.__bucket,
-                Key=f"sessions/{session_id}/tokens.json",
+                Key=key,
+                Body=json.dumps({"expires_at": now + ttl}).encode(),
+                IfNoneMatch="*",
             )
-        except botocore.exceptions.ClientError as e:
-            if e.response["Error"]["Code"] in ["404", "NoSuchKey"]:
-                raise DataNotFoundException()
+            return key
+        except client_error() as e:
+            # taken or cleaned up by somebody else in the meantime
+            if e.response["Error"]["Code"] in PRECONDITION_FAILED + [
+                "404",
+                "NoSuchKey",
+            ]:
+                return None
+            raise Exception(e) from e
+
+    def release_refresh_lease(self, session_id: str, lease: str):
+        prefix = f"sessions/{session_id}/refresh/"
+        if not lease.startswith(prefix) or not lease.endswith(".lock"):
+            return
+        released = lease.removesuffix(".lock") + ".released"
+        try:
+            self.__s3.put_object(
+                Bucket=self.__bucket,
+                Key=released,
+                Body=b"",
+            )
+            # the marker alone keeps the generation, keys sort by it
+            stale = [key for key in self.__list_keys(prefix) if key < released]
+            if stale:
+                self.__s3.delete_objects(
+                    Bucket=self.__bucket,
+                    Delete={
+                        "Objects": [{"Key": key} for key in stale],
+                        "Quiet": True,
+                    },
+                )
+        except client_error() as e:
             raise Exception(e) from e
 
+    def __list_keys(self, prefix: str) -> list[str]:
+        res = self.__s3.list_objects_v2(Bucket=self.__bucket, Prefix=prefix)
+        return [obj["Key"] for obj in res.get("Contents", [])]
+
     def save_state(self, request_id: str, data: dict):
         self.__s3.put_object(
             Bucket=self.__bucket,
@@ -60,7 +283,362 @@ class Storage(object):
                 Key=f"oauth2/{request_id}/state.json",
             )
             return json.loads(res["Body"].read())
-        except botocore.exceptions.ClientError as e:
+        except client_error() as e:
             if e.response["Error"]["Code"] in ["404", "NoSuchKey"]:
                 raise DataNotFoundException()
             raise Exception(e) from e
+
+
+class DynamoDBStorage(Storage):
+    """Storage on a DynamoDB table with a string partition key ``pk``.
+
+    Items carry their expiry in ``expires_at`` (epoch seconds), which is
+    meant to be configured as the TTL attribute of the table. DynamoDB
+    removes expired items lazily, so reads check the expiry themselves.
+    """
+
+    def __init__(
+        self,
+        dynamodb,
+        table: str,
+        session_ttl: int = 30 * 24 * 60 * 60,
+        state_ttl: int = 10 * 60,
+    ):
+        self.__dynamodb = dynamodb
+        self.__table = table
+        self.__session_ttl = session_ttl
+        self.__state_ttl = state_ttl
+
+    def save_tokens(self, session_id: str, data: dict):
+        self.__put(f"sessions/{session_id}", data, self.__session_ttl)
+
+    def get_tokens(self, session_id: str) -> dict:
+        return self.__get(f"sessions/{session_id}")
+
+    def delete_tokens(self, session_id: str):
+        try:
+            self.__dynamodb.delete_item(
+                TableName=self.__table,
+                Key={"pk": {"S": f"sessions/{session_id}"}},
+            )
+        except client_error() as e:
+            raise Exception(e) from e
+
+    def pop_tokens(self, session_id: str) -> dict:
+        try:
+            res = self.__dynamodb.delete_item(
+                TableName=self.__table,
+                Key={"pk": {"S": f"sessions/{session_id}"}},
+                ReturnValues="ALL_OLD",
+            )
+        except client_error() as e:
+            raise Exception(e) from e
+        return self.__parse(res.get("Attributes"))
+
+    def delete_sessions(self, session_ids: list[str]):
+        for chunk in chunked(session_ids, 25):
+            requests = {
+                self.__table: [
+                    {
+                        "DeleteRequest": {
+                            "Key": {"pk": {"S": f"sessions/{session_id}"}},
+                        }
+                    }
+                    for session_id in chunk
+                ]
+            }
+            for attempt in range(5):
+                try:
+                    res = self.__dynamodb.batch_write_item(
+                        RequestItems=requests,
+                    )
+                except client_error() as e:
+                    raise Exception(e) from e
+                requests = res.get("UnprocessedItems")
+                if not requests:
+                    break
+                time.sleep(0.05 * 2**attempt)
+            else:
+                raise Exception(f"Unprocessed items: {requests}")
+
+    def add_user_session(self, sub: str, session_id: str):
+        try:
+            self.__dynamodb.update_item(
+                TableName=self.__table,
+                Key={"pk": {"S": f"users/{sub}"}},
+                UpdateExpression="ADD sessions :s SET expires_at = :e",
+                ExpressionAttributeValues={
+                    ":s": {"SS": [session_id]},
+                    ":e": {"N": str(int(time.time()) + self.__session_ttl)},
+                },
+            )
+        except client_error() as e:
+            raise Exception(e) from e
+
+    def list_user_sessions(self, sub: str) -> list[str]:
+        try:
+            res = self.__dynamodb.get_item(
+                TableName=self.__table,
+                Key={"pk": {"S": f"users/{sub}"}},
+                ConsistentRead=True,
+            )
+        except client_error() as e:
+            raise Exception(e) from e
+        item = res.get("Item")
+        if not item or int(item["expires_at"]["N"]) <= time.time():
+            return []
+        return item.get("sessions", {}).get("SS", [])
+
+    def remove_user_sessions(self, sub: str, session_ids: list[str]):
+        if not session_ids:
+            return
+        try:
+            self.__dynamodb.update_item(
+                TableName=self.__table,
+                Key={"pk": {"S": f"users/{sub}"}},
+                UpdateExpression="DELETE sessions :s",
+                ExpressionAttributeValues={":s": {"SS": session_ids}},
+            )
+        except client_error() as e:
+            raise Exception(e) from e
+
+    def acquire_refresh_lease(
+        self,
+        session_id: str,
+        ttl: int,
+    ) -> Optional[str]:
+        owner = str(uuid.uuid4())
+        now = int(time.time())
+        try:
+            self.__dynamodb.put_item(
+                TableName=self.__table,
+                Item={
+                    "pk": {"S": f"leases/{session_id}"},
+                    "owner": {"S": owner},
+                    "expires_at": {"N": str(now + ttl)},
+                },
+                ConditionExpression=LEASE_AVAILABLE,
+                ExpressionAttributeValues={":now": {"N": str(now)}},
+            )
+            return owner
+        except client_error() as e:
+            if e.response["Error"]["Code"] == CONDITIONAL_CHECK_FAILED:
+                return None
+            raise Exception(e) from e
+
+    def release_refresh_lease(self, session_id: str, lease: str):
+        try:
+            self.__dynamodb.delete_item(
+                TableName=self.__table,
+                Key={"pk": {"S": f"leases/{session_id}"}},
+                ConditionExpression="#owner = :owner",
+                ExpressionAttributeNames={"#owner": "owner"},
+                ExpressionAttributeValues={":owner": {"S": lease}},
+            )
+        except client_error() as e:
+            # the lease expired and was taken over, nothing left to release
+            if e.response["Error"]["Code"] == CONDITIONAL_CHECK_FAILED:
+                return
+            raise Exception(e) from e
+
+    def save_state(self, request_id: str, data: dict):
+        # request ids are unique, never overwrite the state of another flow
+        self.__put(
+            f"oauth2/{request_id}",
+            data,
+            self.__state_ttl,
+            condition="attribute_not_exists(pk)",
+        )
+
+    def get_state(self, request_id: str) -> dict:
+        return self.__get(f"oauth2/{request_id}")
+
+    def __put(
+        self,
+        key: str,
+        data: dict,
+        ttl: int,
+        condition: Optional[str] = None,
+    ):
+        kwargs = {}
+        if condition:
+            kwargs["ConditionExpression"] = condition
+        try:
+            self.__dynamodb.put_item(
+                TableName=self.__table,
+                Item={
+                    "pk": {"S": key},
+                    "data": {"S": json.dumps(data)},
+                    "expires_at": {"N": str(int(time.time()) + ttl)},
+                },
+                **kwargs,
+            )
+        except client_error() as e:
+            raise Exception(e) from e
+
+    def __get(self, key: str) -> dict:
+        try:
+            res = self.__dynamodb.get_item(
+                TableName=self.__table,
+                Key={"pk": {"S": key}},
+                ConsistentRead=True,
+            )
+        except client_error() as e:
+            raise Exception(e) from e
+        return self.__parse(res.get("Item"))
+
+    def __parse(self, item: Optional[dict]) -> dict:
+        if not item or int(item["expires_at"]["N"]) <= time.time():
+            raise DataNotFoundException()
+        return json.loads(item["data"]["S"])
+
+
+class CachedStorage(Storage):
+    """Read-through cache of session tokens in front of ``Storage``.
+
+    Entries never outlive the expiration of the tokens they hold, so a
+    session revoked by another container is served for at most the cache
+    TTL or until its tokens expire, whichever comes first.
+
+    Ids that ``validate`` refuses and ids recently found missing or deleted
+    (kept in the ``negative`` cache) are rejected without a storage call.
+    Session ids are derived from fresh refresh tokens and never reused, so
+    a negative entry can only go stale for an id that is looked up before
+    it is logged in with, and then for at most the negative cache TTL.
+    """
+
+    def __init__(
+        self,
+        storage: Storage,
+        cache: Optional[LRUCache] = None,
+        log_interval: int = 100,
+        negative: Optional[LRUCache] = None,
+        validate: Optional[Callable[[str], bool]] = None,
+    ):
+        self.__storage = storage
+        self.__cache = cache if cache is not None else LRUCache()
+        self.__log_interval = log_interval
+        self.__lookups = 0
+        self.__negative = negative
+        self.__validate = validate
+        self.rejected_malformed = 0
+        self.rejected_unknown = 0
+
+    @property
+    def cache(self) -> LRUCache:
+        return self.__cache
+
+    def stats(self) -> dict:
+        negative = self.__negative
+        return {
+            "cache": self.__cache.stats(),
+            "negative": negative.stats() if negative is not None else None,
+            "rejected_malformed": self.rejected_malformed,
+            "rejected_unknown": self.rejected_unknown,
+        }
+
+    def save_tokens(self, session_id: str, data: dict):
+        self.__cache.delete(session_id)
+        if self.__negative is not None:
+            self.__negative.delete(session_id)
+        self.__storage.save_tokens(session_id, data)
+        self.__put(session_id, data)
+
+    def get_tokens(self, session_id: str) -> dict:
+        self.__lookups += 1
+        if self.__log_interval and self.__lookups % self.__log_interval == 0:
+            logger.info("Session cache stats: %s", self.stats())
+
+        self.__check(session_id)
+        data = self.__cache.get(session_id)
+        if data is not None:
+            return dict(data)
+        try:
+            data = self.__storage.get_tokens(session_id)
+        except DataNotFoundException:
+            self.__forget([session_id])
+            raise
+        self.__put(session_id, data)
+        return data
+
+    def delete_tokens(self, session_id: str):
+        self.__evict([session_id])
+        self.__storage.delete_tokens(session_id)
+        self.__forget([session_id])
+
+    def pop_tokens(self, session_id: str) -> dict:
+        self.__check(session_id)
+        self.__evict([session_id])
+        try:
+            data = self.__storage.pop_tokens(session_id)
+        except DataNotFoundException:
+            self.__forget([session_id])
+            raise
+        self.__forget([session_id])
+        return data
+
+    def delete_sessions(self, session_ids: list[str]):
+        self.__evict(session_ids)
+        self.__storage.delete_sessions(session_ids)
+        self.__forget(session_ids)
+
+    def add_user_session(self, sub: str, session_id: str):
+        self.__storage.add_user_session(sub, session_id)
+
+    def list_user_sessions(self, sub: str) -> list[str]:
+        return self.__storage.list_user_sessions(sub)
+
+    def remove_user_sessions(self, sub: str, session_ids: list[str]):
+        self.__storage.remove_user_sessions(sub, session_ids)
+
+    def acquire_refresh_lease(
+        self,
+        session_id: str,
+        ttl: int,
+    ) -> Optional[str]:
+        # whatever the outcome, the session is about to change
+        self.__cache.delete(session_id)
+        return self.__storage.acquire_refresh_lease(session_id, ttl)
+
+    def release_refresh_lease(self, session_id: str, lease: str):
+        self.__storage.release_refresh_lease(session_id, lease)
+
+    def save_state(self, request_id: str, data: dict):
+        self.__storage.save_state(request_id, data)
+
+    def get_state(self, request_id: str) -> dict:
+        return self.__storage.get_state(request_id)
+
+    def __check(self, session_id: str):
+        if self.__validate is not None and not self.__validate(session_id):
+            self.rejected_malformed += 1
+            raise DataNotFoundException()
+        if self.__negative is not None and self.__negative.get(session_id):
+            self.rejected_unknown += 1
+            raise DataNotFoundException()
+
+    def __evict(self, session_ids: list[str]):
+        for session_id in session_ids:
+            self.__cache.delete(session_id)
+
+    def __forget(self, session_ids: list[str]):
+        # only once the storage said so, a failed delete leaves the session
+        self.__evict(session_ids)
+        if self.__negative is not None:
+            for session_id in session_ids:
+                self.__negative.put(session_id, True)
+
+    def __put(self, session_id: str, data: dict):
+        try:
+            expiration = datetime.datetime.fromisoformat(data["expiration"])
+        except (KeyError, TypeError, ValueError):
+            return
+        ttl = (
+            expiration - datetime.datetime.now(datetime.timezone.utc)
+        ).total_seconds()
+        self.__cache.put(
+            session_id,
+            dict(data),
+            size=len(json.dumps(data)),
+            ttl=ttl,
+        )
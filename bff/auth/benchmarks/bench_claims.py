@@ -0,0 +1,67 @@
+"""CPU spent in /auth/session with and without claims stored in the session.
+
+"before" saves the session without the decoded claims, like sessions
+created before the claims were stored with the tokens, so every request
+decodes the id token again. "after" reads the stored claims. Both run on
+session cache hits so that the decoding is not hidden behind moto.
+
+    poetry run python -m benchmarks.bench_claims
+"""
+
+import argparse
+import logging
+import time
+
+import auth
+import auth.runtime
+
+from .common import login, measure, mock_environment, report, session_event
+
+
+def cpu_per_call(func, iterations):
+    start = time.process_time()
+    for _ in range(iterations):
+        func()
+    return (time.process_time() - start) / iterations * 1000 * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--iterations", type=int, default=2000)
+    args = parser.parse_args()
+    # the session cache logs its stats every 100 lookups
+    logging.getLogger("auth.storage").setLevel(logging.WARNING)
+
+    with mock_environment():
+        cookie = login()
+        session_id = cookie.split("=")[1]
+        event = session_event(cookie)
+        st = auth.runtime.get_runtime().storage
+        tokens = st.get_tokens(session_id)
+
+        def call():
+            auth.handler(event, None)
+
+        st.save_tokens(
+            session_id,
+            {k: v for k, v in tokens.items() if k != "claims"},
+        )
+        call()
+        before = measure(call, args.iterations)
+        before_cpu = cpu_per_call(call, args.iterations)
+
+        st.save_tokens(session_id, tokens)
+        call()
+        after = measure(call, args.iterations)
+        after_cpu = cpu_per_call(call, args.iterations)
+
+    report("before (decode id token)", before)
+    report("after (stored claims)", after)
+    print(
+        f"CPU per call: before={before_cpu:.1f}us after={after_cpu:.1f}us "
+        + f"saved={before_cpu - after_cpu:.1f}us"
+    )
+
+
+if __name__ == "__main__":
+    main()
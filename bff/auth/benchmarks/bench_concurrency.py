@@ -0,0 +1,237 @@
+"""Critical path of /auth/login, /auth/authorize and /auth/callback.
+
+"sequential" makes the downstream calls one after another like before,
+"concurrent" overlaps the independent ones on the runtime executor. S3,
+Cognito and Secrets Manager run against moto with ``--aws-latency`` added
+to every AWS call, and the token endpoint is a local HTTPS stand-in
+answering after ``--token-latency``.
+
+    poetry run python -m benchmarks.bench_concurrency
+"""
+
+import argparse
+import base64
+import contextlib
+import datetime
+import http.server
+import itertools
+import json
+import os
+import ssl
+import tempfile
+import threading
+import time
+import unittest.mock
+
+import boto3
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+import auth
+import auth.runtime
+from auth.identity import generate_secret_hash
+
+from .common import SECRET_ID, measure, mock_environment, report
+
+
+def write_certificate(directory):
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=1))
+        .not_valid_after(now + datetime.timedelta(hours=1))
+        .add_extension(
+            x509.SubjectAlternativeName([x509.DNSName("localhost")]),
+            critical=False,
+        )
+        .sign(key, hashes.SHA256())
+    )
+    cert_file = os.path.join(directory, "cert.pem")
+    key_file = os.path.join(directory, "key.pem")
+    with open(cert_file, "wb") as f:
+        f.write(certificate.public_bytes(serialization.Encoding.PEM))
+    with open(key_file, "wb") as f:
+        f.write(
+            key.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.PKCS8,
+                serialization.NoEncryption(),
+            )
+        )
+    return cert_file, key_file
+
+
+@contextlib.contextmanager
+def token_endpoint(tokens, latency, directory):
+    """Serve POST /oauth2/token over HTTPS on localhost."""
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            time.sleep(latency)
+            body = json.dumps(tokens).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    cert_file, key_file = write_certificate(directory)
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert_file, key_file)
+    server = http.server.ThreadingHTTPServer(("localhost", 0), Handler)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        with unittest.mock.patch.dict(
+            os.environ,
+            {"REQUESTS_CA_BUNDLE": cert_file},
+        ):
+            yield f"localhost:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def issue_tokens():
+    cognito_idp = boto3.client("cognito-idp")
+    secret = json.loads(
+        boto3.client("secretsmanager").get_secret_value(SecretId=SECRET_ID)[
+            "SecretString"
+        ]
+    )
+    result = cognito_idp.admin_initiate_auth(
+        UserPoolId=os.environ["COGNITO_USER_POOL_ID"],
+        ClientId=secret["client_id"],
+        AuthFlow="ADMIN_USER_PASSWORD_AUTH",
+        AuthParameters={
+            "USERNAME": "admin@example.com",
+            "PASSWORD": "P@ssw0rd",
+            "SECRET_HASH": generate_secret_hash(
+                secret["client_id"],
+                secret["client_secret"],
+                "admin@example.com",
+            ),
+        },
+    )["AuthenticationResult"]
+    return {
+        "access_token": result["AccessToken"],
+        "id_token": result["IdToken"],
+        "refresh_token": result["RefreshToken"],
+        "expires_in": result["ExpiresIn"],
+    }
+
+
+def sequential(self, *calls, return_exceptions=False):
+    return [call() for call in calls]
+
+
+def bench(label, iterations, aws_latency):
+    rt = auth.runtime.get_runtime()
+    for service in ["s3", "cognito-idp", "secretsmanager"]:
+        client = rt.client(service)
+        service_id = client.meta.service_model.service_id.hyphenize()
+        client.meta.events.register(
+            f"before-call.{service_id}",
+            lambda **kwargs: time.sleep(aws_latency),
+        )
+    request_ids = (f"request-{i}" for i in itertools.count())
+    request_id = ""
+
+    def save_state():
+        nonlocal request_id
+        request_id = next(request_ids)
+        rt.storage.save_state(request_id, {"redirect_url": "/"})
+
+    def callback():
+        state = base64.b64encode(
+            json.dumps({"request_id": request_id}).encode(),
+        ).decode()
+        result = auth.handler(
+            {
+                "rawPath": "/auth/callback",
+                "queryStringParameters": {"code": "code", "state": state},
+                "headers": {},
+            },
+            None,
+        )
+        assert result["statusCode"] == 302, result
+
+    def authorize():
+        result = auth.handler(
+            {
+                "rawPath": "/auth/authorize",
+                "queryStringParameters": {"idp": "COGNITO"},
+                "requestContext": {"requestId": next(request_ids)},
+            },
+            None,
+        )
+        assert result["statusCode"] == 302, result
+
+    def login():
+        result = auth.handler(
+            {
+                "rawPath": "/auth/login",
+                "headers": {},
+                "body": json.dumps(
+                    {"username": "admin@example.com", "password": "P@ssw0rd"},
+                ),
+                "isBase64Encoded": False,
+            },
+            None,
+        )
+        assert result["statusCode"] == 200, result
+
+    # warm up the clients, the connection pool and the secret cache
+    save_state()
+    callback()
+    login()
+    report(f"{label} login", measure(login, iterations))
+    report(f"{label} authorize", measure(authorize, iterations))
+    report(f"{label} callback", measure(callback, iterations, save_state))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--iterations", type=int, default=50)
+    parser.add_argument("--aws-latency", type=float, default=0.02)
+    parser.add_argument("--token-latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory, mock_environment():
+        with token_endpoint(
+            issue_tokens(),
+            args.token_latency,
+            directory,
+        ) as domain:
+            with unittest.mock.patch.dict(
+                os.environ,
+                {"COGNITO_USER_POOL_DOMAIN": domain},
+            ):
+                with unittest.mock.patch.object(
+                    auth.runtime.Runtime,
+                    "gather",
+                    sequential,
+                ):
+                    auth.runtime.reset_runtime()
+                    bench("sequential", args.iterations, args.aws_latency)
+                auth.runtime.reset_runtime()
+                bench("concurrent", args.iterations, args.aws_latency)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Simulated Cognito refresh load for a burst of logins.
+
+Replays a synthetic login curve (a morning peak on top of a steady trickle)
+in simulated time. Every session polls /auth/session periodically and
+refreshes whenever the policy says so; the peak and p99 refresh QPS are
+reported for the fixed 20 minute threshold and for the jittered,
+rate-limited policy.
+
+    poetry run python -m benchmarks.bench_refresh_policy
+"""
+
+import argparse
+import collections
+import datetime
+import heapq
+import random
+
+from auth.session import RefreshPolicy
+
+EPOCH = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def login_times(users, duration, rng):
+    # 80% of the users log in within a ten minute morning peak
+    peak = [rng.gauss(600, 120) for _ in range(int(users * 0.8))]
+    steady = [rng.uniform(0, duration / 2) for _ in range(users - len(peak))]
+    return sorted(max(0.0, t) for t in peak + steady)
+
+
+def simulate(policy_factory, users, duration, lifetime, poll, seed):
+    rng = random.Random(seed)
+    now = [0.0]
+    policy = policy_factory(lambda: now[0])
+    refreshes: collections.Counter = collections.Counter()
+    events = []
+    expirations = {}
+    for i, logged_in_at in enumerate(login_times(users, duration, rng)):
+        session_id = f"session-{i}"
+        expirations[session_id] = logged_in_at + lifetime
+        heapq.heappush(events, (logged_in_at + rng.uniform(0, poll), i))
+
+    while events:
+        t, i = heapq.heappop(events)
+        if t > duration:
+            break
+        now[0] = t
+        session_id = f"session-{i}"
+        tokens = {
+            "expiration": (
+                EPOCH + datetime.timedelta(seconds=expirations[session_id])
+            ).isoformat()
+        }
+        if policy.should_refresh(
+            session_id,
+            tokens,
+            EPOCH + datetime.timedelta(seconds=t),
+        ):
+            expirations[session_id] = t + lifetime
+            refreshes[int(t)] += 1
+        heapq.heappush(events, (t + poll, i))
+    return refreshes
+
+
+def report(label, refreshes, duration):
+    per_second = sorted(refreshes.get(t, 0) for t in range(int(duration)))
+    p99 = per_second[int(len(per_second) * 0.99) - 1]
+    print(
+        f"{label:<40} total={sum(per_second):<7} "
+        + f"peak={per_second[-1]:<5} p99={p99}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--hours", type=float, default=3)
+    parser.add_argument("--lifetime", type=int, default=3600)
+    parser.add_argument("--poll", type=int, default=60)
+    parser.add_argument("--jitter", type=float, default=600)
+    parser.add_argument("--max-per-second", type=float, default=5)
+    args = parser.parse_args()
+    duration = args.hours * 3600
+
+    before = simulate(
+        lambda clock: RefreshPolicy(20 * 60, clock=clock),
+        args.users,
+        duration,
+        args.lifetime,
+        args.poll,
+        seed=1,
+    )
+    after = simulate(
+        lambda clock: RefreshPolicy(
+            20 * 60,
+            args.jitter,
+            args.max_per_second,
+            clock=clock,
+        ),
+        args.users,
+        duration,
+        args.lifetime,
+        args.poll,
+        seed=1,
+    )
+    report("before (fixed 20 minute threshold)", before, duration)
+    report(
+        f"after (jitter={args.jitter:g}s, max={args.max_per_second:g}/s)",
+        after,
+        duration,
+    )
+
+
+if __name__ == "__main__":
+    main()
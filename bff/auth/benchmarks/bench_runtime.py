@@ -0,0 +1,40 @@
+"""Warm invocation latency of /auth/session with and without the runtime.
+
+"before" rebuilds the clients, Storage and Identity on every invocation,
+like the handlers did before the runtime registry was introduced, and
+"after" reuses the registry of the warm container.
+
+    poetry run python -m benchmarks.bench_runtime
+"""
+
+import argparse
+
+import auth
+import auth.runtime
+
+from .common import login, measure, mock_environment, report, session_event
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    with mock_environment():
+        event = session_event(login())
+        auth.handler(event, None)
+
+        before = measure(
+            lambda: auth.handler(event, None),
+            args.iterations,
+            setup=auth.runtime.reset_runtime,
+        )
+        auth.handler(event, None)
+        after = measure(lambda: auth.handler(event, None), args.iterations)
+
+    report("before (per-invocation clients)", before)
+    report("after (warm runtime)", after)
+
+
+if __name__ == "__main__":
+    main()
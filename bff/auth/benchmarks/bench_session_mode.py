@@ -0,0 +1,74 @@
+"""Latency and S3 reads of /auth/session in storage and cookie mode.
+
+"storage" reads the tokens from S3 on every call, "storage (cache)" from
+the session cache of the container while it holds them, and "cookie"
+decrypts them from the session cookie. Unlike the session cache, the
+cookie also spares the read on a cold or another container.
+
+    poetry run python -m benchmarks.bench_session_mode
+"""
+
+import argparse
+import base64
+import json
+import logging
+import os
+
+import boto3
+
+import auth
+import auth.runtime
+
+from .common import login, measure, mock_environment, report, session_event
+
+KEYS_SECRET_ID = "dev/serverless-app/auth-keys"
+
+
+def bench(label, iterations, **environ):
+    with mock_environment(**environ):
+        boto3.client("secretsmanager").create_secret(
+            Name=KEYS_SECRET_ID,
+            SecretString=json.dumps(
+                {
+                    "session_keys": [
+                        base64.urlsafe_b64encode(os.urandom(32)).decode(),
+                    ],
+                },
+            ),
+        )
+        cookie = login()
+        event = session_event(cookie)
+        auth.handler(event, None)
+
+        calls = []
+        s3 = auth.runtime.get_runtime().client("s3")
+        s3.meta.events.register(
+            "before-call.s3",
+            lambda **kwargs: calls.append(kwargs),
+        )
+        report(label, measure(lambda: auth.handler(event, None), iterations))
+        print(
+            f"  S3 calls per request: {len(calls) / iterations:.2f}, "
+            + f"cookie: {len(cookie)} bytes"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--iterations", type=int, default=500)
+    args = parser.parse_args()
+    # the session cache logs its stats every 100 lookups
+    logging.getLogger("auth.storage").setLevel(logging.WARNING)
+
+    bench("storage", args.iterations, SESSION_CACHE_MAX_ENTRIES="0")
+    bench("storage (cache)", args.iterations)
+    bench(
+        "cookie",
+        args.iterations,
+        SESSION_MODE="cookie",
+        SESSION_KEYS_SECRET_ID=KEYS_SECRET_ID,
+    )
+
+
+if __name__ == "__main__":
+    main()
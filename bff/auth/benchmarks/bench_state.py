@@ -0,0 +1,58 @@
+"""Cost of carrying the OAuth state in S3 and in a token.
+
+Measures what /auth/authorize and /auth/callback spend on the state alone:
+writing and reading it back in S3 (against moto, so no network latency is
+included) or encoding and decoding it locally.
+
+    poetry run python -m benchmarks.bench_state
+"""
+
+import argparse
+import itertools
+import os
+
+import boto3
+import moto
+
+import auth.storage
+from auth.state import StateCodec
+
+from .common import BUCKET, measure, report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--iterations", type=int, default=1000)
+    args = parser.parse_args()
+
+    data = {"redirect_url": "/contacts/1"}
+    with moto.mock_aws():
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket=BUCKET)
+        storage = auth.storage.S3Storage(s3, BUCKET)
+        ids = (f"request-{i}" for i in itertools.count())
+
+        def round_trip():
+            request_id = next(ids)
+            storage.save_state(request_id, data)
+            storage.get_state(request_id)
+
+        report("storage (s3)", measure(round_trip, args.iterations))
+
+    for mode in ["signed", "encrypted"]:
+        codec = StateCodec(
+            os.urandom(32),
+            encrypt=mode == "encrypted",
+        )
+        report(
+            mode,
+            measure(
+                lambda: codec.decode(codec.encode(data)),
+                args.iterations,
+            ),
+        )
+        print(f"{mode} state: {len(codec.encode(data))} chars")
+
+
+if __name__ == "__main__":
+    main()
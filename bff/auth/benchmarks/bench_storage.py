@@ -0,0 +1,71 @@
+"""Latency of save/get/delete on each session storage backend.
+
+Both backends run against moto, so the numbers show client-side cost and
+round trip counts rather than real S3/DynamoDB network latency.
+
+    poetry run python -m benchmarks.bench_storage
+"""
+
+import argparse
+import itertools
+
+import boto3
+import moto
+
+import auth.storage
+from tests.test_storage import setup_dynamodb, tokens
+
+from .common import BUCKET, measure, report
+
+
+def bench(label, storage, iterations):
+    data = tokens(3600)
+    ids = (f"session-{i}" for i in itertools.count())
+    saved = []
+
+    def save():
+        session_id = next(ids)
+        storage.save_tokens(session_id, data)
+        saved.append(session_id)
+
+    report(f"{label} save_tokens", measure(save, iterations))
+    gets = iter(list(saved))
+    report(
+        f"{label} get_tokens",
+        measure(lambda: storage.get_tokens(next(gets)), iterations),
+    )
+    deletes = iter(list(saved))
+    report(
+        f"{label} delete_tokens",
+        measure(lambda: storage.delete_tokens(next(deletes)), iterations),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--iterations", type=int, default=500)
+    args = parser.parse_args()
+
+    with moto.mock_aws():
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket=BUCKET)
+        dynamodb = boto3.client("dynamodb", region_name="us-east-1")
+        setup_dynamodb(dynamodb, "dev-dynamodb-session-storage")
+
+        bench(
+            "s3",
+            auth.storage.S3Storage(s3, BUCKET),
+            args.iterations,
+        )
+        bench(
+            "dynamodb",
+            auth.storage.DynamoDBStorage(
+                dynamodb,
+                "dev-dynamodb-session-storage",
+            ),
+            args.iterations,
+        )
+
+
+if __name__ == "__main__":
+    main()
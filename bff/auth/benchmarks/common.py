@@ -0,0 +1,95 @@
+import contextlib
+import http.cookies
+import json
+import os
+import statistics
+import time
+import unittest.mock
+
+import boto3
+import moto
+
+import auth
+import auth.runtime
+from tests.test_identity import setup_cognito
+
+BUCKET = "dev-s3-session-storage"
+SECRET_ID = "dev/serverless-app/api-client"
+
+
+@contextlib.contextmanager
+def mock_environment(**environ):
+    """Set up moto backends and the Lambda environment for the handler."""
+    with moto.mock_aws(), unittest.mock.patch.dict(
+        os.environ,
+        {"AWS_DEFAULT_REGION": "ap-northeast-1"},
+    ):
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket=BUCKET)
+        user_pool_id, user_pool_domain = setup_cognito(
+            boto3.client("cognito-idp"),
+            boto3.client("secretsmanager"),
+        )
+        env = {
+            "S3_BUCKET": BUCKET,
+            "COGNITO_USER_POOL_ID": user_pool_id,
+            "COGNITO_USER_POOL_DOMAIN": user_pool_domain,
+            "API_CLIENT_SECRET_ID": SECRET_ID,
+        }
+        env.update(environ)
+        with unittest.mock.patch.dict(os.environ, env):
+            auth.runtime.reset_runtime()
+            try:
+                yield
+            finally:
+                auth.runtime.reset_runtime()
+
+
+def login():
+    """Log the test user in and return the cookie header for the session."""
+    result = auth.handler(
+        {
+            "rawPath": "/auth/login",
+            "headers": {},
+            "body": json.dumps(
+                {"username": "admin@example.com", "password": "P@ssw0rd"},
+            ),
+            "isBase64Encoded": False,
+        },
+        None,
+    )
+    cookies = http.cookies.SimpleCookie(result["headers"]["Set-Cookie"])
+    for set_cookie in result.get("cookies", []):
+        cookies.load(set_cookie)
+    return "; ".join(f"{k}={v.value}" for k, v in cookies.items())
+
+
+def session_event(cookie):
+    return {
+        "rawPath": "/auth/session",
+        "headers": {"cookie": cookie},
+        "isBase64Encoded": False,
+    }
+
+
+def measure(func, iterations, setup=None):
+    """Call ``func`` repeatedly and return the latencies in milliseconds."""
+    samples = []
+    for _ in range(iterations):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def report(label, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(
+        f"{label:<32} n={len(samples):<6} "
+        + f"mean={statistics.mean(samples):8.3f}ms "
+        + f"p50={statistics.median(samples):8.3f}ms "
+        + f"p95={p95:8.3f}ms"
+    )
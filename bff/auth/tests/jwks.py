@@ -0,0 +1,97 @@
+import http.server
+import json
+import threading
+import time
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jws
+
+# This module is shared with api/contacts/tests/jwks.py,
+# keep both copies in sync.
+
+
+def generate_key():
+    return (
+        rsa.generate_private_key(65537, 2048)
+        .private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        )
+        .decode()
+    )
+
+
+class LocalJWKS(object):
+    """Stand-in for the JWKS endpoint of a Cognito user pool.
+
+    Serves the public keys on a local port and signs tokens with the
+    matching private keys. Without an issuer the local server is the
+    issuer, so the JWKS is found at its path under the issuer.
+    """
+
+    def __init__(self, issuer=None):
+        self.requests = 0
+        self.keys = {"key-1": generate_key()}
+        owner = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                owner.requests += 1
+                body = json.dumps(owner.jwks()).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.__server = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", 0),
+            Handler,
+        )
+        local = f"http://127.0.0.1:{self.__server.server_address[1]}"
+        self.issuer = issuer or local
+        self.url = f"{local}/.well-known/jwks.json"
+
+    def __enter__(self):
+        threading.Thread(target=self.__server.serve_forever).start()
+        return self
+
+    def __exit__(self, *args):
+        self.__server.shutdown()
+        self.__server.server_close()
+
+    def jwks(self):
+        keys = []
+        for kid, pem in self.keys.items():
+            public = jwk.construct(pem, "RS256").public_key()
+            keys.append({**public.to_dict(), "kid": kid})
+        return {"keys": keys}
+
+    def rotate(self, kid):
+        self.keys[kid] = generate_key()
+
+    def sign(self, **claims):
+        kid = list(self.keys)[-1]
+        now = int(time.time())
+        payload = {
+            "sub": "user-id",
+            "iss": self.issuer,
+            "aud": "client-id",
+            "token_use": "id",
+            "iat": now,
+            "exp": now + 3600,
+        }
+        payload.update(claims)
+        # None removes a default claim
+        payload = {k: v for k, v in payload.items() if v is not None}
+        return jws.sign(
+            payload,
+            self.keys[kid],
+            headers={"kid": kid},
+            algorithm="RS256",
+        )
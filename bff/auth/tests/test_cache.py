@@ -0,0 +1,68 @@
+import unittest
+
+from auth.cache import LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_get(self):
+        sut = LRUCache()
+        self.assertIsNone(sut.get("a"))
+        sut.put("a", 1)
+        self.assertEqual(1, sut.get("a"))
+        stats = sut.stats()
+        self.assertEqual(1, stats["hits"])
+        self.assertEqual(1, stats["misses"])
+        self.assertEqual(0.5, stats["hit_ratio"])
+
+    def test_put_when_max_entries_exceeded(self):
+        sut = LRUCache(max_entries=2)
+        sut.put("a", 1)
+        sut.put("b", 2)
+        sut.get("a")
+        sut.put("c", 3)
+        self.assertEqual(1, sut.get("a"))
+        self.assertIsNone(sut.get("b"))
+        self.assertEqual(3, sut.get("c"))
+        self.assertEqual(1, sut.stats()["evictions"])
+
+    def test_put_when_max_bytes_exceeded(self):
+        sut = LRUCache(max_bytes=10)
+        sut.put("a", 1, size=6)
+        sut.put("b", 2, size=6)
+        sut.put("c", 3, size=11)
+        self.assertIsNone(sut.get("a"))
+        self.assertEqual(2, sut.get("b"))
+        self.assertIsNone(sut.get("c"))
+        self.assertEqual(6, sut.stats()["bytes"])
+
+    def test_get_when_expired(self):
+        now = [0.0]
+        sut = LRUCache(ttl=60, clock=lambda: now[0])
+        sut.put("a", 1)
+        sut.put("b", 2, ttl=10)
+        sut.put("c", 3, ttl=-1)
+        now[0] = 10
+        self.assertEqual(1, sut.get("a"))
+        self.assertIsNone(sut.get("b"))
+        self.assertIsNone(sut.get("c"))
+        now[0] = 60
+        self.assertIsNone(sut.get("a"))
+        self.assertEqual(0, len(sut))
+
+    def test_add(self):
+        now = [0.0]
+        sut = LRUCache(ttl=60, clock=lambda: now[0])
+        self.assertTrue(sut.add("a", 1))
+        self.assertFalse(sut.add("a", 2))
+        self.assertEqual(1, sut.get("a"))
+        now[0] = 60
+        self.assertTrue(sut.add("a", 3))
+        self.assertEqual(3, sut.get("a"))
+
+    def test_delete(self):
+        sut = LRUCache()
+        sut.put("a", 1, size=5)
+        sut.delete("a")
+        sut.delete("b")
+        self.assertIsNone(sut.get("a"))
+        self.assertEqual(0, sut.stats()["bytes"])
@@ -0,0 +1,74 @@
+import concurrent.futures
+import threading
+import time
+import unittest
+
+from auth.concurrency import gather
+
+
+class TestGather(unittest.TestCase):
+    def setUp(self):
+        self.executor = concurrent.futures.ThreadPoolExecutor(4)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_gather(self):
+        barrier = threading.Barrier(3, timeout=1)
+
+        def call(value):
+            # only returns when all three run at the same time
+            barrier.wait()
+            return value
+
+        self.assertEqual(
+            [1, 2, 3],
+            gather(
+                self.executor,
+                [lambda: call(1), lambda: call(2), lambda: call(3)],
+                timeout=5,
+            ),
+        )
+
+    def test_gather_when_failed(self):
+        finished = []
+
+        def fail(message, delay):
+            time.sleep(delay)
+            finished.append(message)
+            raise ValueError(message)
+
+        with self.assertRaisesRegex(ValueError, "first"):
+            gather(
+                self.executor,
+                [
+                    lambda: fail("first", 0.1),
+                    lambda: fail("second", 0),
+                    lambda: finished.append("third"),
+                ],
+                timeout=5,
+            )
+        # raised in the order of the calls, once all of them are done
+        self.assertCountEqual(["first", "second", "third"], finished)
+
+    def test_gather_with_return_exceptions(self):
+        error = ValueError("failed")
+
+        def fail():
+            raise error
+
+        self.assertEqual(
+            [1, error],
+            gather(
+                self.executor,
+                [lambda: 1, fail],
+                timeout=5,
+                return_exceptions=True,
+            ),
+        )
+
+    def test_gather_when_timed_out(self):
+        event = threading.Event()
+        with self.assertRaises(TimeoutError):
+            gather(self.executor, [lambda: 1, event.wait], timeout=0.1)
+        event.set()
@@ -0,0 +1,93 @@
+import http.cookies
+import os
+import unittest
+
+from auth.cookie import InvalidCookieException, Keyring, SessionCookieCodec
+
+TOKENS = {
+    "access_token": "a" * 1200,
+    "id_token": os.urandom(900).hex(),
+    "refresh_token": "r" * 1200,
+    "expiration": "2024-09-07T10:00:00+00:00",
+    "claims": {"sub": "user"},
+}
+
+
+def cookies(set_cookies, cookies=None):
+    """Apply Set-Cookie values like a browser would."""
+    jar = http.cookies.SimpleCookie(cookies)
+    for set_cookie in set_cookies:
+        name, _, value = set_cookie.partition(";")[0].partition("=")
+        if "expires=Thu, 01 Jan 1970" in set_cookie:
+            jar.pop(name, None)
+        else:
+            jar[name] = value
+    return jar
+
+
+class TestSessionCookieCodec(unittest.TestCase):
+    def test_decode(self):
+        sut = SessionCookieCodec(Keyring([os.urandom(32)]), chunk_size=500)
+        set_cookies = sut.encode("session", TOKENS)
+        self.assertGreater(len(set_cookies), 1)
+        self.assertTrue(all(len(c) < 600 for c in set_cookies))
+        tokens = sut.decode("session", cookies(set_cookies))
+        self.assertNotIn("refresh_token", tokens)
+        self.assertEqual(
+            {k: v for k, v in TOKENS.items() if k != "refresh_token"},
+            tokens,
+        )
+
+    def test_decode_when_invalid(self):
+        sut = SessionCookieCodec(Keyring([os.urandom(32)]), chunk_size=500)
+        jar = cookies(sut.encode("session", TOKENS))
+        incomplete = cookies([], jar)
+        del incomplete["session_tokens_1"]
+        tampered = cookies([], jar)
+        value = tampered["session_tokens_1"].value
+        last = "A" if value[-1] != "A" else "B"
+        tampered["session_tokens_1"] = value[:-1] + last
+        malformed = cookies([], jar)
+        malformed["session_tokens_0"] = "x" + jar["session_tokens_0"].value
+        for session_id, jar in [
+            ("other", jar),
+            ("session", incomplete),
+            ("session", tampered),
+            ("session", malformed),
+            ("session", http.cookies.SimpleCookie()),
+        ]:
+            with self.subTest(session_id=session_id, jar=jar):
+                with self.assertRaises(InvalidCookieException):
+                    sut.decode(session_id, jar)
+
+    def test_decode_when_key_rotated(self):
+        old, new = os.urandom(32), os.urandom(32)
+        jar = cookies(
+            SessionCookieCodec(Keyring([old])).encode("session", TOKENS),
+        )
+        sut = SessionCookieCodec(Keyring([new, old]))
+        tokens = sut.decode("session", jar)
+        self.assertEqual("a" * 1200, tokens["access_token"])
+        rotated = cookies(sut.encode("session", TOKENS))
+        with self.assertRaises(InvalidCookieException):
+            SessionCookieCodec(Keyring([old])).decode("session", rotated)
+        with self.assertRaises(InvalidCookieException):
+            SessionCookieCodec(Keyring([new])).decode("session", jar)
+
+    def test_encode_when_shorter(self):
+        sut = SessionCookieCodec(Keyring([os.urandom(32)]), chunk_size=500)
+        jar = cookies(sut.encode("session", TOKENS))
+        short = {"access_token": "a", "id_token": "i", "expiration": "e"}
+        jar = cookies(sut.encode("session", short, jar), jar)
+        self.assertEqual(["session_tokens_0"], list(jar))
+        self.assertEqual(short, sut.decode("session", jar))
+        self.assertEqual([], list(cookies(sut.expire(jar), jar)))
+
+    def test_encode_when_too_large(self):
+        sut = SessionCookieCodec(
+            Keyring([os.urandom(32)]),
+            chunk_size=100,
+            max_chunks=2,
+        )
+        with self.assertRaises(ValueError):
+            sut.encode("session", TOKENS)
@@ -1,7 +1,9 @@
 import base64
+import datetime
 import http.cookies
 import json
 import os
+import time
 import unittest
 import unittest.mock
 import urllib.parse
@@ -10,12 +12,18 @@ import boto3
 import moto
 
 import auth
+import auth.runtime
 from auth.identity import generate_secret_hash
+from auth.storage import DataNotFoundException
 
+from .test_cookie import cookies
 from .test_identity import setup_cognito
 
 
 class TestHandler(unittest.TestCase):
+    def setUp(self):
+        auth.runtime.reset_runtime()
+
     @moto.mock_aws
     @unittest.mock.patch.dict(
         os.environ,
@@ -218,7 +226,7 @@ class TestHandler(unittest.TestCase):
         os.environ,
         {"AWS_DEFAULT_REGION": "ap-northeast-1"},
     )
-    @unittest.mock.patch("requests.post")
+    @unittest.mock.patch("requests.Session.post")
     def test_handler_callback(self, mock_post):
         s3 = boto3.client("s3", region_name="us-east-1")
         s3.create_bucket(Bucket="dev-s3-session-storage")
@@ -333,6 +341,183 @@ class TestHandler(unittest.TestCase):
             location,
         )
 
+    @moto.mock_aws
+    @unittest.mock.patch.dict(
+        os.environ,
+        {"AWS_DEFAULT_REGION": "ap-northeast-1"},
+    )
+    @unittest.mock.patch("requests.Session.post")
+    def test_handler_callback_when_state_is_unknown(self, mock_post):
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="dev-s3-session-storage")
+        cognito_idp = boto3.client("cognito-idp")
+        secretsmanager = boto3.client("secretsmanager")
+        user_pool_id, user_pool_domain = setup_cognito(
+            cognito_idp,
+            secretsmanager,
+        )
+        mock_post.side_effect = Exception("token endpoint is down")
+        state = base64.b64encode(
+            json.dumps({"request_id": "unknown"}).encode(),
+        ).decode()
+
+        with unittest.mock.patch.dict(
+            os.environ,
+            {
+                "S3_BUCKET": "dev-s3-session-storage",
+                "COGNITO_USER_POOL_ID": user_pool_id,
+                "COGNITO_USER_POOL_DOMAIN": user_pool_domain,
+                "API_CLIENT_SECRET_ID": "dev/serverless-app/api-client",
+            },
+        ):
+            with self.assertRaises(DataNotFoundException):
+                auth.handler(
+                    {
+                        "rawPath": "/auth/callback",
+                        "queryStringParameters": {
+                            "code": "valid_code",
+                            "state": state,
+                        },
+                        "headers": {},
+                    },
+                    None,
+                )
+        # the code is not redeemed for a state we did not issue
+        mock_post.assert_not_called()
+        self.assertEqual(
+            0,
+            s3.list_objects_v2(
+                Bucket="dev-s3-session-storage",
+                Prefix="sessions/",
+            )["KeyCount"],
+        )
+
+    @moto.mock_aws
+    @unittest.mock.patch.dict(
+        os.environ,
+        {"AWS_DEFAULT_REGION": "ap-northeast-1"},
+    )
+    @unittest.mock.patch("requests.Session.post")
+    def test_handler_callback_with_signed_state(self, mock_post):
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="dev-s3-session-storage")
+        cognito_idp = boto3.client("cognito-idp")
+        secretsmanager = boto3.client("secretsmanager")
+        user_pool_id, user_pool_domain = setup_cognito(
+            cognito_idp,
+            secretsmanager,
+        )
+        secretsmanager.create_secret(
+            Name="dev/serverless-app/auth-keys",
+            SecretString=json.dumps(
+                {"state_key": base64.urlsafe_b64encode(bytes(32)).decode()},
+            ),
+        )
+
+        secret_response = secretsmanager.get_secret_value(
+            SecretId="dev/serverless-app/api-client",
+        )
+        secret_value = json.loads(secret_response["SecretString"])
+        client_id = secret_value["client_id"]
+        client_secret = secret_value["client_secret"]
+        response = cognito_idp.admin_initiate_auth(
+            UserPoolId=user_pool_id,
+            ClientId=client_id,
+            AuthFlow="ADMIN_USER_PASSWORD_AUTH",
+            AuthParameters={
+                "USERNAME": "admin@example.com",
+                "PASSWORD": "P@ssw0rd",
+                "SECRET_HASH": generate_secret_hash(
+                    client_id,
+                    client_secret,
+                    "admin@example.com",
+                ),
+            },
+        )
+        result = response["AuthenticationResult"]
+        mock_response = unittest.mock.MagicMock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {
+            "access_token": result["AccessToken"],
+            "id_token": result["IdToken"],
+            "refresh_token": result["RefreshToken"],
+            "expires_in": result["ExpiresIn"],
+        }
+        mock_post.return_value = mock_response
+
+        def callback(state):
+            return auth.handler(
+                {
+                    "rawPath": "/auth/callback",
+                    "queryStringParameters": {
+                        "code": "valid_code",
+                        "state": state,
+                    },
+                    "headers": {
+                        "host": "lambda-url.com",
+                    },
+                    "requestContext": {
+                        "http": {
+                            "method": "GET",
+                            "path": "/auth/callback",
+                        },
+                        "requestId": "be4172b1-0ea4-4121-88db-08960adb054f",
+                        "timeEpoch": 1725703735416,
+                    },
+                },
+                None,
+            )
+
+        with unittest.mock.patch.dict(
+            os.environ,
+            {
+                "S3_BUCKET": "dev-s3-session-storage",
+                "COGNITO_USER_POOL_ID": user_pool_id,
+                "COGNITO_USER_POOL_DOMAIN": user_pool_domain,
+                "API_CLIENT_SECRET_ID": "dev/serverless-app/api-client",
+                "OAUTH_STATE_MODE": "signed",
+                "OAUTH_STATE_KEY_SECRET_ID": "dev/serverless-app/auth-keys",
+            },
+        ):
+            result = auth.handler(
+                {
+                    "rawPath": "/auth/authorize",
+                    "queryStringParameters": {
+                        "idp": "COGNITO",
+                        "redirect_url": "/contacts/1",
+                    },
+                    "headers": {
+                        "host": "lambda-url.com",
+                    },
+                    "requestContext": {
+                        "http": {
+                            "method": "GET",
+                            "path": "/auth/authorize",
+                        },
+                        "requestId": "be4172b1-0ea4-4121-88db-08960adb054f",
+                        "timeEpoch": 1725703735416,
+                    },
+                },
+                None,
+            )
+            self.assertEqual(302, result["statusCode"])
+            query = urllib.parse.urlparse(result["headers"]["Location"]).query
+            state = urllib.parse.parse_qs(query)["state"][0]
+            self.assertEqual(
+                0,
+                s3.list_objects_v2(
+                    Bucket="dev-s3-session-storage",
+                    Prefix="oauth2/",
+                )["KeyCount"],
+            )
+
+            self.assertEqual(400, callback(state[:-1])["statusCode"])
+            result = callback(state)
+            self.assertEqual(302, result["statusCode"])
+            self.assertEqual("/contacts/1", result["headers"]["Location"])
+            # a state is good for one callback only
+            self.assertEqual(400, callback(state)["statusCode"])
+
     @moto.mock_aws
     @unittest.mock.patch.dict(
         os.environ,
@@ -410,6 +595,407 @@ class TestHandler(unittest.TestCase):
         self.assertIsNotNone(res_body["session"]["id_token"])
         self.assertIsNotNone(res_body["session"]["access_token"])
 
+    @moto.mock_aws
+    @unittest.mock.patch.dict(
+        os.environ,
+        {"AWS_DEFAULT_REGION": "ap-northeast-1"},
+    )
+    def test_handler_session_when_expiring(self):
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="dev-s3-session-storage")
+        cognito_idp = boto3.client("cognito-idp")
+        secretsmanager = boto3.client("secretsmanager")
+        user_pool_id, user_pool_domain = setup_cognito(
+            cognito_idp,
+            secretsmanager,
+        )
+
+        with unittest.mock.patch.dict(
+            os.environ,
+            {
+                "S3_BUCKET": "dev-s3-session-storage",
+                "COGNITO_USER_POOL_ID": user_pool_id,
+                "COGNITO_USER_POOL_DOMAIN": user_pool_domain,
+                "API_CLIENT_SECRET_ID": "dev/serverless-app/api-client",
+            },
+        ):
+            cookie = login()
+            session_id = cookie.split("=")[1]
+            st = auth.runtime.get_runtime().storage
+            expiration = datetime.datetime.now(
+                datetime.timezone.utc
+            ) + datetime.timedelta(minutes=5)
+            st.save_tokens(
+                session_id,
+                dict(
+                    st.get_tokens(session_id),
+                    expiration=expiration.isoformat(),
+                ),
+            )
+            result = auth.handler(
+                cookie_event("/auth/session", cookie),
+                None,
+            )
+            tokens = st.get_tokens(session_id)
+        self.assertEqual(200, result["statusCode"])
+        self.assertLess(
+            expiration,
+            datetime.datetime.fromisoformat(tokens["expiration"]),
+        )
+        self.assertEqual(
+            json.loads(result["body"])["claims"],
+            tokens["claims"],
+        )
+
+    @moto.mock_aws
+    @unittest.mock.patch.dict(
+        os.environ,
+        {"AWS_DEFAULT_REGION": "ap-northeast-1"},
+    )
+    def test_handler_session_without_stored_claims(self):
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="dev-s3-session-storage")
+        cognito_idp = boto3.client("cognito-idp")
+        secretsmanager = boto3.client("secretsmanager")
+        user_pool_id, user_pool_domain = setup_cognito(
+            cognito_idp,
+            secretsmanager,
+        )
+
+        with unittest.mock.patch.dict(
+            os.environ,
+            {
+                "S3_BUCKET": "dev-s3-session-storage",
+                "COGNITO_USER_POOL_ID": user_pool_id,
+                "COGNITO_USER_POOL_DOMAIN": user_pool_domain,
+                "API_CLIENT_SECRET_ID": "dev/serverless-app/api-client",
+            },
+        ):
+            cookie = login()
+            session_id = cookie.split("=")[1]
+            st = auth.runtime.get_runtime().storage
+            tokens = st.get_tokens(session_id)
+            claims = tokens.pop("claims")
+            st.save_tokens(session_id, tokens)
+            result = auth.handler(
+                cookie_event("/auth/session", cookie),
+                None,
+            )
+        self.assertEqual(200, result["statusCode"])
+        self.assertEqual(claims, json.loads(result["body"])["claims"])
+
+    @moto.mock_aws
+    @unittest.mock.patch.dict(
+        os.environ,
+        {"AWS_DEFAULT_REGION": "ap-northeast-1"},
+    )
+    def test_handler_session_when_unknown(self):
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="dev-s3-session-storage")
+
+        with unittest.mock.patch.dict(
+            os.environ,
+            {"S3_BUCKET": "dev-s3-session-storage"},
+        ):
+            st = auth.runtime.get_runtime().storage
+            calls = []
+            auth.runtime.get_runtime().client("s3").meta.events.register(
+                "before-call.s3",
+                lambda **kwargs: calls.append(kwargs["model"].name),
+            )
+            for cookie in [
+                "session_id=../../etc",
+                "session_id=" + "0" * 64,
+                "session_id=" + "0" * 64,
+            ]:
+                for path in ["/auth/session", "/auth/logout"]:
+                    result = auth.handler(cookie_event(path, cookie), None)
+                    self.assertEqual(401, result["statusCode"])
+        self.assertEqual(["GetObject"], calls)
+        self.assertEqual(2, st.stats()["rejected_malformed"])
+        self.assertEqual(3, st.stats()["rejected_unknown"])
+
+    @moto.mock_aws
+    @unittest.mock.patch.dict(
+        os.environ,
+        {"AWS_DEFAULT_REGION": "ap-northeast-1"},
+    )
+    def test_handler_sessions(self):
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="dev-s3-session-storage")
+        cognito_idp = boto3.client("cognito-idp")
+        secretsmanager = boto3.client("secretsmanager")
+        user_pool_id, user_pool_domain = setup_cognito(
+            cognito_idp,
+            secretsmanager,
+        )
+
+        with unittest.mock.patch.dict(
+            os.environ,
+            {
+                "S3_BUCKET": "dev-s3-session-storage",
+                "COGNITO_USER_POOL_ID": user_pool_id,
+                "COGNITO_USER_POOL_DOMAIN": user_pool_domain,
+                "API_CLIENT_SECRET_ID": "dev/serverless-app/api-client",
+            },
+        ):
+            cookie = login()
+            other_cookie = login()
+            result = auth.handler(cookie_event("/auth/sessions", cookie), None)
+        self.assertEqual(200, result["statusCode"])
+        sessions = json.loads(result["body"])["sessions"]
+        self.assertEqual(2, len(sessions))
+        self.assertEqual(
+            [False, True],
+            sorted(session["current"] for session in sessions),
+        )
+        self.assertNotIn(cookie.split("=")[1], result["body"])
+        self.assertNotIn(other_cookie.split("=")[1], result["body"])
+
+    @moto.mock_aws
+    @unittest.mock.patch.dict(
+        os.environ,
+        {"AWS_DEFAULT_REGION": "ap-northeast-1"},
+    )
+    def test_handler_revoke_all_sessions(self):
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="dev-s3-session-storage")
+        cognito_idp = boto3.client("cognito-idp")
+        secretsmanager = boto3.client("secretsmanager")
+        user_pool_id, user_pool_domain = setup_cognito(
+            cognito_idp,
+            secretsmanager,
+        )
+
+        with unittest.mock.patch.dict(
+            os.environ,
+            {
+                "S3_BUCKET": "dev-s3-session-storage",
+                "COGNITO_USER_POOL_ID": user_pool_id,
+                "COGNITO_USER_POOL_DOMAIN": user_pool_domain,
+                "API_CLIENT_SECRET_ID": "dev/serverless-app/api-client",
+            },
+        ):
+            cookie = login()
+            other_cookie = login()
+            result = auth.handler(
+                cookie_event("/auth/sessions/revoke-all", cookie),
+                None,
+            )
+            self.assertEqual(200, result["statusCode"])
+            for c in [cookie, other_cookie]:
+                result = auth.handler(
+                    cookie_event("/auth/session", c),
+                    None,
+                )
+                self.assertEqual(401, result["statusCode"])
+
+    @moto.mock_aws
+    @unittest.mock.patch.dict(
+        os.environ,
+        {"AWS_DEFAULT_REGION": "ap-northeast-1"},
+    )
+    def test_handler_login_when_timed_out(self):
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="dev-s3-session-storage")
+        cognito_idp = boto3.client("cognito-idp")
+        secretsmanager = boto3.client("secretsmanager")
+        user_pool_id, user_pool_domain = setup_cognito(
+            cognito_idp,
+            secretsmanager,
+        )
+        add_user_session = auth.storage.S3Storage.add_user_session
+
+        def slow_add_user_session(*args):
+            time.sleep(0.5)
+            return add_user_session(*args)
+
+        with unittest.mock.patch.dict(
+            os.environ,
+            {
+                "S3_BUCKET": "dev-s3-session-storage",
+                "COGNITO_USER_POOL_ID": user_pool_id,
+                "COGNITO_USER_POOL_DOMAIN": user_pool_domain,
+                "API_CLIENT_SECRET_ID": "dev/serverless-app/api-client",
+                "IO_TIMEOUT_SECONDS": "0.1",
+            },
+        ), unittest.mock.patch.object(
+            auth.storage.S3Storage,
+            "add_user_session",
+            slow_add_user_session,
+        ):
+            result = auth.handler(login_event(), None)
+            self.assertEqual(504, result["statusCode"])
+            # let the pending call finish before moto goes away
+            auth.runtime.get_runtime().executor.shutdown()
+
+    @moto.mock_aws
+    @unittest.mock.patch.dict(
+        os.environ,
+        {"AWS_DEFAULT_REGION": "ap-northeast-1"},
+    )
+    def test_handler_login_when_save_failed(self):
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="dev-s3-session-storage")
+        cognito_idp = boto3.client("cognito-idp")
+        secretsmanager = boto3.client("secretsmanager")
+        user_pool_id, user_pool_domain = setup_cognito(
+            cognito_idp,
+            secretsmanager,
+        )
+
+        for method in ["save_tokens", "add_user_session"]:
+            with self.subTest(method=method), unittest.mock.patch.dict(
+                os.environ,
+                {
+                    "S3_BUCKET": "dev-s3-session-storage",
+                    "COGNITO_USER_POOL_ID": user_pool_id,
+                    "COGNITO_USER_POOL_DOMAIN": user_pool_domain,
+                    "API_CLIENT_SECRET_ID": "dev/serverless-app/api-client",
+                },
+            ), unittest.mock.patch.object(
+                auth.storage.S3Storage,
+                method,
+                side_effect=Exception("failed"),
+            ):
+                with self.assertRaisesRegex(Exception, "failed"):
+                    auth.handler(login_event(), None)
+                # the write which did succeed is undone
+                for prefix in ["sessions/", "users/"]:
+                    self.assertEqual(
+                        0,
+                        s3.list_objects_v2(
+                            Bucket="dev-s3-session-storage",
+                            Prefix=prefix,
+                        )["KeyCount"],
+                    )
+
+    @moto.mock_aws
+    @unittest.mock.patch.dict(
+        os.environ,
+        {"AWS_DEFAULT_REGION": "ap-northeast-1"},
+    )
+    def test_handler_session_in_cookie_mode(self):
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="dev-s3-session-storage")
+        cognito_idp = boto3.client("cognito-idp")
+        secretsmanager = boto3.client("secretsmanager")
+        user_pool_id, user_pool_domain = setup_cognito(
+            cognito_idp,
+            secretsmanager,
+        )
+        secretsmanager.create_secret(
+            Name="dev/serverless-app/auth-keys",
+            SecretString=json.dumps(
+                {
+                    "session_keys": [
+                        base64.urlsafe_b64encode(os.urandom(32)).decode(),
+                    ],
+                },
+            ),
+        )
+
+        with unittest.mock.patch.dict(
+            os.environ,
+            {
+                "S3_BUCKET": "dev-s3-session-storage",
+                "COGNITO_USER_POOL_ID": user_pool_id,
+                "COGNITO_USER_POOL_DOMAIN": user_pool_domain,
+                "API_CLIENT_SECRET_ID": "dev/serverless-app/api-client",
+                "SESSION_MODE": "cookie",
+                "SESSION_KEYS_SECRET_ID": "dev/serverless-app/auth-keys",
+                "SESSION_CACHE_MAX_ENTRIES": "0",
+            },
+        ):
+            result = auth.handler(login_event(), None)
+            self.assertEqual(200, result["statusCode"])
+            jar = cookies(
+                result["cookies"],
+                result["headers"]["Set-Cookie"],
+            )
+            session_id = jar["session_id"].value
+            key = f"sessions/{session_id}/tokens.json"
+            stored = s3.get_object(Bucket="dev-s3-session-storage", Key=key)
+            s3.delete_object(Bucket="dev-s3-session-storage", Key=key)
+
+            # answered from the cookie, the stored tokens are not read
+            cookie = jar.output(header="", sep=";").strip()
+            result = auth.handler(cookie_event("/auth/session", cookie), None)
+            self.assertEqual(200, result["statusCode"])
+            self.assertNotIn("cookies", result)
+            body = json.loads(result["body"])
+            self.assertIsNotNone(body["session"]["access_token"])
+
+            # without the envelope the session is read from storage and the
+            # envelope written again
+            s3.put_object(
+                Bucket="dev-s3-session-storage",
+                Key=key,
+                Body=stored["Body"].read(),
+            )
+            cookie = f"session_id={session_id}"
+            result = auth.handler(cookie_event("/auth/session", cookie), None)
+            self.assertEqual(200, result["statusCode"])
+            self.assertEqual(body, json.loads(result["body"]))
+            self.assertIn("session_tokens_0", cookies(result["cookies"]))
+
+            cookie = jar.output(header="", sep=";").strip()
+            result = auth.handler(cookie_event("/auth/logout", cookie), None)
+            self.assertEqual(200, result["statusCode"])
+            jar = cookies(result["cookies"], jar)
+            self.assertEqual(["session_id"], list(jar))
+
+
+def login():
+    result = auth.handler(login_event(), None)
+    cookies = http.cookies.SimpleCookie(result["headers"]["Set-Cookie"])
+    return cookies.output(header="", sep=";").strip()
+
+
+def login_event():
+    return {
+        "rawPath": "/auth/login",
+        "rawQueryString": "",
+        "headers": {
+            "host": "lambda-url.com",
+        },
+        "requestContext": {
+            "http": {
+                "method": "POST",
+                "path": "/auth/login",
+            },
+            "requestId": "be4172b1-0ea4-4121-88db-08960adb054f",
+            "timeEpoch": 1725703735416,
+        },
+        "body": json.dumps(
+            {
+                "username": "admin@example.com",
+                "password": "P@ssw0rd",
+            }
+        ),
+        "isBase64Encoded": False,
+    }
+
+
+def cookie_event(path, cookie):
+    return {
+        "rawPath": path,
+        "rawQueryString": "",
+        "headers": {
+            "host": "lambda-url.com",
+            "cookie": cookie,
+        },
+        "requestContext": {
+            "http": {
+                "method": "POST",
+                "path": path,
+            },
+            "requestId": "be4172b1-0ea4-4121-88db-08960adb054f",
+            "timeEpoch": 1725703735416,
+        },
+        "isBase64Encoded": False,
+    }
+
 
 if __name__ == "__main__":
     unittest.main()
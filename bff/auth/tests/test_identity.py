@@ -1,8 +1,12 @@
+import http.server
 import json
+import threading
+import time
 import unittest
 
 import boto3
 import moto
+import requests.exceptions
 
 import auth.identity
 
@@ -87,7 +91,7 @@ class TestIdentity(unittest.TestCase):
             sut.login("admin@example.com", "invalid_password")
 
     @moto.mock_aws
-    @unittest.mock.patch("requests.post")
+    @unittest.mock.patch("requests.Session.post")
     def test_request_tokens_by_code(self, mock_post):
         mock_response = unittest.mock.MagicMock()
         mock_response.status_code = 200
@@ -116,6 +120,81 @@ class TestIdentity(unittest.TestCase):
         )
         tokens = sut.request_tokens_by_code("code")
         self.assertIsNotNone(tokens["id_token"])
+        self.assertEqual((3.05, 10), mock_post.call_args.kwargs["timeout"])
+
+    @moto.mock_aws
+    @unittest.mock.patch("requests.Session.post")
+    def test_request_tokens_by_code_when_redeemed(self, mock_post):
+        mock_response = unittest.mock.MagicMock()
+        mock_response.status_code = 400
+        mock_response.json.return_value = {"error": "invalid_grant"}
+        mock_post.return_value = mock_response
+
+        cognito_idp = boto3.client("cognito-idp")
+        secretsmanager = boto3.client("secretsmanager")
+        user_pool_id, user_pool_domain = setup_cognito(
+            cognito_idp,
+            secretsmanager,
+        )
+
+        sut = auth.identity.Identity(
+            cognito_idp,
+            secretsmanager,
+            user_pool_id,
+            user_pool_domain,
+            "dev/serverless-app/api-client",
+        )
+        exception = auth.identity.TokenRequestFailedException
+        with self.assertRaises(exception) as cm:
+            sut.request_tokens_by_code("code")
+        self.assertEqual(400, cm.exception.status)
+        self.assertEqual("invalid_grant", cm.exception.error)
+
+    @moto.mock_aws
+    def test_login_after_secret_rotation(self):
+        cognito_idp = boto3.client("cognito-idp")
+        secretsmanager = boto3.client("secretsmanager")
+        user_pool_id, user_pool_domain = setup_cognito(
+            cognito_idp,
+            secretsmanager,
+        )
+
+        sut = auth.identity.Identity(
+            cognito_idp,
+            secretsmanager,
+            user_pool_id,
+            user_pool_domain,
+            "dev/serverless-app/api-client",
+        )
+        sut.login("admin@example.com", "P@ssw0rd")
+
+        old_client_id = json.loads(
+            secretsmanager.get_secret_value(
+                SecretId="dev/serverless-app/api-client",
+            )["SecretString"]
+        )["client_id"]
+        new_client = cognito_idp.create_user_pool_client(
+            UserPoolId=user_pool_id,
+            ClientName="dev-user-pool-client-rotated",
+            GenerateSecret=True,
+        )["UserPoolClient"]
+        secretsmanager.put_secret_value(
+            SecretId="dev/serverless-app/api-client",
+            SecretString=json.dumps(
+                {
+                    "client_id": new_client["ClientId"],
+                    "client_secret": new_client["ClientSecret"],
+                    "redirect_uri": "https://example.com/auth/callback",
+                }
+            ),
+        )
+        cognito_idp.delete_user_pool_client(
+            UserPoolId=user_pool_id,
+            ClientId=old_client_id,
+        )
+
+        tokens = sut.login("admin@example.com", "P@ssw0rd")
+        self.assertIsNotNone(tokens["id_token"])
 
     @moto.mock_aws
     def test_refresh_token(self):
@@ -169,3 +248,69 @@ class TestIdentity(unittest.TestCase):
                 "admin@example.com",
                 tokens["refresh_token"],
             )
+
+
+class TestCreateHttpSession(unittest.TestCase):
+    def setUp(self):
+        self.statuses = []
+        self.clients = set()
+        self.requests = 0
+        self.delay = 0.0
+        owner = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                owner.clients.add(self.client_address)
+                owner.requests += 1
+                self.rfile.read(int(self.headers["Content-Length"]))
+                time.sleep(owner.delay)
+                status = owner.statuses.pop(0) if owner.statuses else 200
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.send_header("Retry-After", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.url = f"http://127.0.0.1:{server.server_address[1]}/oauth2/token"
+
+    def test_keep_alive(self):
+        sut = auth.identity.create_http_session()
+        for _ in range(3):
+            self.assertEqual(200, sut.post(self.url, data={}).status_code)
+        self.assertEqual(1, len(self.clients))
+
+    def test_retry(self):
+        sut = auth.identity.create_http_session(backoff_factor=0)
+        self.statuses = [503, 429]
+        self.assertEqual(200, sut.post(self.url, data={}).status_code)
+
+    def test_retry_when_exhausted(self):
+        sut = auth.identity.create_http_session(
+            max_retries=1,
+            backoff_factor=0,
+        )
+        self.statuses = [503, 503, 503]
+        self.assertEqual(503, sut.post(self.url, data={}).status_code)
+        self.assertEqual([503], self.statuses)
+
+    def test_no_retry_when_maybe_processed(self):
+        # the code may have been redeemed, sending it again would fail
+        sut = auth.identity.create_http_session(backoff_factor=0)
+        for status in [500, 502, 504]:
+            with self.subTest(status=status):
+                self.statuses = [status]
+                response = sut.post(self.url, data={})
+                self.assertEqual(status, response.status_code)
+        self.assertEqual(3, self.requests)
+        self.delay = 0.5
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            sut.post(self.url, data={}, timeout=(1, 0.1))
+        self.assertEqual(4, self.requests)
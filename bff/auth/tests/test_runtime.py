@@ -0,0 +1,71 @@
+import os
+import unittest
+import unittest.mock
+
+import moto
+
+import auth.identity
+import auth.runtime
+import auth.storage
+
+
+class TestRuntime(unittest.TestCase):
+    def setUp(self):
+        auth.runtime.reset_runtime()
+
+    def tearDown(self):
+        auth.runtime.reset_runtime()
+
+    @moto.mock_aws
+    @unittest.mock.patch.dict(
+        os.environ,
+        {
+            "AWS_DEFAULT_REGION": "ap-northeast-1",
+            "S3_BUCKET": "dev-s3-session-storage",
+            "COGNITO_USER_POOL_ID": "user-pool-id",
+            "COGNITO_USER_POOL_DOMAIN": "example.com",
+            "API_CLIENT_SECRET_ID": "dev/serverless-app/api-client",
+        },
+    )
+    def test_get_runtime(self):
+        sut = auth.runtime.get_runtime()
+        self.assertIs(sut, auth.runtime.get_runtime())
+        self.assertEqual("dev-s3-session-storage", sut.config.s3_bucket)
+        self.assertIs(sut.client("s3"), sut.client("s3"))
+        self.assertIsInstance(sut.storage, auth.storage.CachedStorage)
+        self.assertIs(sut.storage, sut.storage)
+        self.assertIsInstance(sut.identity, auth.identity.Identity)
+        self.assertIs(sut.identity, sut.identity)
+
+    @moto.mock_aws
+    @unittest.mock.patch.dict(
+        os.environ,
+        {"AWS_DEFAULT_REGION": "ap-northeast-1", "S3_BUCKET": "bucket-a"},
+    )
+    def test_reset_runtime(self):
+        before = auth.runtime.get_runtime()
+        with unittest.mock.patch.dict(os.environ, {"S3_BUCKET": "bucket-b"}):
+            current = auth.runtime.get_runtime()
+            self.assertEqual("bucket-a", current.config.s3_bucket)
+            auth.runtime.reset_runtime()
+            after = auth.runtime.get_runtime()
+        self.assertIsNot(before, after)
+        self.assertEqual("bucket-b", after.config.s3_bucket)
+
+    @moto.mock_aws
+    @unittest.mock.patch.dict(
+        os.environ,
+        {
+            "AWS_DEFAULT_REGION": "ap-northeast-1",
+            "SESSION_STORAGE": "dynamodb",
+            "DYNAMODB_TABLE": "dev-dynamodb-session-storage",
+            "SESSION_CACHE_MAX_ENTRIES": "0",
+            "SESSION_NEGATIVE_CACHE_MAX_ENTRIES": "0",
+        },
+    )
+    def test_storage_with_dynamodb(self):
+        sut = auth.runtime.get_runtime()
+        self.assertIsInstance(sut.storage, auth.storage.CachedStorage)
+        with self.assertRaises(auth.storage.DataNotFoundException):
+            sut.storage.get_tokens("session-id")
+        self.assertEqual(1, sut.storage.stats()["rejected_malformed"])
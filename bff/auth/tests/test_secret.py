@@ -0,0 +1,72 @@
+import json
+import threading
+import time
+import unittest
+import unittest.mock
+
+from auth.secret import SecretCache
+
+
+def secretsmanager_stub(*values):
+    secretsmanager = unittest.mock.MagicMock()
+    secretsmanager.get_secret_value.side_effect = [
+        {"SecretString": json.dumps(value)} for value in values
+    ]
+    return secretsmanager
+
+
+class TestSecretCache(unittest.TestCase):
+    def test_get(self):
+        secretsmanager = secretsmanager_stub({"client_id": "a"})
+        sut = SecretCache(secretsmanager)
+        self.assertEqual({"client_id": "a"}, sut.get("secret-id"))
+        self.assertEqual({"client_id": "a"}, sut.get("secret-id"))
+        secretsmanager.get_secret_value.assert_called_once_with(
+            SecretId="secret-id",
+        )
+
+    def test_get_when_expired(self):
+        now = [0.0]
+        secretsmanager = secretsmanager_stub(
+            {"client_id": "a"},
+            {"client_id": "b"},
+        )
+        sut = SecretCache(secretsmanager, ttl=60, clock=lambda: now[0])
+        self.assertEqual({"client_id": "a"}, sut.get("secret-id"))
+        now[0] = 59
+        self.assertEqual({"client_id": "a"}, sut.get("secret-id"))
+        now[0] = 60
+        self.assertEqual({"client_id": "b"}, sut.get("secret-id"))
+
+    def test_invalidate(self):
+        secretsmanager = secretsmanager_stub(
+            {"client_id": "a"},
+            {"client_id": "b"},
+        )
+        sut = SecretCache(secretsmanager)
+        self.assertEqual({"client_id": "a"}, sut.get("secret-id"))
+        sut.invalidate("secret-id")
+        self.assertEqual({"client_id": "b"}, sut.get("secret-id"))
+
+    def test_get_concurrently(self):
+        calls = []
+
+        def get_secret_value(SecretId):
+            calls.append(SecretId)
+            time.sleep(0.05)
+            return {"SecretString": json.dumps({"client_id": "a"})}
+
+        secretsmanager = unittest.mock.MagicMock()
+        secretsmanager.get_secret_value.side_effect = get_secret_value
+        sut = SecretCache(secretsmanager)
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(sut.get("id")))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(["id"], calls)
+        self.assertEqual([{"client_id": "a"}] * 8, results)
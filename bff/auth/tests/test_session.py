@@ -0,0 +1,190 @@
+import datetime
+import threading
+import time
+import unittest
+import unittest.mock
+
+import boto3
+import moto
+from jose import jwt
+
+import auth.identity
+import auth.session
+import auth.storage
+
+from .test_identity import setup_cognito
+
+
+def expire_in(tokens: dict, seconds: int) -> dict:
+    return dict(
+        tokens,
+        expiration=(
+            datetime.datetime.now(datetime.timezone.utc)
+            + datetime.timedelta(seconds=seconds)
+        ).isoformat(),
+    )
+
+
+class TestRefreshPolicy(unittest.TestCase):
+    def test_should_refresh(self):
+        sut = auth.session.RefreshPolicy(threshold=20 * 60)
+        tokens = {"expiration": "2000-01-01T00:00:00+00:00"}
+        self.assertFalse(sut.should_refresh("id", expire_in(tokens, 1300)))
+        self.assertTrue(sut.should_refresh("id", expire_in(tokens, 1100)))
+        self.assertTrue(sut.should_refresh("id", expire_in(tokens, -1)))
+
+    def test_threshold_for(self):
+        sut = auth.session.RefreshPolicy(threshold=20 * 60, jitter=10 * 60)
+        thresholds = [sut.threshold_for(f"session-{i}") for i in range(100)]
+        self.assertEqual(thresholds[0], sut.threshold_for("session-0"))
+        self.assertTrue(all(1200 <= t <= 1800 for t in thresholds))
+        self.assertGreater(max(thresholds) - min(thresholds), 300)
+
+    def test_should_refresh_when_rate_limited(self):
+        now = [0.0]
+        sut = auth.session.RefreshPolicy(
+            threshold=20 * 60,
+            max_per_second=2,
+            clock=lambda: now[0],
+        )
+        tokens = {"expiration": "2000-01-01T00:00:00+00:00"}
+        expiring = expire_in(tokens, 60)
+        self.assertTrue(sut.should_refresh("id", expiring))
+        self.assertTrue(sut.should_refresh("id", expiring))
+        self.assertFalse(sut.should_refresh("id", expiring))
+        # expired tokens are always refreshed
+        self.assertTrue(sut.should_refresh("id", expire_in(tokens, -1)))
+        now[0] = 0.5
+        self.assertTrue(sut.should_refresh("id", expiring))
+        self.assertFalse(sut.should_refresh("id", expiring))
+
+
+class TestClaims(unittest.TestCase):
+    def test_attach_claims(self):
+        claims = {"sub": "user-id", "cognito:username": "admin"}
+        tokens = {"id_token": jwt.encode(claims, "secret")}
+        result = auth.session.attach_claims(tokens)
+        self.assertEqual(claims, result["claims"])
+        self.assertNotIn("claims", tokens)
+        with unittest.mock.patch.object(
+            jwt,
+            "get_unverified_claims",
+        ) as get_unverified_claims:
+            self.assertEqual(claims, auth.session.get_claims(result))
+        get_unverified_claims.assert_not_called()
+
+    def test_get_claims_without_stored_claims(self):
+        claims = {"sub": "user-id", "cognito:username": "admin"}
+        tokens = {"id_token": jwt.encode(claims, "secret")}
+        self.assertEqual(claims, auth.session.get_claims(tokens))
+
+
+class TestRefreshSession(unittest.TestCase):
+    def setUp(self):
+        self.mock_aws = moto.mock_aws()
+        self.mock_aws.start()
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="test-bucket")
+        cognito_idp = boto3.client("cognito-idp")
+        secretsmanager = boto3.client("secretsmanager")
+        user_pool_id, user_pool_domain = setup_cognito(
+            cognito_idp,
+            secretsmanager,
+        )
+        self.storage = auth.storage.S3Storage(s3, "test-bucket")
+        self.identity = auth.identity.Identity(
+            cognito_idp,
+            secretsmanager,
+            user_pool_id,
+            user_pool_domain,
+            "dev/serverless-app/api-client",
+        )
+        self.tokens = self.identity.login("admin@example.com", "P@ssw0rd")
+
+    def tearDown(self):
+        self.mock_aws.stop()
+
+    def test_refresh_session(self):
+        tokens = expire_in(self.tokens, 60)
+        self.storage.save_tokens("session-id", tokens)
+        refreshed = auth.session.refresh_session(
+            self.storage,
+            self.identity,
+            "session-id",
+            tokens,
+            threshold=20 * 60,
+        )
+        self.assertFalse(auth.session.expires_within(refreshed, 20 * 60))
+        self.assertEqual(refreshed, self.storage.get_tokens("session-id"))
+
+    def test_refresh_session_when_lease_is_taken(self):
+        tokens = expire_in(self.tokens, 60)
+        self.storage.save_tokens("session-id", tokens)
+        self.storage.acquire_refresh_lease("session-id", 10)
+        with unittest.mock.patch.object(
+            self.identity,
+            "refresh_tokens",
+        ) as refresh_tokens:
+            result = auth.session.refresh_session(
+                self.storage,
+                self.identity,
+                "session-id",
+                tokens,
+                threshold=20 * 60,
+            )
+        self.assertEqual(tokens, result)
+        refresh_tokens.assert_not_called()
+
+    def test_refresh_session_when_expired_and_lease_is_taken(self):
+        tokens = expire_in(self.tokens, -1)
+        self.storage.save_tokens("session-id", tokens)
+        self.storage.acquire_refresh_lease("session-id", 10)
+        with self.assertRaises(auth.session.SessionRefreshFailedException):
+            auth.session.refresh_session(
+                self.storage,
+                self.identity,
+                "session-id",
+                tokens,
+                threshold=20 * 60,
+                wait=0.3,
+            )
+
+    def test_refresh_session_concurrently(self):
+        tokens = expire_in(self.tokens, -1)
+        self.storage.save_tokens("session-id", tokens)
+        refresh_tokens = self.identity.refresh_tokens
+        calls = []
+
+        def slow_refresh_tokens(*args):
+            calls.append(args)
+            time.sleep(0.3)
+            return refresh_tokens(*args)
+
+        results = []
+
+        def refresh():
+            results.append(
+                auth.session.refresh_session(
+                    self.storage,
+                    self.identity,
+                    "session-id",
+                    tokens,
+                    threshold=20 * 60,
+                )
+            )
+
+        with unittest.mock.patch.object(
+            self.identity,
+            "refresh_tokens",
+            side_effect=slow_refresh_tokens,
+        ):
+            threads = [threading.Thread(target=refresh) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(1, len(calls))
+        self.assertEqual(8, len(results))
+        for result in results:
+            self.assertFalse(auth.session.expires_within(result, 0))
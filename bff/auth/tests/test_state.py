@@ -0,0 +1,57 @@
+import unittest
+
+from auth.state import InvalidStateException, StateCodec
+
+KEY = bytes(range(32))
+
+
+class TestStateCodec(unittest.TestCase):
+    def test_decode(self):
+        sut = StateCodec(KEY)
+        token = sut.encode({"redirect_url": "/contacts"})
+        self.assertEqual({"redirect_url": "/contacts"}, sut.decode(token))
+
+    def test_decode_when_tampered(self):
+        sut = StateCodec(KEY)
+        body, signature = sut.encode({"redirect_url": "/"}).split(".")
+        forged = StateCodec(bytes(32)).encode({"redirect_url": "//evil"})
+        for token in [
+            f"{forged.split('.')[0]}.{signature}",
+            f"{body}.{signature[:-2]}",
+            forged,
+            "",
+            "あ.い",
+        ]:
+            with self.subTest(token=token):
+                with self.assertRaises(InvalidStateException):
+                    sut.decode(token)
+
+    def test_decode_when_expired(self):
+        now = [1000.0]
+        sut = StateCodec(KEY, ttl=600, clock=lambda: now[0])
+        token = sut.encode({})
+        now[0] += 600
+        with self.assertRaises(InvalidStateException):
+            sut.decode(token)
+
+    def test_decode_when_replayed(self):
+        sut = StateCodec(KEY)
+        token = sut.encode({})
+        sut.decode(token)
+        with self.assertRaises(InvalidStateException):
+            sut.decode(token)
+
+    def test_decode_when_encrypted(self):
+        sut = StateCodec(KEY, encrypt=True)
+        token = sut.encode({"redirect_url": "/contacts"})
+        self.assertNotIn(".", token)
+        self.assertEqual({"redirect_url": "/contacts"}, sut.decode(token))
+        tampered = token[:-2] + ("A" if token[-2] != "A" else "B") + token[-1]
+        for token in [tampered, "", "abc"]:
+            with self.subTest(token=token):
+                with self.assertRaises(InvalidStateException):
+                    StateCodec(KEY, encrypt=True).decode(token)
+
+    def test_init_when_key_is_short(self):
+        with self.assertRaises(ValueError):
+            StateCodec(b"short")
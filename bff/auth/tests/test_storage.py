@@ -1,17 +1,37 @@
+import datetime
 import unittest
+import unittest.mock
 
 import boto3
 import moto
 
 import auth.storage
+from auth.cache import LRUCache
+from auth.session import is_session_id
 
 
-class TestStorage(unittest.TestCase):
+def setup_dynamodb(dynamodb, table_name):
+    dynamodb.create_table(
+        TableName=table_name,
+        KeySchema=[{"AttributeName": "pk", "KeyType": "HASH"}],
+        AttributeDefinitions=[{"AttributeName": "pk", "AttributeType": "S"}],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    dynamodb.update_time_to_live(
+        TableName=table_name,
+        TimeToLiveSpecification={
+            "Enabled": True,
+            "AttributeName": "expires_at",
+        },
+    )
+
+
+class TestS3Storage(unittest.TestCase):
     @moto.mock_aws
     def test_save_tokens(self):
         s3 = boto3.client("s3", region_name="us-east-1")
         s3.create_bucket(Bucket="test-bucket")
-        sut = auth.storage.Storage(s3, "test-bucket")
+        sut = auth.storage.S3Storage(s3, "test-bucket")
         sut.save_tokens("request-id", {"tokens": "tokens"})
         ret = sut.get_tokens("request-id")
         self.assertEqual({"tokens": "tokens"}, ret)
@@ -20,19 +40,380 @@ class TestStorage(unittest.TestCase):
     def test_delete_tokens(self):
         s3 = boto3.client("s3", region_name="us-east-1")
         s3.create_bucket(Bucket="test-bucket")
-        sut = auth.storage.Storage(s3, "test-bucket")
+        sut = auth.storage.S3Storage(s3, "test-bucket")
         sut.save_tokens("request-id", {"tokens": "tokens"})
         sut.delete_tokens("request-id")
         with self.assertRaises(auth.storage.DataNotFoundException):
             sut.get_tokens("request-id")
+        sut.delete_tokens("request-id")
+
+    @moto.mock_aws
+    def test_pop_tokens(self):
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="test-bucket")
+        sut = auth.storage.S3Storage(s3, "test-bucket")
+        sut.save_tokens("request-id", {"tokens": "tokens"})
+        self.assertEqual({"tokens": "tokens"}, sut.pop_tokens("request-id"))
         with self.assertRaises(auth.storage.DataNotFoundException):
-            sut.delete_tokens("request-id")
+            sut.pop_tokens("request-id")
+
+    @moto.mock_aws
+    def test_delete_sessions(self):
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="test-bucket")
+        sut = auth.storage.S3Storage(s3, "test-bucket")
+        session_ids = [f"session-{i}" for i in range(1001)]
+        for session_id in session_ids:
+            sut.save_tokens(session_id, {"tokens": session_id})
+        sut.save_tokens("other", {"tokens": "other"})
+        sut.delete_sessions(session_ids + ["unknown"])
+        for session_id in session_ids:
+            with self.assertRaises(auth.storage.DataNotFoundException):
+                sut.get_tokens(session_id)
+        self.assertEqual({"tokens": "other"}, sut.get_tokens("other"))
 
     @moto.mock_aws
     def test_save_state(self):
         s3 = boto3.client("s3", region_name="us-east-1")
         s3.create_bucket(Bucket="test-bucket")
-        sut = auth.storage.Storage(s3, "test-bucket")
+        sut = auth.storage.S3Storage(s3, "test-bucket")
         sut.save_state("request-id", {"redirect_url": "/"})
         ret = sut.get_state("request-id")
         self.assertEqual({"redirect_url": "/"}, ret)
+
+    @moto.mock_aws
+    def test_user_sessions(self):
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="test-bucket")
+        sut = auth.storage.S3Storage(s3, "test-bucket")
+        sut.add_user_session("user-1", "session-1")
+        sut.add_user_session("user-1", "session-2")
+        sut.add_user_session("user-2", "session-3")
+        self.assertEqual(
+            ["session-1", "session-2"],
+            sorted(sut.list_user_sessions("user-1")),
+        )
+        sut.remove_user_sessions("user-1", ["session-1"])
+        self.assertEqual(["session-2"], sut.list_user_sessions("user-1"))
+        self.assertEqual(["session-3"], sut.list_user_sessions("user-2"))
+        self.assertEqual([], sut.list_user_sessions("user-3"))
+
+    @moto.mock_aws
+    def test_refresh_lease(self):
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="test-bucket")
+        sut = auth.storage.S3Storage(s3, "test-bucket")
+        lease = sut.acquire_refresh_lease("session-id", 60)
+        self.assertIsNotNone(lease)
+        self.assertIsNone(sut.acquire_refresh_lease("session-id", 60))
+        self.assertIsNotNone(sut.acquire_refresh_lease("other-id", 60))
+        sut.release_refresh_lease("session-id", "not-the-owner")
+        self.assertIsNone(sut.acquire_refresh_lease("session-id", 60))
+        sut.release_refresh_lease("session-id", lease)
+        self.assertIsNotNone(sut.acquire_refresh_lease("session-id", 60))
+
+    @moto.mock_aws
+    def test_refresh_lease_when_expired(self):
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="test-bucket")
+        sut = auth.storage.S3Storage(s3, "test-bucket")
+        expired = sut.acquire_refresh_lease("session-id", 0)
+        self.assertIsNotNone(expired)
+        lease = sut.acquire_refresh_lease("session-id", 60)
+        self.assertIsNotNone(lease)
+        # the lease holds for its whole ttl, whatever the time
+        self.assertIsNone(sut.acquire_refresh_lease("session-id", 60))
+        sut.release_refresh_lease("session-id", expired)
+        self.assertIsNone(sut.acquire_refresh_lease("session-id", 60))
+        sut.release_refresh_lease("session-id", lease)
+        # only the marker of the released generation is left behind
+        res = s3.list_objects_v2(
+            Bucket="test-bucket",
+            Prefix="sessions/session-id/refresh/",
+        )
+        self.assertEqual(1, res["KeyCount"])
+        self.assertIsNotNone(sut.acquire_refresh_lease("session-id", 60))
+
+
+class TestDynamoDBStorage(unittest.TestCase):
+    @moto.mock_aws
+    def test_save_tokens(self):
+        dynamodb = boto3.client("dynamodb", region_name="us-east-1")
+        setup_dynamodb(dynamodb, "test-table")
+        sut = auth.storage.DynamoDBStorage(dynamodb, "test-table")
+        sut.save_tokens("request-id", {"tokens": "tokens"})
+        ret = sut.get_tokens("request-id")
+        self.assertEqual({"tokens": "tokens"}, ret)
+
+    @moto.mock_aws
+    def test_get_tokens_when_expired(self):
+        dynamodb = boto3.client("dynamodb", region_name="us-east-1")
+        setup_dynamodb(dynamodb, "test-table")
+        sut = auth.storage.DynamoDBStorage(
+            dynamodb,
+            "test-table",
+            session_ttl=0,
+        )
+        sut.save_tokens("request-id", {"tokens": "tokens"})
+        with self.assertRaises(auth.storage.DataNotFoundException):
+            sut.get_tokens("request-id")
+
+    @moto.mock_aws
+    def test_delete_tokens(self):
+        dynamodb = boto3.client("dynamodb", region_name="us-east-1")
+        setup_dynamodb(dynamodb, "test-table")
+        sut = auth.storage.DynamoDBStorage(dynamodb, "test-table")
+        sut.save_tokens("request-id", {"tokens": "tokens"})
+        sut.delete_tokens("request-id")
+        with self.assertRaises(auth.storage.DataNotFoundException):
+            sut.get_tokens("request-id")
+        sut.delete_tokens("request-id")
+
+    @moto.mock_aws
+    def test_pop_tokens(self):
+        dynamodb = boto3.client("dynamodb", region_name="us-east-1")
+        setup_dynamodb(dynamodb, "test-table")
+        sut = auth.storage.DynamoDBStorage(dynamodb, "test-table")
+        sut.save_tokens("request-id", {"tokens": "tokens"})
+        self.assertEqual({"tokens": "tokens"}, sut.pop_tokens("request-id"))
+        with self.assertRaises(auth.storage.DataNotFoundException):
+            sut.pop_tokens("request-id")
+
+    @moto.mock_aws
+    def test_delete_sessions(self):
+        dynamodb = boto3.client("dynamodb", region_name="us-east-1")
+        setup_dynamodb(dynamodb, "test-table")
+        sut = auth.storage.DynamoDBStorage(dynamodb, "test-table")
+        session_ids = [f"session-{i}" for i in range(60)]
+        for session_id in session_ids:
+            sut.save_tokens(session_id, {"tokens": session_id})
+        sut.save_tokens("other", {"tokens": "other"})
+        sut.delete_sessions(session_ids + ["unknown"])
+        for session_id in session_ids:
+            with self.assertRaises(auth.storage.DataNotFoundException):
+                sut.get_tokens(session_id)
+        self.assertEqual({"tokens": "other"}, sut.get_tokens("other"))
+
+    @moto.mock_aws
+    def test_save_state(self):
+        dynamodb = boto3.client("dynamodb", region_name="us-east-1")
+        setup_dynamodb(dynamodb, "test-table")
+        sut = auth.storage.DynamoDBStorage(dynamodb, "test-table")
+        sut.save_state("request-id", {"redirect_url": "/"})
+        ret = sut.get_state("request-id")
+        self.assertEqual({"redirect_url": "/"}, ret)
+        with self.assertRaises(Exception):
+            sut.save_state("request-id", {"redirect_url": "/other"})
+
+    @moto.mock_aws
+    def test_user_sessions(self):
+        dynamodb = boto3.client("dynamodb", region_name="us-east-1")
+        setup_dynamodb(dynamodb, "test-table")
+        sut = auth.storage.DynamoDBStorage(dynamodb, "test-table")
+        sut.add_user_session("user-1", "session-1")
+        sut.add_user_session("user-1", "session-2")
+        sut.add_user_session("user-2", "session-3")
+        self.assertEqual(
+            ["session-1", "session-2"],
+            sorted(sut.list_user_sessions("user-1")),
+        )
+        sut.remove_user_sessions("user-1", ["session-1"])
+        self.assertEqual(["session-2"], sut.list_user_sessions("user-1"))
+        sut.remove_user_sessions("user-1", ["session-2"])
+        self.assertEqual([], sut.list_user_sessions("user-1"))
+        self.assertEqual(["session-3"], sut.list_user_sessions("user-2"))
+        self.assertEqual([], sut.list_user_sessions("user-3"))
+
+    @moto.mock_aws
+    def test_refresh_lease(self):
+        dynamodb = boto3.client("dynamodb", region_name="us-east-1")
+        setup_dynamodb(dynamodb, "test-table")
+        sut = auth.storage.DynamoDBStorage(dynamodb, "test-table")
+        lease = sut.acquire_refresh_lease("session-id", 60)
+        self.assertIsNotNone(lease)
+        self.assertIsNone(sut.acquire_refresh_lease("session-id", 60))
+        self.assertIsNotNone(sut.acquire_refresh_lease("other-id", 60))
+        sut.release_refresh_lease("session-id", "not-the-owner")
+        self.assertIsNone(sut.acquire_refresh_lease("session-id", 60))
+        sut.release_refresh_lease("session-id", lease)
+        self.assertIsNotNone(sut.acquire_refresh_lease("session-id", 60))
+
+    @moto.mock_aws
+    def test_refresh_lease_when_expired(self):
+        dynamodb = boto3.client("dynamodb", region_name="us-east-1")
+        setup_dynamodb(dynamodb, "test-table")
+        sut = auth.storage.DynamoDBStorage(dynamodb, "test-table")
+        self.assertIsNotNone(sut.acquire_refresh_lease("session-id", 0))
+        self.assertIsNotNone(sut.acquire_refresh_lease("session-id", 60))
+
+
+def tokens(expires_in: int):
+    return {
+        "id_token": "id_token",
+        "access_token": "access_token",
+        "refresh_token": "refresh_token",
+        "expiration": (
+            datetime.datetime.now(datetime.timezone.utc)
+            + datetime.timedelta(seconds=expires_in)
+        ).isoformat(),
+    }
+
+
+class TestCachedStorage(unittest.TestCase):
+    @moto.mock_aws
+    def test_get_tokens(self):
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="test-bucket")
+        storage = auth.storage.S3Storage(s3, "test-bucket")
+        storage.save_tokens("session-id", tokens(3600))
+        sut = auth.storage.CachedStorage(storage)
+        with unittest.mock.patch.object(
+            storage,
+            "get_tokens",
+            wraps=storage.get_tokens,
+        ) as get_tokens:
+            first = sut.get_tokens("session-id")
+            second = sut.get_tokens("session-id")
+        self.assertEqual(first, second)
+        get_tokens.assert_called_once_with("session-id")
+        self.assertEqual(1, sut.cache.stats()["hits"])
+
+    @moto.mock_aws
+    def test_get_tokens_when_expired(self):
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="test-bucket")
+        storage = auth.storage.S3Storage(s3, "test-bucket")
+        storage.save_tokens("session-id", tokens(-1))
+        sut = auth.storage.CachedStorage(storage)
+        sut.get_tokens("session-id")
+        self.assertEqual(0, len(sut.cache))
+
+    @moto.mock_aws
+    def test_save_tokens(self):
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="test-bucket")
+        storage = auth.storage.S3Storage(s3, "test-bucket")
+        sut = auth.storage.CachedStorage(storage)
+        sut.save_tokens("session-id", tokens(3600))
+        sut.get_tokens("session-id")
+        refreshed = dict(tokens(3600), access_token="refreshed")
+        sut.save_tokens("session-id", refreshed)
+        self.assertEqual(refreshed, sut.get_tokens("session-id"))
+        self.assertEqual(refreshed, storage.get_tokens("session-id"))
+
+    @moto.mock_aws
+    def test_delete_tokens(self):
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="test-bucket")
+        storage = auth.storage.S3Storage(s3, "test-bucket")
+        sut = auth.storage.CachedStorage(storage)
+        sut.save_tokens("session-id", tokens(3600))
+        sut.get_tokens("session-id")
+        sut.delete_tokens("session-id")
+        with self.assertRaises(auth.storage.DataNotFoundException):
+            sut.get_tokens("session-id")
+
+    @moto.mock_aws
+    def test_pop_tokens(self):
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="test-bucket")
+        storage = auth.storage.S3Storage(s3, "test-bucket")
+        sut = auth.storage.CachedStorage(storage)
+        sut.save_tokens("session-id", tokens(3600))
+        sut.get_tokens("session-id")
+        sut.pop_tokens("session-id")
+        with self.assertRaises(auth.storage.DataNotFoundException):
+            sut.get_tokens("session-id")
+
+    @moto.mock_aws
+    def test_delete_sessions(self):
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="test-bucket")
+        storage = auth.storage.S3Storage(s3, "test-bucket")
+        sut = auth.storage.CachedStorage(storage)
+        sut.save_tokens("session-1", tokens(3600))
+        sut.save_tokens("session-2", tokens(3600))
+        sut.delete_sessions(["session-1", "session-2"])
+        self.assertEqual(0, len(sut.cache))
+        with self.assertRaises(auth.storage.DataNotFoundException):
+            sut.get_tokens("session-1")
+
+    @moto.mock_aws
+    def test_get_tokens_when_unknown(self):
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="test-bucket")
+        storage = auth.storage.S3Storage(s3, "test-bucket")
+        sut = auth.storage.CachedStorage(storage, negative=LRUCache())
+        with unittest.mock.patch.object(
+            storage,
+            "get_tokens",
+            wraps=storage.get_tokens,
+        ) as get_tokens:
+            for _ in range(3):
+                with self.assertRaises(auth.storage.DataNotFoundException):
+                    sut.get_tokens("session-id")
+        get_tokens.assert_called_once_with("session-id")
+        self.assertEqual(2, sut.stats()["rejected_unknown"])
+
+        # a login with the id makes it known again
+        data = tokens(3600)
+        sut.save_tokens("session-id", data)
+        self.assertEqual(data, sut.get_tokens("session-id"))
+
+    @moto.mock_aws
+    def test_get_tokens_when_deleted(self):
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="test-bucket")
+        storage = auth.storage.S3Storage(s3, "test-bucket")
+        sut = auth.storage.CachedStorage(storage, negative=LRUCache())
+        sut.save_tokens("session-1", tokens(3600))
+        sut.save_tokens("session-2", tokens(3600))
+        sut.save_tokens("session-3", tokens(3600))
+        sut.pop_tokens("session-1")
+        sut.delete_sessions(["session-2", "session-3"])
+        with unittest.mock.patch.object(storage, "get_tokens") as get_tokens:
+            for session_id in ["session-1", "session-2", "session-3"]:
+                with self.assertRaises(auth.storage.DataNotFoundException):
+                    sut.get_tokens(session_id)
+            with self.assertRaises(auth.storage.DataNotFoundException):
+                sut.pop_tokens("session-1")
+        get_tokens.assert_not_called()
+        self.assertEqual(4, sut.stats()["rejected_unknown"])
+
+    def test_delete_tokens_when_failed(self):
+        data = tokens(3600)
+        storage = unittest.mock.MagicMock()
+        storage.get_tokens.return_value = data
+        storage.delete_tokens.side_effect = Exception("unavailable")
+        storage.pop_tokens.side_effect = Exception("unavailable")
+        storage.delete_sessions.side_effect = Exception("unavailable")
+        sut = auth.storage.CachedStorage(storage, negative=LRUCache())
+        for delete in [
+            lambda: sut.delete_tokens("session-id"),
+            lambda: sut.pop_tokens("session-id"),
+            lambda: sut.delete_sessions(["session-id"]),
+        ]:
+            with self.assertRaises(Exception):
+                delete()
+            # the session still exists, it is not taken for an unknown one
+            self.assertEqual(data, sut.get_tokens("session-id"))
+        self.assertEqual(0, sut.stats()["rejected_unknown"])
+
+    def test_get_tokens_when_malformed(self):
+        storage = unittest.mock.MagicMock()
+        sut = auth.storage.CachedStorage(
+            storage,
+            negative=LRUCache(),
+            validate=is_session_id,
+        )
+        for session_id in ["", "session-id", "A" * 64, "0" * 65]:
+            with self.subTest(session_id=session_id):
+                with self.assertRaises(auth.storage.DataNotFoundException):
+                    sut.get_tokens(session_id)
+                with self.assertRaises(auth.storage.DataNotFoundException):
+                    sut.pop_tokens(session_id)
+        storage.get_tokens.assert_not_called()
+        storage.pop_tokens.assert_not_called()
+        self.assertEqual(8, sut.stats()["rejected_malformed"])
+        # rejected before the negative cache is even looked up
+        self.assertEqual(0, sut.stats()["negative"]["misses"])
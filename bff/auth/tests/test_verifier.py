@@ -0,0 +1,91 @@
+import time
+import unittest
+
+import auth.verifier
+
+from .jwks import LocalJWKS
+
+
+class TestTokenVerifier(unittest.TestCase):
+    def setUp(self):
+        self.jwks = LocalJWKS().__enter__()
+        self.addCleanup(self.jwks.__exit__)
+
+    def verifier(self, **kwargs):
+        return auth.verifier.TokenVerifier(
+            self.jwks.issuer,
+            ["client-id"],
+            jwks_url=self.jwks.url,
+            **kwargs,
+        )
+
+    def test_verify(self):
+        sut = self.verifier()
+        claims = sut.verify(self.jwks.sign(), token_use="id")
+        self.assertEqual("user-id", claims["sub"])
+        sut.verify(self.jwks.sign(sub="other"))
+        self.assertEqual(1, self.jwks.requests)
+
+    def test_verify_access_token(self):
+        sut = self.verifier()
+        token = self.jwks.sign(
+            aud=None,
+            client_id="client-id",
+            token_use="access",
+        )
+        self.assertEqual("access", sut.verify(token)["token_use"])
+        with self.assertRaises(auth.verifier.InvalidTokenException):
+            sut.verify(token, token_use="id")
+
+    def test_verify_when_invalid(self):
+        sut = self.verifier()
+        now = int(time.time())
+        for token in [
+            "not a token",
+            self.jwks.sign(exp=now - 1),
+            self.jwks.sign(iss="https://example.com"),
+            self.jwks.sign(aud="other-client-id"),
+            self.jwks.sign()[:-4] + "AAAA",
+        ]:
+            with self.subTest(token=token):
+                with self.assertRaises(auth.verifier.InvalidTokenException):
+                    sut.verify(token)
+
+    def test_verify_when_keys_rotated(self):
+        now = [time.time()]
+        sut = self.verifier(min_refresh_interval=30, clock=lambda: now[0])
+        sut.verify(self.jwks.sign(exp=int(now[0]) + 3600))
+        self.jwks.rotate("key-2")
+        token = self.jwks.sign(exp=int(now[0]) + 3600)
+        with self.assertRaises(auth.verifier.InvalidTokenException):
+            sut.verify(token)
+        now[0] += 30
+        sut.verify(token)
+        self.assertEqual(2, self.jwks.requests)
+
+    def test_verify_when_ttl_expired(self):
+        now = [time.time()]
+        sut = self.verifier(ttl=60, clock=lambda: now[0])
+        token = self.jwks.sign(exp=int(now[0]) + 3600)
+        sut.verify(token)
+        now[0] += 59
+        sut.verify(token)
+        self.assertEqual(1, self.jwks.requests)
+        now[0] += 1
+        sut.verify(token)
+        self.assertEqual(2, self.jwks.requests)
+
+    def test_verify_when_key_set_unavailable(self):
+        sut = auth.verifier.TokenVerifier(
+            self.jwks.issuer,
+            ["client-id"],
+            jwks_url="http://127.0.0.1:1/.well-known/jwks.json",
+        )
+        with self.assertRaises(auth.verifier.KeySetUnavailableException):
+            sut.verify(self.jwks.sign())
+
+    def test_init_without_audience(self):
+        for audiences in [[], [""]]:
+            with self.subTest(audiences=audiences):
+                with self.assertRaises(ValueError):
+                    auth.verifier.TokenVerifier(self.jwks.issuer, audiences)
@@ -14,3 +14,5 @@ cd ${SCRIPT_DIR}/../api/contacts && poetry run black --check .
 cd ${SCRIPT_DIR}/../api/contacts && poetry run isort --check .
 cd ${SCRIPT_DIR}/../api/contacts && poetry run flake8
 cd ${SCRIPT_DIR}/../api/contacts && poetry run mypy .
+cd ${SCRIPT_DIR}/../bff/auth && poetry run python ../../scripts/importtime.py auth --budget-ms 150 --deny boto3 botocore jose requests
+cd ${SCRIPT_DIR}/../api/contacts && poetry run python ../../scripts/importtime.py contacts --budget-ms 200 --deny boto3 botocore jose
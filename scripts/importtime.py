@@ -0,0 +1,103 @@
+"""Cold import time of a Lambda package, attributed per module.
+
+Imports the package in fresh interpreters with ``python -X importtime`` and
+reports the median time of the modules it pulled in. Fails when the cold
+import takes longer than the budget or pulls in a module that should only
+be imported by the routes that need it. Run it from the project directory
+with the interpreter of the project:
+
+    poetry run python ../../scripts/importtime.py auth --budget-ms 150 \\
+        --deny boto3 jose requests
+
+Modules already imported by the interpreter startup (site, .pth files) are
+not attributed to the package.
+"""
+
+import argparse
+import collections
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$")
+
+
+def profile(module):
+    """Return {name: (self us, cumulative us)} of one cold import."""
+    # a clean environment, PYTHONPATH and friends would change what loads
+    env = {k: v for k, v in os.environ.items() if not k.startswith("PYTHON")}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        env=env,
+        check=True,
+    )
+    lines = [LINE.match(line) for line in result.stderr.splitlines()]
+    entries = [
+        (m.group(4), len(m.group(3)), int(m.group(1)), int(m.group(2)))
+        for m in lines
+        if m is not None
+    ]
+    # the output is in post-order, the package comes after its imports
+    root = max(i for i, entry in enumerate(entries) if entry[0] == module)
+    depth = entries[root][1]
+    start, end = root, root + 1
+    while start > 0 and entries[start - 1][1] > depth:
+        start -= 1
+    return {
+        name: (self_us, cumulative_us)
+        for name, _, self_us, cumulative_us in entries[start:end]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("module")
+    parser.add_argument("-n", "--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float)
+    parser.add_argument("--deny", nargs="*", default=[])
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    # the first run writes the bytecode caches, it is not a cold start
+    profile(args.module)
+    runs = [profile(args.module) for _ in range(args.runs)]
+
+    names = set().union(*runs)
+    self_ms = {
+        name: statistics.median(run.get(name, (0, 0))[0] for run in runs)
+        / 1000
+        for name in names
+    }
+    total = statistics.median(run[args.module][1] for run in runs) / 1000
+
+    packages: dict[str, float] = collections.defaultdict(float)
+    for name, ms in self_ms.items():
+        packages[name.split(".")[0]] += ms
+
+    print(f"{args.module}: {total:.1f} ms cold import (median of {args.runs})")
+    print("\nby package (self time):")
+    for name, ms in sorted(packages.items(), key=lambda x: -x[1])[: args.top]:
+        print(f"  {ms:8.1f} ms  {name}")
+    print("\nby module (self time):")
+    for name, ms in sorted(self_ms.items(), key=lambda x: -x[1])[: args.top]:
+        print(f"  {ms:8.1f} ms  {name}")
+
+    failures = []
+    if args.budget_ms is not None and total > args.budget_ms:
+        failures.append(
+            f"{total:.1f} ms is over the budget of {args.budget_ms:.1f} ms",
+        )
+    for name in args.deny:
+        if any(n == name or n.startswith(f"{name}.") for n in names):
+            failures.append(f"{name} is imported on cold start")
+    for failure in failures:
+        print(f"FAIL: {args.module}: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
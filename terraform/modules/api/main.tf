@@ -43,6 +43,42 @@ data "aws_iam_policy_document" "contacts_policy" {
       "arn:aws:rds-db:${data.aws_region.current.name}:${data.aws_caller_identity.current.account_id}:dbuser:${var.db_resource_id}/contacts_api"
     ]
   }
+  statement {
+    effect = "Allow"
+    actions = [
+      "s3:GetObject",
+      "s3:PutObject",
+      "s3:AbortMultipartUpload"
+    ]
+    resources = [
+      "${aws_s3_bucket.contacts_import.arn}/*"
+    ]
+  }
+}
+
+resource "aws_s3_bucket" "contacts_import" {
+  bucket = "${var.env_code}-s3-contacts-import-${data.aws_caller_identity.current.account_id}"
+}
+
+resource "aws_s3_bucket_public_access_block" "contacts_import_pab" {
+  bucket = aws_s3_bucket.contacts_import.id
+
+  block_public_acls       = true
+  block_public_policy     = true
+  ignore_public_acls      = true
+  restrict_public_buckets = true
+}
+
+resource "aws_s3_bucket_lifecycle_configuration" "contacts_import" {
+  bucket = aws_s3_bucket.contacts_import.id
+  rule {
+    id     = "expire-imports"
+    status = "Enabled"
+    filter {}
+    expiration {
+      days = 7
+    }
+  }
 }
 
 resource "aws_iam_role" "contacts_role" {
@@ -77,6 +113,15 @@ resource "aws_security_group_rule" "contacts" {
   to_port                  = 5432
 }
 
+resource "aws_security_group_rule" "contacts_https" {
+  security_group_id = aws_security_group.contacts.id
+  type              = "egress"
+  cidr_blocks       = ["0.0.0.0/0"]
+  protocol          = "tcp"
+  from_port         = 443
+  to_port           = 443
+}
+
 resource "aws_security_group_rule" "db_from_contacts" {
   security_group_id        = var.db_security_group_id
   type                     = "ingress"
@@ -93,9 +138,12 @@ resource "aws_lambda_function" "contacts" {
   source_code_hash = data.local_file.contacts_zip.content_md5
   runtime          = "python3.11"
   handler          = "contacts.handler"
+  timeout          = 29
   environment {
     variables = {
-      DB_HOST = var.db_host
+      DB_HOST       = var.db_host
+      IMPORT_BUCKET = aws_s3_bucket.contacts_import.id
+      EXPORT_BUCKET = aws_s3_bucket.contacts_import.id
     }
   }
   vpc_config {
@@ -128,6 +176,30 @@ resource "aws_apigatewayv2_route" "contacts" {
   target             = "integrations/${aws_apigatewayv2_integration.contacts.id}"
 }
 
+locals {
+  contacts_routes = {
+    Createcontact   = "POST /contacts"
+    Importcontacts  = "POST /contacts/import"
+    Exportcontacts  = "POST /contacts/export"
+    Batchcontacts   = "POST /contacts/batch"
+    Getchanges      = "GET /contacts/changes"
+    Getcontact      = "GET /contacts/{id}"
+    Updatecontact   = "PATCH /contacts/{id}"
+    Deletecontact   = "DELETE /contacts/{id}"
+    Favoritecontact = "PUT /contacts/{id}/favorite"
+  }
+}
+
+resource "aws_apigatewayv2_route" "contacts_item" {
+  for_each           = local.contacts_routes
+  api_id             = aws_apigatewayv2_api.api.id
+  operation_name     = each.key
+  route_key          = each.value
+  authorization_type = "JWT"
+  authorizer_id      = aws_apigatewayv2_authorizer.cognito_authorizer.id
+  target             = "integrations/${aws_apigatewayv2_integration.contacts.id}"
+}
+
 resource "aws_apigatewayv2_stage" "default" {
   api_id      = aws_apigatewayv2_api.api.id
   name        = "$default"
@@ -17,6 +17,29 @@ resource "aws_s3_bucket_public_access_block" "session_storage_pab" {
   restrict_public_buckets = true
 }
 
+resource "aws_dynamodb_table" "session_storage" {
+  name         = "${var.env_code}-dynamodb-session-storage"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "pk"
+
+  attribute {
+    name = "pk"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+}
+
+# the value, {"state_key": "<base64url of 32 random bytes>",
+# "session_keys": ["<base64url of 32 random bytes>", ...]}, is put out of
+# band so the keys never land in the terraform state
+resource "aws_secretsmanager_secret" "auth_keys" {
+  name = "${var.env_code}/serverless-app/auth-keys"
+}
+
 data "aws_iam_policy_document" "assume_role_lambda" {
   statement {
     effect = "Allow"
@@ -41,7 +64,8 @@ data "aws_iam_policy_document" "auth_role_policy" {
       "secretsmanager:GetSecretValue"
     ]
     resources = [
-      "arn:aws:secretsmanager:${data.aws_region.current.name}:${data.aws_caller_identity.current.account_id}:secret:${var.env_code}/serverless-app/api-client-*"
+      "arn:aws:secretsmanager:${data.aws_region.current.name}:${data.aws_caller_identity.current.account_id}:secret:${var.env_code}/serverless-app/api-client-*",
+      aws_secretsmanager_secret.auth_keys.arn
     ]
   }
   statement {
@@ -67,6 +91,19 @@ data "aws_iam_policy_document" "auth_role_policy" {
       "${aws_s3_bucket.session_storage.arn}/*"
     ]
   }
+  statement {
+    effect = "Allow"
+    actions = [
+      "dynamodb:GetItem",
+      "dynamodb:PutItem",
+      "dynamodb:UpdateItem",
+      "dynamodb:DeleteItem",
+      "dynamodb:BatchWriteItem"
+    ]
+    resources = [
+      aws_dynamodb_table.session_storage.arn
+    ]
+  }
 }
 
 resource "aws_iam_role_policy" "auth_role_policy" {
@@ -88,10 +125,13 @@ resource "aws_lambda_function" "auth" {
   timeout          = 59
   environment {
     variables = {
-      "S3_BUCKET"                = aws_s3_bucket.session_storage.bucket
-      "COGNITO_USER_POOL_ID"     = var.cognito_user_pool_id
-      "COGNITO_USER_POOL_DOMAIN" = var.cognito_user_pool_domain
-      "API_CLIENT_SECRET_ID"     = "${var.env_code}/serverless-app/api-client"
+      "S3_BUCKET"                 = aws_s3_bucket.session_storage.bucket
+      "DYNAMODB_TABLE"            = aws_dynamodb_table.session_storage.name
+      "COGNITO_USER_POOL_ID"      = var.cognito_user_pool_id
+      "COGNITO_USER_POOL_DOMAIN"  = var.cognito_user_pool_domain
+      "API_CLIENT_SECRET_ID"      = "${var.env_code}/serverless-app/api-client"
+      "OAUTH_STATE_KEY_SECRET_ID" = aws_secretsmanager_secret.auth_keys.name
+      "SESSION_KEYS_SECRET_ID"    = aws_secretsmanager_secret.auth_keys.name
     }
   }
 }